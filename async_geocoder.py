@@ -0,0 +1,171 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from geopy.location import Location
+
+from instrumentation import report_error
+
+
+##########################
+# Token bucket           #
+##########################
+
+# Raises ValueError unless the bucket refills (rate above 0) and holds at least one token
+def check_bucket_options(rate, capacity):
+    if not rate > 0:
+        raise ValueError("Token bucket rate must be above 0 calls per second, got " + str(rate))
+    if not capacity >= 1:
+        raise ValueError("Token bucket capacity must be at least 1 call, got " + str(capacity))
+
+
+# Token bucket allowing rate calls per second on average, with bursts of up to capacity calls.
+# It is shared by all the geocoding tasks of one event loop. clock gives the time in seconds and sleep waits,
+# they can be replaced by a fake clock in tests
+def token_bucket(rate, capacity=1, clock=time.monotonic, sleep=asyncio.sleep):
+    check_bucket_options(rate, capacity)
+    return {"rate": rate, "capacity": capacity, "tokens": capacity, "updated": clock(), "clock": clock,
+            "sleep": sleep, "lock": asyncio.Lock()}
+
+
+# Wait until the bucket has a token and take it. Waiting tasks take tokens one after another in the order they came
+async def take_token(bucket):
+    async with bucket["lock"]:
+        while True:
+            now = bucket["clock"]()
+            bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+            bucket["updated"] = now
+            if bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                return
+            await bucket["sleep"]((1 - bucket["tokens"]) / bucket["rate"])
+
+
+##########################
+# Async geocoding client #
+##########################
+
+# Response status codes of a busy or failing server, which are retried
+retry_status = [429, 500, 502, 503, 504]
+
+
+# Nominatim search url of a city name
+def search_url(base_url, city_name, country_codes="il"):
+    query = urllib.parse.urlencode({"q": city_name, "format": "json", "limit": 1, "countrycodes": country_codes})
+    return base_url.rstrip("/") + "/search?" + query
+
+
+# Blocking http get of a json response, run by the worker threads of the client
+def fetch_json(url, timeout, user_agent):
+    request = urllib.request.Request(url, headers={"User-Agent": user_agent})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+# Geopy location of the first search result, None if nothing was found
+def search_location(results):
+    if results == []:
+        return None
+    place = results[0]
+    return Location(place.get("display_name"), (float(place["lat"]), float(place["lon"]), 0.0), place)
+
+
+# Seconds to wait before a retry - exponential backoff with jitter, or the server's Retry-After if it is longer
+def retry_delay(error, attempt, backoff):
+    delay = backoff * 2 ** attempt * (1 + random.random())
+    if isinstance(error, urllib.error.HTTPError):
+        try:
+            delay = max(delay, float(error.headers.get("Retry-After", 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+# Geocode one city, each attempt takes a token from the bucket.
+# Connection errors, timeouts and retry_status responses are retried, other errors are raised
+async def geocode_city(city_name, options, bucket, executor):
+    loop = asyncio.get_running_loop()
+    url = search_url(options["url"], city_name)
+    for attempt in range(options["retries"] + 1):
+        await take_token(bucket)
+        try:
+            results = await loop.run_in_executor(executor, fetch_json, url, options["timeout"], options["user_agent"])
+            return search_location(results)
+        except OSError as e:  # urllib errors and timeouts
+            if (isinstance(e, urllib.error.HTTPError) and e.code not in retry_status) or attempt == options["retries"]:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt, options["backoff"]))
+
+
+# Geocode cities with up to options["concurrency"] requests at a time, putting (city name, location) pairs on the
+# results queue as they arrive. Cities which failed after all retries are reported and not put on the queue
+async def geocode_cities(city_names, options, results):
+    bucket = token_bucket(options["rate"], options["burst"])
+    semaphore = asyncio.Semaphore(options["concurrency"])
+
+    async def geocode_one(city_name, executor):
+        async with semaphore:
+            try:
+                location = await geocode_city(city_name, options, bucket, executor)
+            except Exception as e:
+                report_error("Geocoding failed for " + str(city_name), e)
+                return
+            results.put((city_name, location))
+
+    with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+        await asyncio.gather(*[geocode_one(city_name, executor) for city_name in city_names])
+
+
+# Geocoder (see geoloc_for_map) calling a self-hosted Nominatim compatible server at url.
+# Calls are limited to rate per second (bursts of up to burst calls), with up to concurrency calls at a time,
+# and failed calls are retried up to retries times with exponential backoff from backoff seconds.
+# The event loop runs in a background thread, and cities are yielded as soon as they are geocoded
+def async_geocoder(url="http://localhost:8080", rate=1, burst=1, concurrency=4, retries=3, backoff=1.0, timeout=4,
+                   user_agent="myGeocoder"):
+    check_bucket_options(rate, burst)  # Checked here, errors in the event loop thread would only end the results
+    options = {"url": url, "rate": rate, "burst": burst, "concurrency": concurrency, "retries": retries,
+               "backoff": backoff, "timeout": timeout, "user_agent": user_agent}
+
+    def geocoder(city_names):
+        results = queue.Queue()
+
+        def run_loop():
+            try:
+                asyncio.run(geocode_cities(city_names, options, results))
+            finally:
+                results.put(None)  # End of results
+
+        thread = threading.Thread(target=run_loop, daemon=True)
+        thread.start()
+        for result in iter(results.get, None):
+            yield result
+        thread.join()
+
+    return geocoder
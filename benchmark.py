@@ -0,0 +1,200 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import generators
+import visualize
+from data_cleaning import data_cleaning, data_value_cleaining, shorten_product_name
+from data_conversion import save_conversion_schema
+from geoloc_for_map import gazetteer_geocoder
+from instrumentation import frame_mb
+from load_data import data_cache_key, load_data_from_cache
+from output_paths import set_output_root
+from register_columns import analysis_columns, ingestion_dtypes
+from synthetic_data import prtr_columns, write_synthetic_csv
+
+####################
+# Stage benchmarks #
+####################
+
+'''
+Runs the analysis stages on synthetic register data (synthetic_data.py) of growing size and records, for each size
+and stage, wall time, CPU time, peak memory allocated by Python and numpy (tracemalloc) and the number of rows.
+Results are saved as json, with the scaling exponent of each stage (slope of log time over log rows).
+Memory tracing slows the stages, run with trace_memory=False for timing only.
+Charts are rendered headless into a temporary output folder, cities are geocoded by the local gazetteer.
+The chart stages are slow at any size (shotgun renders over a hundred figures), chart_stages selects the ones to run.
+CPU time and memory are of this process, shotgun chart workers are not included.
+Peak memory is allocated in the stage only, the stages after the emission cube also record the memory of the data
+they work on (data_mb), so the peak can be compared to the size of the data.
+'''
+
+data_stages = ["generate", "cleaning", "load_cache", "value_cleaning", "labels", "emission_cube"]
+chart_stages = ["waste", "accident_analysis", "shotgun", "geo_maps"]
+
+
+# Conversion schema which keeps all columns, so cleaning runs without the dialog
+def write_benchmark_schema(schema_file_name):
+    schema = {col: "unchanged" for col in prtr_columns}
+    schema["ShnatDivuach"] = "int"
+    save_conversion_schema(schema=schema, schema_file_name=schema_file_name)
+    return schema_file_name
+
+
+# Runs function(**kwargs) as one stage of row_count rows and appends its measures to results. Errors are recorded, not raised.
+# data_mb is the memory of the data the stage works on, recorded with its peak
+def measure_stage(results, stage, row_count, function, trace_memory=True, data_mb=None, **kwargs):
+    print("Benchmark: %s, %d rows" % (stage, row_count))
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = None
+    error = None
+    try:
+        result = function(**kwargs)
+    except Exception as e:
+        print("Error during benchmark stage " + stage)
+        print(e)
+        error = repr(e)
+    record = {"stage": stage, "rows": row_count, "wall_seconds": time.perf_counter() - wall_start,
+              "cpu_seconds": time.process_time() - cpu_start, "peak_mb": None, "data_mb": data_mb, "error": error}
+    if trace_memory:
+        record["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    results.append(record)
+    return result
+
+
+# Shorten and mirror the Hebrew labels as main does before the charts
+def label_stage(data):
+    data = shorten_product_name(dataframe=data, product_col="TchumPeilutAtarSvivati")
+    visualize.correct_heb_mirror_values(dataframe=data,
+                                        cols=["SugPeilutAtarSvivati", "TchumPeilutAtarSvivati", "AnafAtarSvivati"],
+                                        how_short=40)
+    return data
+
+
+# Shotgun charts of both activity columns, as main does
+def shotgun_stage(data, cube, workers):
+    for x_val_col in ["SugPeilutAtarSvivati", "TchumPeilutAtarSvivati"]:
+        generators.accidents_non_accidents_shotgun(data=data, x_val_col=x_val_col, is_log=False, workers=workers,
+                                                   cube=cube)
+
+
+# Runs the stages on rows synthetic rows in work_folder and returns the stage records.
+# chart_stages are the chart stages to run, the data stages always run. Shotgun workers are all CPUs if None
+def run_benchmark(rows, work_folder, seed=0, workers=None, trace_memory=True, cutoffs=(1, 5, 10),
+                  chart_stages=chart_stages):
+    results = []
+    csv_file_name = os.path.join(work_folder, "MIFLAS_synthetic.csv")
+    schema_file_name = write_benchmark_schema(os.path.join(work_folder, "conversion_schema.json"))
+    set_output_root(os.path.join(work_folder, "Output_files"))
+    cache_folder = os.path.join(work_folder, "Output_files", "cache")
+    os.makedirs(cache_folder, exist_ok=True)
+
+    measure_stage(results, "generate", rows, write_synthetic_csv, trace_memory=trace_memory,
+                  file_name=csv_file_name, rows=rows, seed=seed)
+    cleaning_config = {"cleaning_version": "benchmark", "usecols": analysis_columns,
+                       "column_dtypes": ingestion_dtypes}
+    cache_key = data_cache_key(source_file_name=csv_file_name, cleaning_config=cleaning_config)
+    measure_stage(results, "cleaning", rows, data_cleaning, trace_memory=trace_memory, file_to_load=csv_file_name,
+                  cache_name="cleanData", cache_key=cache_key, cleaning_config=cleaning_config,
+                  output_folder_name=cache_folder, usecols=analysis_columns, column_dtypes=ingestion_dtypes,
+                  chunksize=100000, schema_file_name=schema_file_name)
+    data = measure_stage(results, "load_cache", rows, load_data_from_cache, trace_memory=trace_memory,
+                         cache_name="cleanData", cache_key=cache_key, output_folder_name=cache_folder,
+                         columns=analysis_columns)
+    data = measure_stage(results, "value_cleaning", rows, data_value_cleaining, trace_memory=trace_memory,
+                         all_data=data)
+    data = measure_stage(results, "labels", rows, label_stage, trace_memory=trace_memory, data=data)
+    data_mb = frame_mb(data)
+    cube = measure_stage(results, "emission_cube", rows, generators.emission_cube, trace_memory=trace_memory,
+                         data_mb=data_mb, data=data)
+    if "waste" in chart_stages:
+        measure_stage(results, "waste", rows, generators.waste, trace_memory=trace_memory, data_mb=data_mb,
+                      data=data)
+    if "accident_analysis" in chart_stages:
+        measure_stage(results, "accident_analysis", rows, generators.outlier_sweep, trace_memory=trace_memory,
+                      data_mb=data_mb, data=data, cutoffs=list(cutoffs), cube=cube)
+    if "shotgun" in chart_stages:
+        measure_stage(results, "shotgun", rows, shotgun_stage, trace_memory=trace_memory, data_mb=data_mb,
+                      data=data, cube=cube, workers=workers)
+    if "geo_maps" in chart_stages:
+        measure_stage(results, "geo_maps", rows, generators.industry_geoloc, trace_memory=trace_memory,
+                      data_mb=data_mb, data=data,
+                      city_col="YeshuvAtarSvivatiMenifa", industry_col="AnafAtarSvivati",
+                      pivot_by="YeshuvAtarSvivatiMenifa", values="AnafAtarSvivati", geocoder=gazetteer_geocoder(),
+                      store_file_name=os.path.join(work_folder, "city_geocodes.json"))
+    return results
+
+
+# Scaling exponent of each stage, the slope of log wall time over log rows (1 is linear)
+def scaling_exponents(results):
+    table = pd.DataFrame(results)
+    table = table.loc[table["error"].isnull() & (table["wall_seconds"] > 0)]
+    exponents = {}
+    for stage, stage_table in table.groupby("stage", sort=False):
+        if stage_table["rows"].nunique() > 1:
+            slope = np.polyfit(np.log(stage_table["rows"]), np.log(stage_table["wall_seconds"]), 1)[0]
+            exponents[stage] = float(slope)
+    return exponents
+
+
+# Runs the benchmark for each size and saves the results as json. Work files are removed unless keep_files.
+def benchmark_suite(sizes=(10 ** 4, 10 ** 5), results_file_name="benchmark_results.json", work_root=None, seed=0,
+                    workers=None, trace_memory=True, keep_files=False, chart_stages=chart_stages):
+    visualize.set_headless_mode(figure_size=(19.2, 10.8), dpi=100)
+    results = []
+    for rows in sizes:
+        work_folder = tempfile.mkdtemp(prefix="prtr_benchmark_%d_" % rows, dir=work_root)
+        try:
+            results += run_benchmark(rows=rows, work_folder=work_folder, seed=seed, workers=workers,
+                                     trace_memory=trace_memory, chart_stages=chart_stages)
+        finally:
+            if not keep_files:
+                shutil.rmtree(work_folder, ignore_errors=True)
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "pandas": pd.__version__, "numpy": np.__version__,
+                        "seed": seed, "workers": workers, "trace_memory": trace_memory},
+        "sizes": list(sizes),
+        "stages": data_stages + list(chart_stages),
+        "results": results,
+        "scaling_exponents": scaling_exponents(results)
+    }
+    with open(results_file_name, "w", encoding="utf-8") as file1:
+        json.dump(report, file1, indent=1)
+    print("Benchmark results saved to " + results_file_name)
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_suite(sizes=[10 ** 4, 10 ** 5])
@@ -17,14 +17,16 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
+import functools
 import os
 
 import numpy as np
 import pandas as pd
 
 import data_conversion as dataconv
-from load_data import load_data_from_csv
-from save_data import save_as_pickel
+from instrumentation import annotate_span, traced
+from load_data import data_cache_key, load_data_from_csv, load_data_from_csv_chunked, schema_cleaning_config
+from save_data import save_as_pickel, save_to_cache
 
 
 # Returns column names with high number of unique values and ones with lower,
@@ -46,45 +48,38 @@ def value_variability_check(dataframe, low_medium_variable_cutoff, medium_high_v
     return dataframe_value_dict, variable_columns, highly_variable_columns
 
 
-## Recursively finds the distinct values in a column,
-## then separates the dataframe with the first value.
-## and continues until each value has a new dataframe.
-## Returns the list of sperate dataframes as well as the values
-## used for separation.
-def two_group_separator(dataframe, col, dataframes_list, rename_df=True):
-    values = pd.unique(dataframe[col])
-    if len(values) > 1:
-        with_value = np.array(values[0] == dataframe[col])
-        without_value = ~with_value
-        df_with_value = dataframe.loc[with_value, :]
-        df_without_value = dataframe.loc[without_value, :]
-        # df_with_value = df_with_value.rename_axis(values[0], axis=1)
-        if rename_df:
-            df_with_value.name = values[0]
-        else:
-            df_with_value.name = dataframe.name
-        dataframes_list.append(df_with_value)
-        df = two_group_separator(df_without_value, col, dataframes_list)
-    else:
-        dataframes_list.append(dataframe)
+## Finds the distinct values in a column and the row positions of each value, in one pass.
+## Values are returned in order of appearance, rows with NaN values are not assigned to any value.
+def column_value_positions(dataframe, col):
+    codes, values = pd.factorize(dataframe[col], sort=False)
+    order = np.argsort(codes, kind="stable")  # Rows grouped by value, NaN rows (code -1) first
+    counts = np.bincount(codes[codes >= 0], minlength=len(values))
+    starts = np.count_nonzero(codes < 0) + np.cumsum(counts) - counts
+    positions = [order[start:start + count] for start, count in zip(starts, counts)]
+    return values, positions
+
+
+## Yields a separate dataframe for each value in the column, selected by row positions only when it is reached.
+## Each dataframe is named by its value, or keeps the name of the original dataframe.
+def dataframe_partitions(dataframe, values, positions, rename_df=True):
+    for value, rows in zip(values, positions):
+        df_with_value = dataframe.iloc[rows]
         if rename_df:
-            dataframe.name = values[0]
+            df_with_value.name = value
         else:
-            dataframe.name = dataframe.name
-        return dataframes_list
-    return df
-
-
-## Takes a dataframe and returns a seperate dataframe for each value in the specified column
-def dataframe_by_column_value_separator(dataframe, col, rename_df=True):
-    dataframes_list = []
-    data_frame = pd.DataFrame()
-    values = pd.unique(dataframe[col])
-    if len(values) > 1:
-        two_group_separator(dataframe, col, dataframes_list, rename_df)
-        return dataframes_list, values
-    else:
-        return dataframe, values
+            df_with_value.name = getattr(dataframe, "name", None)
+        yield df_with_value
+
+
+## Takes a dataframe and returns a seperate dataframe for each value in the specified column,
+## as well as the values used for separation. If lazy the dataframes are returned as a generator.
+## The dataframes are a list even for a single value, and rows with NaN in the column are in none of them.
+def dataframe_by_column_value_separator(dataframe, col, rename_df=True, lazy=False):
+    values, positions = column_value_positions(dataframe, col)
+    dataframes = dataframe_partitions(dataframe, values, positions, rename_df)
+    if lazy:
+        return dataframes, values
+    return list(dataframes), values
 
 
 # Searches if all values are in a given list
@@ -128,21 +123,35 @@ def values_which_are_in_list(dict_of_lists, value_list):
             return result_dict
 
 
+## Parses values as numbers after removing thousands separators, values which are not numbers become NaN
+def parse_numbers(values):
+    text = pd.Series(np.asarray(values, dtype=object)).astype(str)
+    return pd.to_numeric(text.str.replace(",", "", regex=False), errors="coerce")
+
+
+## Scans a df column for values which are not numbers, in one pass over the distinct values.
+## Returns the column as numbers (NaN for non numbers) and a table with each non number value,
+## its count and its row positions.
+def scan_numeric_column(series):
+    codes, uniques = pd.factorize(series)
+    unique_numbers = parse_numbers(uniques).to_numpy(dtype=np.float64)
+    numbers = np.append(unique_numbers, np.nan)[codes]  # Code -1 (NaN) maps to the last element
+
+    non_number_codes = np.flatnonzero(np.isnan(unique_numbers))
+    non_number_rows = np.flatnonzero(np.isin(codes, non_number_codes))
+    non_number_rows = non_number_rows[np.argsort(codes[non_number_rows], kind="stable")]
+    counts = np.bincount(codes[non_number_rows], minlength=len(uniques))[non_number_codes]
+    positions = np.split(non_number_rows, np.cumsum(counts)[:-1]) if len(counts) > 0 else []
+    non_numbers = pd.DataFrame({"value": np.asarray(uniques, dtype=object)[non_number_codes], "count": counts,
+                                "positions": positions})
+    return numbers, non_numbers
+
+
 ## Finds the values which are non numbers in a df column
 ## reutrns the values in a list form
 def find_non_number_values_in_column(series):
-    non_num_values = []
-    for entry in pd.unique(series):
-        try:
-            entry = entry.replace(',', '')
-        except AttributeError:
-            if isinstance(entry, str):
-                non_num_values.append(entry)
-        try:
-            float(entry)
-        except ValueError:
-            non_num_values.append(entry)
-    return non_num_values
+    numbers, non_numbers = scan_numeric_column(series)
+    return list(non_numbers["value"])
 
 
 ## Finds the values which are non numbers in several df columns
@@ -156,13 +165,26 @@ def find_non_number_values_in_columns(dataframe, col_list):
     return values_dict
 
 
+## Removes thousands separators, finds non number values and converts to float in one pass per column.
+## Non number values become NaN, they are returned in a dictionary of tables (see scan_numeric_column),
+## one key for each column which has them
+def convert_numeric_columns(dataframe, col_list):
+    non_numbers_dict = {}
+    for col in col_list:
+        if col in dataframe.columns:
+            numbers, non_numbers = scan_numeric_column(dataframe[col])
+            dataframe[col] = pd.to_numeric(numbers, downcast="float")
+            if len(non_numbers) > 0:
+                non_numbers_dict[col] = non_numbers
+    return dataframe, non_numbers_dict
+
+
 # Removes comma from numbers
 def comma_removal(dataframe, columns):
     comma_removed_from_col = []
     for col in columns:
-        if (col in dataframe.columns) and (dataframe[col].dtype == np.object):
-            dataframe.loc[dataframe[col].isnull(), col] = "נתון לא זמין"
-            dataframe[col] = dataframe[col].map(lambda x: x.replace(",", ""))
+        if (col in dataframe.columns) and (dataframe[col].dtype == object):
+            dataframe[col] = dataframe[col].fillna("נתון לא זמין").str.replace(",", "", regex=False)
             comma_removed_from_col.append(col)
     return dataframe, comma_removed_from_col
 
@@ -175,249 +197,352 @@ def convert_to_numeric(dataframe, column_list):
     return dataframe
 
 
-# Corrects Nans and specific emission column data
-def data_value_cleaining(all_data):
-    # Emission accidental/non accidental column
-    all_data["KamutPlitaLoBeTeunot"] = 0
-
-    # df_categories, variable_columns, highly_variable_columns = value_variability_check(dataframe=all_data,
-    #                                                                                    low_medium_variable_cutoff=20,
-    #                                                                                    medium_high_variable_cutoff=200)
+###################################
+# Emission sentinel value engine  #
+###################################
+
+# Text values used in the emission columns instead of numbers, and the class of value they mark.
+# A new sentinel value only needs to be added here.
+emission_sentinel_classes = {
+    'פליטה נמוכה מכמות הסף': "too_low",
+    'הזרמה נמוכה מכמות הסף': "too_low",
+    'לא נפלט בתקלה': "non_accident",
+    'לא הוזרם בתקלה': "non_accident",
+    "נתון לא זמין": "unavailable"
+}
+# Empty values are unavailable, other text values are unrecognized. Both are treated as a missing number.
+emission_value_classes = ["numeric", "too_low", "non_accident", "unavailable", "unrecognized"]
+
+# State of a row by the class of total emission (KamutPlita) and accident emission (KamutPlitaBeTeunot).
+# "*" matches any class, rows matching no rule are in the "numeric" state.
+emission_state_rules = {
+    ("too_low", "too_low"): "both_below_threshold",
+    ("too_low", "non_accident"): "below_threshold_not_in_accident",
+    ("too_low", "*"): "below_threshold",
+    ("*", "too_low"): "accident_below_threshold",
+    ("*", "non_accident"): "not_in_accident"
+}
+
+# Effect of each state: (total emission kept, accident emission kept, non accidental emission, Accidental flag).
+# Non accidental emission is 0, NaN or the total emission.
+# Rows below threshold and not emitted in malfunction are not Accidental, as rows not emitted in malfunction above
+# threshold are not (the baseline masks flagged them Accidental, as the other rows below threshold)
+emission_state_effects = {
+    "numeric": (True, True, "zero", np.nan),
+    "both_below_threshold": (False, False, "nan", True),
+    "below_threshold_not_in_accident": (False, False, "nan", False),
+    "below_threshold": (False, False, "nan", True),
+    "accident_below_threshold": (True, False, "total", True),
+    "not_in_accident": (True, False, "total", False)
+}
+emission_states = list(emission_state_effects.keys())
+
+
+# Builds the table of state codes indexed by [total emission class code, accident emission class code]
+def emission_state_table():
+    table = np.zeros((len(emission_value_classes), len(emission_value_classes)), dtype=np.int8)
+    for total_code, total_class in enumerate(emission_value_classes):
+        for accident_code, accident_class in enumerate(emission_value_classes):
+            state = emission_state_rules.get((total_class, accident_class),
+                                             emission_state_rules.get((total_class, "*"),
+                                                                      emission_state_rules.get(("*", accident_class),
+                                                                                               "numeric")))
+            table[total_code, accident_code] = emission_states.index(state)
+    return table
+
+
+# Classifies each value of an emission column and parses it as a number (thousands separator removed).
+# Work is done on the distinct values only, then spread to the rows by their codes.
+# Returns the class code and the number of each row, and the unrecognized text values.
+def classify_emission_values(series):
+    codes, uniques = pd.factorize(series)
+    unique_values = pd.Series(np.asarray(uniques, dtype=object))
+    unique_numbers = parse_numbers(unique_values)
+    unique_classes = unique_values.map(emission_sentinel_classes)
+    unique_classes[unique_classes.isnull() & unique_numbers.isnull()] = "unrecognized"
+    unique_classes = unique_classes.fillna("numeric")
+    unique_class_codes = unique_classes.map(emission_value_classes.index).to_numpy(dtype=np.int8)
+
+    # Code -1 (NaN) maps to the last element, an unavailable value
+    row_classes = np.append(unique_class_codes, emission_value_classes.index("unavailable"))[codes]
+    row_numbers = np.append(unique_numbers.to_numpy(dtype=np.float64), np.nan)[codes]
+    unrecognized_values = list(unique_values[unique_classes == "unrecognized"])
+    return row_classes, row_numbers, unrecognized_values
+
+
+# Resolves emission sentinel values in one pass. Each row is classified into a state, which gives
+# numeric total, accident and non accident emissions and the Accidental flag.
+# Returns the four columns and the number of rows in each state. Unrecognized text values, treated as missing,
+# are recorded in the trace by column
+def resolve_emission_sentinels(total_emission, accident_emission):
+    total_classes, total, unrecognized_total = classify_emission_values(total_emission)
+    accident_classes, accident, unrecognized_accident = classify_emission_values(accident_emission)
+    unrecognized_values = {str(col_name): [str(value) for value in unrecognized]
+                           for col_name, unrecognized in ((total_emission.name, unrecognized_total),
+                                                          (accident_emission.name, unrecognized_accident))
+                           if unrecognized != []}
+    if unrecognized_values != {}:
+        annotate_span(unrecognized_emission_values=unrecognized_values)
+
+    states = emission_state_table()[total_classes, accident_classes]
+    effects = list(zip(*emission_state_effects.values()))
+    keep_total = np.array(effects[0])[states]
+    keep_accident = np.array(effects[1])[states]
+    non_accident_rule = np.array(effects[2])[states]
+    accidental = np.array(effects[3], dtype=object)[states]
+
+    total = np.where(keep_total, total, np.nan)
+    accident = np.where(keep_accident, accident, np.nan)
+    non_accident = np.select([non_accident_rule == "zero", non_accident_rule == "total"], [0, total], np.nan)
+    state_counts = dict(zip(emission_states, np.bincount(states, minlength=len(emission_states)).tolist()))
+    return total.astype(np.float32), accident.astype(np.float32), non_accident.astype(np.float32), accidental, \
+           state_counts
+
+
+# Version of the emission value cleaning, recorded in the frames it cleans. Change it when data_value_cleaining changes
+value_cleaning_version = 1
+# Columns added by data_value_cleaining
+value_cleaning_columns = ["KamutPlitaLoBeTeunot", "Accidental", "PsoletMesukenetTotal", "PsoletLoMesukenetTotal"]
+
+
+# Cleaning steps applied to a dataframe and their versions, kept in its attrs
+def cleaning_steps(dataframe):
+    return dict(dataframe.attrs.get("cleaning_steps", {}))
+
+
+# True if the emission values of the dataframe were cleaned - by the cleaning steps in its attrs, or, as some
+# operations drop attrs, by its columns: the added columns exist and the emission columns are numbers
+def is_value_cleaned(dataframe):
+    if cleaning_steps(dataframe).get("value_cleaning") == value_cleaning_version:
+        return True
+    return all(col in dataframe.columns for col in value_cleaning_columns) and all(
+        pd.api.types.is_numeric_dtype(dataframe[col]) for col in ["KamutPlita", "KamutPlitaBeTeunot"])
 
-    # Remove comma from number values
-    cols_for_comma_removal = ["KamutPlita", "KamutPlitaBeTeunot"]
-    all_data, comma_removed_from_col = comma_removal(dataframe=all_data, columns=cols_for_comma_removal)
 
-    column_list = ["KamutPlita", "KamutPlitaBeTeunot"]
+# Corrects Nans and specific emission column data.
+# Returns a new dataframe (sharing the unchanged columns), all_data is not changed. Data which is already cleaned is
+# returned as is, so cleaning can be called again safely. Rows in each emission state are kept in the attrs of the
+# cleaned data and recorded in the trace
+@traced
+def data_value_cleaining(all_data):
+    if is_value_cleaned(all_data):
+        annotate_span(already_value_cleaned=True)
+        return all_data
+    cleaned_data = all_data.copy(deep=False)
     # KamutPlita is Total emissions
     # KamutPlitaBeTeunot is emissions in accidents
-    non_nums_in_cols_dict = find_non_number_values_in_columns(dataframe=all_data, col_list=column_list)
-    # non_nums_in_cols_dict contains two special types of values.
-    values_dict = {
-        "too_low_values": ['פליטה נמוכה מכמות הסף', 'הזרמה נמוכה מכמות הסף'],
-        "non_accident_values": ['לא נפלט בתקלה', 'לא הוזרם בתקלה'],
-        "unavailable": ["נתון לא זמין"]
-    }
-
-    mask = (all_data["KamutPlita"] == values_dict["unavailable"][0])
-    all_data.loc[mask, "KamutPlita"] = np.nan
-    mask = (all_data["KamutPlitaBeTeunot"] == values_dict["unavailable"][0])
-    all_data.loc[mask, "KamutPlitaBeTeunot"] = np.nan
-
-    # if KamutPlita and KamutPlitaBeTeunot are too_low_values:
-    # KamutPlita is Nan
-    # KamutPlitaBeTeunot is Nan
-    # KamutPlitaLoBeTeunot are Nan,
-    # Accidental = 1
-    mask1 = (((all_data["KamutPlita"] == values_dict["too_low_values"][0]) | (
-            all_data["KamutPlita"] == values_dict["too_low_values"][1])) & (
-                     (all_data["KamutPlitaBeTeunot"] == values_dict["too_low_values"][0]) | (
-                     all_data["KamutPlitaBeTeunot"] == values_dict["too_low_values"][1])))
-
-    # if KamutPlita is in too_low_values and KamutPlitaBeTeunot is non_accident_values:
-    # KamutPlita is Nan
-    # KamutPlitaBeTeunot is None
-    # KamutPlitaLoBeTeunot are Nan,
-    # Accidental = 0
-    mask2 = (((all_data["KamutPlita"] == values_dict["too_low_values"][0]) | (
-            all_data["KamutPlita"] == values_dict["too_low_values"][1])) & (
-                     (all_data["KamutPlitaBeTeunot"] == values_dict["non_accident_values"][0]) | (
-                     all_data["KamutPlitaBeTeunot"] == values_dict["non_accident_values"][1])))
-
-    # if KamutPlita is in too_low_values and KamutPlitaBeTeunot is numeric:
-    # KamutPlita is Nan
-    # KamutPlitaBeTeunot is Nan
-    # KamutPlitaLoBeTeunot are Nan,
-    # Accidental = 1
-    mask3 = ((all_data["KamutPlita"] == values_dict["too_low_values"][0]) | (
-            all_data["KamutPlita"] == values_dict["too_low_values"][1]))
-    mask4 = mask3 & (~(mask1 & mask2))
-
-    # if KamutPlita is numeric and KamutPlitaBeTeunot  in too_low_values:
-    # KamutPlita is unchanged
-    # KamutPlitaBeTeunot is Nan
-    # KamutPlitaLoBeTeunot are --> KamutPlita,
-    # Accidental = 1
-    mask5 = ((all_data["KamutPlitaBeTeunot"] == values_dict["too_low_values"][0]) | (
-            all_data["KamutPlitaBeTeunot"] == values_dict["too_low_values"][1]))
-    mask6 = mask5 & (~(mask3))
-
-    # if KamutPlita is numeric and KamutPlitaBeTeunot  is non_accident_values:
-    # KamutPlita is unchanged
-    # KamutPlitaBeTeunot is Non
-    # KamutPlitaLoBeTeunot are --> KamutPlita,
-    # Accidental = 0
-    mask7 = ((all_data["KamutPlitaBeTeunot"] == values_dict["non_accident_values"][0]) | (
-            all_data["KamutPlitaBeTeunot"] == values_dict["non_accident_values"][1]))
-    mask8 = mask7 & (~(mask3))
-
-    all_data.loc[mask1, "KamutPlita"] = np.nan
-    all_data.loc[mask1, "KamutPlitaBeTeunot"] = np.nan
-    all_data.loc[mask1, "KamutPlitaLoBeTeunot"] = np.nan
-    all_data.loc[mask1, "Accidental"] = True
-
-    all_data.loc[mask2, "KamutPlita"] = np.nan
-    all_data.loc[mask2, "KamutPlitaBeTeunot"] = np.nan  # None
-    all_data.loc[mask2, "KamutPlitaLoBeTeunot"] = np.nan
-    all_data.loc[mask2, "Accidental"] = False
-
-    all_data.loc[mask4, "KamutPlita"] = np.nan
-    all_data.loc[mask4, "KamutPlitaBeTeunot"] = np.nan
-    all_data.loc[mask4, "KamutPlitaLoBeTeunot"] = np.nan
-    all_data.loc[mask4, "Accidental"] = True
-
-    all_data.loc[mask6, "KamutPlitaBeTeunot"] = np.nan
-    all_data.loc[mask6, "KamutPlitaLoBeTeunot"] = all_data.loc[mask6, "KamutPlita"]
-    all_data.loc[mask6, "Accidental"] = True
-
-    all_data.loc[mask8, "KamutPlitaBeTeunot"] = np.nan  # None
-    all_data.loc[mask8, "KamutPlitaLoBeTeunot"] = all_data.loc[mask8, "KamutPlita"]
-    all_data.loc[mask8, "Accidental"] = False
-
-    columns_to_convert = comma_removed_from_col + ["KamutPlitaLoBeTeunot"]
-
-    all_data = convert_to_numeric(dataframe=all_data, column_list=columns_to_convert)
+    # KamutPlitaLoBeTeunot is emissions not in accidents
+    total, accident, non_accident, accidental, state_counts = resolve_emission_sentinels(
+        total_emission=all_data["KamutPlita"], accident_emission=all_data["KamutPlitaBeTeunot"])
+    cleaned_data["KamutPlita"] = total
+    cleaned_data["KamutPlitaBeTeunot"] = accident
+    cleaned_data["KamutPlitaLoBeTeunot"] = non_accident
+    cleaned_data["Accidental"] = pd.Categorical(accidental, categories=[False, True])
+    annotate_span(emission_state_counts=state_counts)
 
     # Waste column
-    all_data["PsoletMesukenetTotal"] = np.NaN
-    all_data["PsoletLoMesukenetTotal"] = np.NaN
-    all_data["PsoletMesukenetTotal"] = all_data["SachTipulPsoletMesukenet"] + all_data["SachSilukPsoletMesukenet"]
-    all_data["PsoletLoMesukenetTotal"] = all_data["SachTipulPsoletLoMesukenet"] + all_data["SachSilukPsoletLoMesukenet"]
-
-    return all_data
-
-
-# Loads data, cleans it and pickles the result
-def data_cleaning(file_to_load, pickel_name, output_folder_name):
-    data_df = load_data_from_csv(file_to_load)
-    data_df = dataconv.clean_data_ui(data_df)  # Removes columns and adjusts data types
-    save_as_pickel(dataframe=data_df, output_folder_name=output_folder_name, save_file_name=pickel_name)
+    cleaned_data["PsoletMesukenetTotal"] = all_data["SachTipulPsoletMesukenet"] + all_data["SachSilukPsoletMesukenet"]
+    cleaned_data["PsoletLoMesukenetTotal"] = all_data["SachTipulPsoletLoMesukenet"] + \
+                                             all_data["SachSilukPsoletLoMesukenet"]
+
+    steps = cleaning_steps(all_data)
+    steps["value_cleaning"] = value_cleaning_version
+    cleaned_data.attrs = dict(all_data.attrs, cleaning_steps=steps, emission_state_counts=state_counts)
+    return cleaned_data
+
+
+# Loads data, cleans it and caches the result under the cache key.
+# If chunksize is given the csv is streamed in chunks, reading only usecols and converting column_dtypes on the fly.
+# If the conversion schema file exists cleaning runs without user input, otherwise the user choices are saved to it
+# and the data is cached under the key of the saved schema, which later runs replay. Returns the cache key.
+@traced
+def data_cleaning(file_to_load, cache_name, cache_key, cleaning_config, output_folder_name, usecols=None,
+                  column_dtypes=None, chunksize=None, schema_file_name=None):
+    if chunksize is None:
+        data_df = load_data_from_csv(file_to_load)
+        if usecols is not None:
+            data_df = data_df[[col for col in data_df.columns if col in usecols]]
+    else:
+        data_df = load_data_from_csv_chunked(file_to_load, usecols=usecols, column_dtypes=column_dtypes,
+                                             chunksize=chunksize)
+    if schema_file_name is not None and os.path.isfile(schema_file_name):
+        data_df = dataconv.clean_data_batch(data_df, schema_file_name)  # Removes columns and adjusts data types
+    else:
+        data_df = dataconv.clean_data_ui(data_df, schema_file_name)  # Removes columns and adjusts data types
+        if schema_file_name is not None:
+            cleaning_config = schema_cleaning_config(cleaning_config, schema_file_name)
+            cache_key = data_cache_key(source_file_name=file_to_load, cleaning_config=cleaning_config)
+    save_to_cache(dataframe=data_df, cache_name=cache_name, cache_key=cache_key, cleaning_config=cleaning_config,
+                  output_folder_name=output_folder_name)
+    return cache_key
 
 
 # Load dataframe from csv, clean it and immediately pickle it
 def load_csv_then_pickle(csv_file_name, output_folder_name, pickle_file_name):
-    working_direcotry = os.getcwd()
-    os.chdir(output_folder_name)
-    data = load_data_from_csv(csv_file_name)
+    data = load_data_from_csv(os.path.join(output_folder_name, csv_file_name))
     data = dataconv.clean_data_ui(data)
-    save_as_pickel(data, output_folder_name, pickle_file_name)
-    os.chdir(working_direcotry)
+    save_as_pickel(dataframe=data, save_file_name=pickle_file_name, output_folder_name=output_folder_name)
+
+
+#################
+# Label mapping #
+#################
+
+# Label transforms run on the distinct values of a column, not on its rows, and each transformed label is cached
+# for the run, as the same labels are shortened for many charts.
+
+# Label shortened to how_short characters, values which are not text are kept
+@functools.lru_cache(maxsize=8192)
+def short_label(label, how_short):
+    if not isinstance(label, str):
+        return label
+    return label[:how_short]
+
+
+# Applies transform to the distinct labels of a column. A categorical column keeps its codes when no labels merge
+# (categories are renamed), otherwise the codes are mapped through a table. Categories stay sorted.
+# Other columns are factorized and returned as text.
+def map_labels(series, transform):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        labels = series.cat.categories
+    else:
+        codes, labels = pd.factorize(series)
+    new_labels = pd.Index([transform(label) for label in labels])
+    categories = new_labels.unique().sort_values()
+    if isinstance(series.dtype, pd.CategoricalDtype) and len(categories) == len(labels):
+        mapped = series.cat.rename_categories(new_labels)
+        return mapped.cat.reorder_categories(categories) if not new_labels.equals(categories) else mapped
+    code_table = np.append(categories.get_indexer(new_labels), -1)  # Code -1 (NaN) maps to the last, -1, element
+    mapped = pd.Categorical.from_codes(code_table[codes], categories=categories)
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        mapped = np.asarray(mapped, dtype=object)
+    return pd.Series(mapped, index=series.index, name=series.name)
+
+
+# Dataframe with the cols labels mapped by transform. The dataframe is not changed, other columns are shared with it
+def map_column_labels(dataframe, cols, transform):
+    mapped = dataframe.copy(deep=False)
+    for col in cols:
+        mapped[col] = map_labels(dataframe[col], transform)
+    return mapped
 
 
 # shorten name for display
 def shorten_name(dataframe, cols, how_short):
-    for col in cols:
-        dataframe[col] = dataframe[col].str[:how_short]
-    return dataframe
+    return map_column_labels(dataframe, cols, lambda label: short_label(label, how_short))
+
+
+# Full activity names of TchumPeilutAtarSvivati and the short names they are displayed by
+product_full_names = [
+    "74 - טיפול ועיבוד חלב בלבד, אם כמות תשומת החלב עולה על 200 טון ליום",
+    "72 - שחיטה של בעלי חיים בקיבולת של 50 טון ליום",
+    "20 - ייצור מלט באמצעות כבשנים סובבים (Rotary Kilns) בעלי כושר ייצור של 500 טון ליום, או בכבשנים אחרים (furnaces) בעלי כושר ייצור של 50 טון ליום",
+    "19 - ייצור אספלט",
+    "14 - ייצור והפקה של מתכות לא ברזיליות גולמיות ממחצבים, עופרות, תרכיזים, או חומרי גלם שניוניים על ידי תהליכים מטאלורגיים, כימיים או אלקטרוליטיים",
+    "56 - פעילות שנעשה בה שימוש במיתקנים לטיפול או סילוק של שפכים בספיקה של 1,000 מטר מעוקב ליום",
+    "52 - טיפול או שילוב של טיפול וסילוק, של פסולת לא מסוכנת בקיבולת של 50 טון ליום הכוללת אחת או יותר מפעילויות המנויות, למעט טיפול בשפכים שאינם שפכי תעשייה",
+    "28 - ייצור פחממנים המכילים חמצן כגון אלכוהולים, אלדהידים, קטונים, חומצות קרבוקסיליות, אסטרים, אצטטים, אתרים, פרוקסידים, שרפים אפוקסים",
+    "53 - תפעול מטמנות בקיבולת של 10 טון ליום או בקיבולת כללית העולה על 25,000 טון",
+    "54 - מיתקן נייח וקבוע שבו נעשת העברה של פסולת או מיון של פסולת לרכיביה",
+    "70 - מיתקנים לגידול עופות בקיבולת של 40,000 עופות",
+    "41 - ייצור מלחים כגון אמוניום כלוריד, פוטסיום כלורט, פוטסיום קרבונט, סודיום קרבונט, פרבורט, ניטרט כסף (Silver nitrate)",
+    "68 - התפלת מים בספיקה של 30 מיליון מטר מעוקב בשנה",
+    "16 - טיפול פני השטח של מתכות וחומרים פלסטיים על ידי תהליך כימי או אלקטרוליטי באמבטיות טיפול שנפחן הכולל 30 מטר מעוקב",
+    "59 - ייצור נייר וקרטון בכושר ייצור העולה על 20 טון ליום",
+    "21 - ייצור סיד בכבשנים בעלי כושר ייצור של  50 טון ליום",
+    "55 - פעילות שנעשה בה שימוש במיתקנים לכילוי או מיחזור של פגרי בעלי חיים ופסדים, בקיבולת של 10 טון ליום",
+    "18 - מחצבות פתוחות (Open cast mining),",
+    "73 - טיפול ועיבוד, של חומרי גלם מהחי או מהצומח, בין אם עובדו קודם לכן ובין אם לא, המיועדים לייצור מוצרי מזון, משקאות או מזון לבעלי חיים",
+    "47 - טיפול או סילוק של פסולת מסוכנת בכמות של 10 טון ליום באמצעות הפעילויות המנויות",
+    "02 - הפקת דלקים במצב צבירה גז, נוזל או מוצק, בקנה מידה תעשייתי",
+    "45 - תהליכים כימיים וביולוגיים לייצור מוצרים  פרמצבטיים כולל חומרי ביניים",
+    "15 - התכה, כולל סגסוגות (alloyage), של מתכות לא ברזיליות, כולל מוצרים מוחזרים והפעלת בתי יציקה למתכות לא ברזיליות בכושר התכה העולה על 4 טון ליום לעופרת וקדמיום ו-20 טון ליום לכל שאר המתכות",
+    "64 - טיפול פני שטח של חומרים, רכיבים או מוצרים, באמצעות  ממיסים אורגניים בכמות של 150 קילוגרם לשעה או 200 טון לשנה, במיוחד להדפסה, ציפוי, ניקוי משמנים, עמידות למים, צביעה, ניקוי או אימפרגנציה וכדומה",
+    "06 - פעילות שנעשה בה שימוש במיתקן שריפה בהספק תרמי של  50 מגה וואט",
+    "09 - פעילות שנעשה בה שימוש במיתקנים לייצור ברזל גולמי או פלדה (התכה ראשונית או שניונית) ובכלל זה יציקה רציפה, בעלי כושר ייצור של 2.5 טון לשעה",
+    "51 - סילוק של פסולת לא מסוכנת בקיבולת של 50 טון ליום הכוללת אחת או יותר מפעילויות המנויות, למעט טיפול בשפכים שאינם שפכי תעשייה:",
+    "27 - ייצור פחממנים פשוטים (לינארים או ציקלים, רוויים ושאינם רוויים, אליפטים או ארומטיים)",
+    "38 - ייצור גזים כגון אמוניה, כלור או מימן כלורי, פלואור או מימן פלואורי, תחמוצות פחמן, תרכובות גופרית, תחמוצות חנקן, מימן, דו-תחמוצת הגפרית, קרבוניל כלוריד",
+    "69 - מיתקנים לגידול אינטנסיבי של חזירים בקיבולת של 2,000 חזירים (אשר משקלם עולה על 30 קילוגרם) או 750  חזירות (נקבות)",
+    "71 - מיתקנים לגידול דגים או רכיכות בקיבולת של 1,000 טון דגים או רכיכות לשנה",
+    "23 - פעילות שנעשה בה שימוש במיתקנים ליצור זכוכית כולל סיבי זכוכית, בעלי כושר המסה של 20 טון ליום",
+    "44 - ייצור ביוצידים (נגד מיקרואורגניזמים) או מוצרים בסיסיים להגנת הצומח",
+    "34 - ייצור חומרים פלסטיים (פולימרים, סיבים סינתטיים וסיבים המבוססים על צלולוס)",
+    "39 - ייצור חומצות כגון חומצה כרומית, חומצה הידרופלואורית, חומצה זרחתית, חומצה חנקתית, חומצה הידרוכלורית, חומצה גפרתית, אולאום (Oleum), חומצות גפריתיות",
+    "10 - פעילות שנעשה בה שימוש במיתקני ערגול בכושר ייצור של  20 טון פלדה גולמית לשעה",
+    "26 - פעילות שנעשה בה שימוש במיתקנים ליצור מוצרים קרמים על ידי שריפה, כגון רעפים, לבנים, אריחים או פורצלן, בעלי כושר ייצור של 75 טון ליום או עם כבשנים בעלי נפח של 4 מטרים מעוקבים ועם צפיפות השמה לכבשן של 300 קילוגרם למטר מעוקב",
+    "42 - ייצור תרכובות אנאורגניות לא מתכתיות או תחמוצות מתכת או תרכובות אנאורגניות אחרות כגון סידן קרביד, סיליקון, סיליקון קרביד",
+    "43 - ייצור דשנים המבוססים על זרחן, חנקן או אשלגן (תרכובות פשוטות או מורכבות)",
+    "57 - טיפול או סילוק של שפכים שהם תוצר של פעילויות מהסוגים המפורטים בטור ב' לתוספת זו",
+    "32 - ייצור פחממנים הלוגנים",
+    "01 - זיקוק גז ודלקים",
+    "37 - ייצור חומרים פעילי שטח ודטרגנטים",
+    "12 - יישום גלוון או ציפוי מתכת (fused metal coats) בכושר ייצור של 2 טון פלדה גולמית לשעה",
+    "58 - ייצור עיסה מעץ או מחומרים סיביים אחרים",
+    "50 - סילוק או טיפול בפסולת במיתקנים לשריפה או לטיפול תרמי, בפסולת לא מסוכנת – בקיבולת של 3 טון לשעה, ובפסולת מסוכנת – בקיבולת של 10 טון ליום",
+    "62 - פעילויות מקדימות כגון שטיפה, הלבנה, מירצור או צביעת חוטים או טקסטיל, בכושר ייצור של 10 טון ליום",
+    "13 - פעילות שנעשה בה שימוש בבתי יציקה של מתכות ברזיליות בכושר ייצור של 20 טון ליום"
+]
+
+product_display_names = [
+    "74- טיפול ועיבוד חלב בלבד",
+    "72- שחיטה של בעלי חיים",
+    "20- ייצור מלט באמצעות כבשנים סובבים או בכבשנים אחרים",
+    "19- ייצור אספלט",
+    "14- ייצור והפקה של מתכות לא ברזיליות גולמיות",
+    "56- פעילות שנעשה בה שימוש במיתקנים לטיפול או סילוק של שפכים",
+    "52- טיפול או שילוב של טיפול וסילוק, של פסולת לא מסוכנת למעט טיפול בשפכים שאינם שפכי תעשייה",
+    "28- ייצור פחממנים",
+    "53- תפעול מטמנות",
+    "54- מיתקן נייח וקבוע שבו נעשת העברה של פסולת או מיון של פסולת לרכיביה",
+    "70- מיתקנים לגידול עופות",
+    "41- ייצור מלחים",
+    "68- התפלת מים",
+    "16- טיפול פני השטח של מתכות וחומרים פלסטיים",
+    "59- ייצור נייר וקרטון",
+    "21- ייצור סיד בכבשנים",
+    "55- פעילות שנעשה בה שימוש במיתקנים לכילוי או מיחזור של פגרי בעלי חיים ופסדים",
+    "18- מחצבות פתוחות",
+    "73- טיפול ועיבוד, של חומרי גלם מהחי או מהצומח,לייצור מוצרי מזון, משקאות או מזון לבעלי חיים",
+    "47- טיפול או סילוק של פסולת מסוכנת",
+    "2- הפקת דלקים במצב צבירה גז, נוזל או מוצק, בקנה מידה תעשייתי",
+    "45- תהליכים כימיים וביולוגיים לייצור מוצרים  פרמצבטיים כולל חומרי ביניים",
+    "15- התכה, כולל סגסוגות של מתכות לא ברזיליות",
+    "64- טיפול פני שטח של חומרים, רכיבים או מוצרים, באמצעות  ממיסים אורגניים",
+    "6- פעילות שנעשה בה שימוש במיתקן שריפה",
+    "9- פעילות שנעשה בה שימוש במיתקנים לייצור ברזל גולמי או פלדה",
+    "51- סילוק של פסולת לא מסוכנת למעט טיפול",
+    "27- ייצור פחממנים פשוטים",
+    "38- ייצור גזים",
+    "69- מיתקנים לגידול אינטנסיבי של חזירים",
+    "71- מיתקנים לגידול דגים או רכיכות",
+    "23- פעילות שנעשה בה שימוש במיתקנים ליצור זכוכית כולל סיבי זכוכית",
+    "44- ייצור ביוצידים או מוצרים בסיסיים להגנת הצומח",
+    "34- ייצור חומרים פלסטיים",
+    "39- ייצור חומצות",
+    "10- פעילות שנעשה בה שימוש במיתקני ערגול",
+    "26- פעילות שנעשה בה שימוש במיתקנים ליצור מוצרים קרמים",
+    "42- ייצור תרכובות אנאורגניות",
+    "43- ייצור דשנים",
+    "57- טיפול או סילוק של שפכים",
+    "32- ייצור פחממנים הלוגנים",
+    "1- זיקוק גז ודלקים",
+    "37- ייצור חומרים פעילי שטח ודטרגנטים",
+    "12- יישום גלוון או ציפוי מתכת",
+    "58- ייצור עיסה מעץ או מחומרים סיביים אחרים",
+    "50- סילוק או טיפול בפסולת במיתקנים לשריפה או לטיפול תרמי, בפסולת לא מסוכנת או בפסולת מסוכנת",
+    "62- פעילויות מקדימות כגון שטיפה, הלבנה, מירצור או צביעת חוטים או טקסטיל",
+    "13- פעילות שנעשה בה שימוש בבתי יציקה של מתכות ברזיליות"
+]
+
+
+product_short_names = dict(zip(product_full_names, product_display_names))
 
 
 # Shorten product names for display
 def shorten_product_name(dataframe, product_col):
-    keys = [
-        "74 - טיפול ועיבוד חלב בלבד, אם כמות תשומת החלב עולה על 200 טון ליום",
-        "72 - שחיטה של בעלי חיים בקיבולת של 50 טון ליום",
-        "20 - ייצור מלט באמצעות כבשנים סובבים (Rotary Kilns) בעלי כושר ייצור של 500 טון ליום, או בכבשנים אחרים (furnaces) בעלי כושר ייצור של 50 טון ליום",
-        "19 - ייצור אספלט",
-        "14 - ייצור והפקה של מתכות לא ברזיליות גולמיות ממחצבים, עופרות, תרכיזים, או חומרי גלם שניוניים על ידי תהליכים מטאלורגיים, כימיים או אלקטרוליטיים",
-        "56 - פעילות שנעשה בה שימוש במיתקנים לטיפול או סילוק של שפכים בספיקה של 1,000 מטר מעוקב ליום",
-        "52 - טיפול או שילוב של טיפול וסילוק, של פסולת לא מסוכנת בקיבולת של 50 טון ליום הכוללת אחת או יותר מפעילויות המנויות, למעט טיפול בשפכים שאינם שפכי תעשייה",
-        "28 - ייצור פחממנים המכילים חמצן כגון אלכוהולים, אלדהידים, קטונים, חומצות קרבוקסיליות, אסטרים, אצטטים, אתרים, פרוקסידים, שרפים אפוקסים",
-        "53 - תפעול מטמנות בקיבולת של 10 טון ליום או בקיבולת כללית העולה על 25,000 טון",
-        "54 - מיתקן נייח וקבוע שבו נעשת העברה של פסולת או מיון של פסולת לרכיביה",
-        "70 - מיתקנים לגידול עופות בקיבולת של 40,000 עופות",
-        "41 - ייצור מלחים כגון אמוניום כלוריד, פוטסיום כלורט, פוטסיום קרבונט, סודיום קרבונט, פרבורט, ניטרט כסף (Silver nitrate)",
-        "68 - התפלת מים בספיקה של 30 מיליון מטר מעוקב בשנה",
-        "16 - טיפול פני השטח של מתכות וחומרים פלסטיים על ידי תהליך כימי או אלקטרוליטי באמבטיות טיפול שנפחן הכולל 30 מטר מעוקב",
-        "59 - ייצור נייר וקרטון בכושר ייצור העולה על 20 טון ליום",
-        "21 - ייצור סיד בכבשנים בעלי כושר ייצור של  50 טון ליום",
-        "55 - פעילות שנעשה בה שימוש במיתקנים לכילוי או מיחזור של פגרי בעלי חיים ופסדים, בקיבולת של 10 טון ליום",
-        "18 - מחצבות פתוחות (Open cast mining),",
-        "73 - טיפול ועיבוד, של חומרי גלם מהחי או מהצומח, בין אם עובדו קודם לכן ובין אם לא, המיועדים לייצור מוצרי מזון, משקאות או מזון לבעלי חיים",
-        "47 - טיפול או סילוק של פסולת מסוכנת בכמות של 10 טון ליום באמצעות הפעילויות המנויות",
-        "02 - הפקת דלקים במצב צבירה גז, נוזל או מוצק, בקנה מידה תעשייתי",
-        "45 - תהליכים כימיים וביולוגיים לייצור מוצרים  פרמצבטיים כולל חומרי ביניים",
-        "15 - התכה, כולל סגסוגות (alloyage), של מתכות לא ברזיליות, כולל מוצרים מוחזרים והפעלת בתי יציקה למתכות לא ברזיליות בכושר התכה העולה על 4 טון ליום לעופרת וקדמיום ו-20 טון ליום לכל שאר המתכות",
-        "64 - טיפול פני שטח של חומרים, רכיבים או מוצרים, באמצעות  ממיסים אורגניים בכמות של 150 קילוגרם לשעה או 200 טון לשנה, במיוחד להדפסה, ציפוי, ניקוי משמנים, עמידות למים, צביעה, ניקוי או אימפרגנציה וכדומה",
-        "06 - פעילות שנעשה בה שימוש במיתקן שריפה בהספק תרמי של  50 מגה וואט",
-        "09 - פעילות שנעשה בה שימוש במיתקנים לייצור ברזל גולמי או פלדה (התכה ראשונית או שניונית) ובכלל זה יציקה רציפה, בעלי כושר ייצור של 2.5 טון לשעה",
-        "51 - סילוק של פסולת לא מסוכנת בקיבולת של 50 טון ליום הכוללת אחת או יותר מפעילויות המנויות, למעט טיפול בשפכים שאינם שפכי תעשייה:",
-        "27 - ייצור פחממנים פשוטים (לינארים או ציקלים, רוויים ושאינם רוויים, אליפטים או ארומטיים)",
-        "38 - ייצור גזים כגון אמוניה, כלור או מימן כלורי, פלואור או מימן פלואורי, תחמוצות פחמן, תרכובות גופרית, תחמוצות חנקן, מימן, דו-תחמוצת הגפרית, קרבוניל כלוריד",
-        "69 - מיתקנים לגידול אינטנסיבי של חזירים בקיבולת של 2,000 חזירים (אשר משקלם עולה על 30 קילוגרם) או 750  חזירות (נקבות)",
-        "71 - מיתקנים לגידול דגים או רכיכות בקיבולת של 1,000 טון דגים או רכיכות לשנה",
-        "23 - פעילות שנעשה בה שימוש במיתקנים ליצור זכוכית כולל סיבי זכוכית, בעלי כושר המסה של 20 טון ליום",
-        "44 - ייצור ביוצידים (נגד מיקרואורגניזמים) או מוצרים בסיסיים להגנת הצומח",
-        "34 - ייצור חומרים פלסטיים (פולימרים, סיבים סינתטיים וסיבים המבוססים על צלולוס)",
-        "39 - ייצור חומצות כגון חומצה כרומית, חומצה הידרופלואורית, חומצה זרחתית, חומצה חנקתית, חומצה הידרוכלורית, חומצה גפרתית, אולאום (Oleum), חומצות גפריתיות",
-        "10 - פעילות שנעשה בה שימוש במיתקני ערגול בכושר ייצור של  20 טון פלדה גולמית לשעה",
-        "26 - פעילות שנעשה בה שימוש במיתקנים ליצור מוצרים קרמים על ידי שריפה, כגון רעפים, לבנים, אריחים או פורצלן, בעלי כושר ייצור של 75 טון ליום או עם כבשנים בעלי נפח של 4 מטרים מעוקבים ועם צפיפות השמה לכבשן של 300 קילוגרם למטר מעוקב",
-        "42 - ייצור תרכובות אנאורגניות לא מתכתיות או תחמוצות מתכת או תרכובות אנאורגניות אחרות כגון סידן קרביד, סיליקון, סיליקון קרביד",
-        "43 - ייצור דשנים המבוססים על זרחן, חנקן או אשלגן (תרכובות פשוטות או מורכבות)",
-        "57 - טיפול או סילוק של שפכים שהם תוצר של פעילויות מהסוגים המפורטים בטור ב' לתוספת זו",
-        "32 - ייצור פחממנים הלוגנים",
-        "01 - זיקוק גז ודלקים",
-        "37 - ייצור חומרים פעילי שטח ודטרגנטים",
-        "12 - יישום גלוון או ציפוי מתכת (fused metal coats) בכושר ייצור של 2 טון פלדה גולמית לשעה",
-        "58 - ייצור עיסה מעץ או מחומרים סיביים אחרים",
-        "50 - סילוק או טיפול בפסולת במיתקנים לשריפה או לטיפול תרמי, בפסולת לא מסוכנת – בקיבולת של 3 טון לשעה, ובפסולת מסוכנת – בקיבולת של 10 טון ליום",
-        "62 - פעילויות מקדימות כגון שטיפה, הלבנה, מירצור או צביעת חוטים או טקסטיל, בכושר ייצור של 10 טון ליום",
-        "13 - פעילות שנעשה בה שימוש בבתי יציקה של מתכות ברזיליות בכושר ייצור של 20 טון ליום"
-    ]
-
-    values = [
-        "74- טיפול ועיבוד חלב בלבד",
-        "72- שחיטה של בעלי חיים",
-        "20- ייצור מלט באמצעות כבשנים סובבים או בכבשנים אחרים",
-        "19- ייצור אספלט",
-        "14- ייצור והפקה של מתכות לא ברזיליות גולמיות",
-        "56- פעילות שנעשה בה שימוש במיתקנים לטיפול או סילוק של שפכים",
-        "52- טיפול או שילוב של טיפול וסילוק, של פסולת לא מסוכנת למעט טיפול בשפכים שאינם שפכי תעשייה",
-        "28- ייצור פחממנים",
-        "53- תפעול מטמנות",
-        "54- מיתקן נייח וקבוע שבו נעשת העברה של פסולת או מיון של פסולת לרכיביה",
-        "70- מיתקנים לגידול עופות",
-        "41- ייצור מלחים",
-        "68- התפלת מים",
-        "16- טיפול פני השטח של מתכות וחומרים פלסטיים",
-        "59- ייצור נייר וקרטון",
-        "21- ייצור סיד בכבשנים",
-        "55- פעילות שנעשה בה שימוש במיתקנים לכילוי או מיחזור של פגרי בעלי חיים ופסדים",
-        "18- מחצבות פתוחות",
-        "73- טיפול ועיבוד, של חומרי גלם מהחי או מהצומח,לייצור מוצרי מזון, משקאות או מזון לבעלי חיים",
-        "47- טיפול או סילוק של פסולת מסוכנת",
-        "2- הפקת דלקים במצב צבירה גז, נוזל או מוצק, בקנה מידה תעשייתי",
-        "45- תהליכים כימיים וביולוגיים לייצור מוצרים  פרמצבטיים כולל חומרי ביניים",
-        "15- התכה, כולל סגסוגות של מתכות לא ברזיליות",
-        "64- טיפול פני שטח של חומרים, רכיבים או מוצרים, באמצעות  ממיסים אורגניים",
-        "6- פעילות שנעשה בה שימוש במיתקן שריפה",
-        "9- פעילות שנעשה בה שימוש במיתקנים לייצור ברזל גולמי או פלדה",
-        "51- סילוק של פסולת לא מסוכנת למעט טיפול",
-        "27- ייצור פחממנים פשוטים",
-        "38- ייצור גזים",
-        "69- מיתקנים לגידול אינטנסיבי של חזירים",
-        "71- מיתקנים לגידול דגים או רכיכות",
-        "23- פעילות שנעשה בה שימוש במיתקנים ליצור זכוכית כולל סיבי זכוכית",
-        "44- ייצור ביוצידים או מוצרים בסיסיים להגנת הצומח",
-        "34- ייצור חומרים פלסטיים",
-        "39- ייצור חומצות",
-        "10- פעילות שנעשה בה שימוש במיתקני ערגול",
-        "26- פעילות שנעשה בה שימוש במיתקנים ליצור מוצרים קרמים",
-        "42- ייצור תרכובות אנאורגניות",
-        "43- ייצור דשנים",
-        "57- טיפול או סילוק של שפכים",
-        "32- ייצור פחממנים הלוגנים",
-        "1- זיקוק גז ודלקים",
-        "37- ייצור חומרים פעילי שטח ודטרגנטים",
-        "12- יישום גלוון או ציפוי מתכת",
-        "58- ייצור עיסה מעץ או מחומרים סיביים אחרים",
-        "50- סילוק או טיפול בפסולת במיתקנים לשריפה או לטיפול תרמי, בפסולת לא מסוכנת או בפסולת מסוכנת",
-        "62- פעילויות מקדימות כגון שטיפה, הלבנה, מירצור או צביעת חוטים או טקסטיל",
-        "13- פעילות שנעשה בה שימוש בבתי יציקה של מתכות ברזיליות"
-    ]
-
-    product_dict = dict(zip(keys, values))
-    dataframe = dataframe.replace({product_col: product_dict})
-    return dataframe
+    return map_column_labels(dataframe, [product_col], lambda label: product_short_names.get(label, label))
 
 
 ##############
@@ -476,4 +601,5 @@ def shorten_product_name(dataframe, product_col):
 #             return values_dict
 
 if __name__ == "__main__":
-    data_cleaning(file_to_load="MIFLAS_data.csv", pickel_name="testpickle", output_folder_name="Output_files")
+    data_cleaning(file_to_load="MIFLAS_data.csv", cache_name="testcache", cache_key="test", cleaning_config={},
+                  output_folder_name="Output_files")
@@ -17,21 +17,31 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
+import json
+
 import numpy as np
 import pandas as pd
 
+from output_paths import output_path
+
 
-# Displaying data overview by describe and column names
+# Displaying data overview by describe and column names.
+# Text columns are either object or, when the csv is streamed in chunks, category columns. A description is skipped
+# when there are no columns of its kind, as describe fails on them
 def observe_data(data):
     desired_width = 230
     pd.set_option('display.width', desired_width)
     pd.set_option('display.max_columns', len(data.columns))
     print("Numeric Data Description:")
-    description_numeric = data.describe(include=[np.number])
-    print(description_numeric)
+    numeric_columns = data.select_dtypes(include=[np.number]).columns
+    if len(numeric_columns) > 0:
+        description_numeric = data[numeric_columns].describe()
+        print(description_numeric)
     print("Text Data Description:")
-    description_object = data.describe(include=[np.object])
-    print(description_object)
+    text_columns = data.select_dtypes(include=["object", "category"]).columns
+    if len(text_columns) > 0:
+        description_object = data[text_columns].describe()
+        print(description_object)
     print("Data columns:")
     column_names = data.columns
     print(column_names)
@@ -46,7 +56,7 @@ def remove_low_variety_columns(data):
             columns_deleted.append(col_name)
             data.drop([col_name], axis=1, inplace=True)
     # print("Deleted Colums: " + str(columns_deleted))
-    with open('Output_files/deletedColumns.txt', 'w') as file1:
+    with open(output_path("reports", "deletedColumns.txt"), 'w') as file1:
         for item in columns_deleted:
             file1.write("%s\n" % item)
     file1.close()
@@ -82,18 +92,24 @@ def identify_cols_with_nan(data):
         if data[col_name].isnull().any() == True:
             columns_with_nan.append(col_name)
     # print("Columns that have NaNs: " + str(columns_with_nan))
-    with open('Output_files/columsWithNan.txt', 'w') as file2:
+    with open(output_path("reports", "columsWithNan.txt"), 'w') as file2:
         for item in columns_with_nan:
             file2.write("%s\n" % item)
     file2.close()
     return data, columns_with_nan
 
 
-# Converts data in dataframe columns to the datatype chosen by the user
+# Schema action saved for each choice in user_action_select_ui
+schema_actions = {1: "unchanged", 2: "int", 3: "bool", 4: "date", 5: "category", 6: "manual", 7: "remove"}
+
+
+# Converts data in dataframe columns to the datatype chosen by the user.
+# The choices are returned as a conversion schema which can be replayed by convert_datatype_batch
 def convert_datatype_ui(data):
     data_dict = data.dtypes.to_dict()
     columns_for_manual_correction = []
     columns_deleted = []
+    schema = {}
 
     for key in data_dict:
         unique_vals = data[key].unique()
@@ -103,6 +119,7 @@ def convert_datatype_ui(data):
         if data[key].isnull().any() == True: print("***Conatins NaNs***")
         print("It should:")
         input_val = user_action_select_ui(flag=0)
+        schema[key] = schema_actions[input_val]
         if input_val == 2:
             try:
                 data[key] = pd.to_numeric(data[key])
@@ -123,7 +140,7 @@ def convert_datatype_ui(data):
             columns_for_manual_correction.append(key + " cannot be converted into d/m/Y")
         elif input_val == 5:
             try:
-                data[key].astype('category')
+                data[key] = data[key].astype('category')
             except:
                 print("%s column cannot be converted to category" % key)
                 columns_for_manual_correction.append(key + " cannot be converted into category")
@@ -133,7 +150,7 @@ def convert_datatype_ui(data):
             try:
                 data.drop([key], axis=1, inplace=True)
                 columns_deleted.append(key)
-                with open("Output_files/deletedColumns.txt", "a") as file3:
+                with open(output_path("reports", "deletedColumns.txt"), "a") as file3:
                     file3.write("%s\n" % key)
                 file3.close()
             except:
@@ -143,23 +160,98 @@ def convert_datatype_ui(data):
             continue
 
     # print("Columns for manual correction: "+ str(columns_for_manual_correction))
-    with open('Output_files/ForManual.txt', 'w') as file4:
+    with open(output_path("reports", "ForManual.txt"), 'w') as file4:
         for item in columns_for_manual_correction:
             file4.write("%s\n" % item)
     file4.close()
+    return data, columns_for_manual_correction, columns_deleted, schema
+
+
+# Convert several columns with a conversion function in one pass. Values which fail conversion become NaN,
+# so a column fails if it has new NaNs. Failed columns are left unchanged.
+def convert_columns(data, columns, convert):
+    if columns == []:
+        return data, []
+    converted = data[columns].apply(convert)
+    failed = (converted.isnull() & data[columns].notnull()).any()
+    converted_cols = list(failed.index[~failed])
+    if converted_cols != []:
+        data[converted_cols] = converted[converted_cols]
+    return data, list(failed.index[failed])
+
+
+# Converts data in dataframe columns by a saved conversion schema, without user input.
+# Columns which fail conversion or are not in the schema are reported for manual correction.
+def convert_datatype_batch(data, schema):
+    columns_for_manual_correction = []
+    schema_cols = {}
+    for action in schema_actions.values():
+        schema_cols[action] = [col for col in data.columns if schema.get(col) == action]
+
+    data, failed = convert_columns(data, schema_cols["int"], lambda col: pd.to_numeric(col, errors="coerce"))
+    columns_for_manual_correction += [col + " cannot be converted into int" for col in failed]
+    data, failed = convert_columns(data, schema_cols["date"],
+                                   lambda col: pd.to_datetime(col, format='%d/%m/%Y', errors="coerce"))
+    columns_for_manual_correction += [col + " cannot be converted into d/m/Y" for col in failed]
+    if schema_cols["bool"] != []:
+        data[schema_cols["bool"]] = data[schema_cols["bool"]].astype('bool')
+    if schema_cols["category"] != []:
+        data[schema_cols["category"]] = data[schema_cols["category"]].astype('category')
+    columns_for_manual_correction += schema_cols["manual"]
+    columns_for_manual_correction += [col + " is not in conversion schema" for col in data.columns if col not in schema]
+
+    columns_deleted = schema_cols["remove"]
+    data.drop(columns_deleted, axis=1, inplace=True)
+    with open(output_path("reports", "deletedColumns.txt"), "a") as file3:
+        for item in columns_deleted:
+            file3.write("%s\n" % item)
+    with open(output_path("reports", "ForManual.txt"), 'w') as file4:
+        for item in columns_for_manual_correction:
+            file4.write("%s\n" % item)
     return data, columns_for_manual_correction, columns_deleted
 
 
+# Save conversion schema (column name to action) as json
+def save_conversion_schema(schema, schema_file_name):
+    with open(schema_file_name, "w", encoding="utf-8") as file1:
+        json.dump(schema, file1, ensure_ascii=False, indent=1)
+
+
+# Load conversion schema saved by save_conversion_schema
+def load_conversion_schema(schema_file_name):
+    with open(schema_file_name, "r", encoding="utf-8") as file1:
+        schema = json.load(file1)
+    return schema
+
+
+# Prints summary of all cleaning actions
+def print_cleaning_summary(columns_deleted, columns_manual, columns_nan):
+    print("Summery:")
+    print("Deleted Columns: " + str(columns_deleted))
+    print("Columns for manual correction: " + str(columns_manual))
+    print("Columns that have NaNs: " + str(columns_nan))
+
+
 # Removes binary columns and empty columns, outputs all columns with nan into a file,
 # descrives each column and opens a UI asking what to do with it, and displays
-# summary of all user induced actions
-def clean_data_ui(data):
+# summary of all user induced actions.
+# The user choices are saved as a conversion schema if schema_file_name is given
+def clean_data_ui(data, schema_file_name=None):
     observe_data(data)
     [data, columns_deleted1] = remove_low_variety_columns(data)
-    [data, columns_manual, columns_deleted2] = convert_datatype_ui(data)
+    [data, columns_manual, columns_deleted2, schema] = convert_datatype_ui(data)
     [data, columns_nan] = identify_cols_with_nan(data)
-    print("Summery:")
-    print("Deleted Columns: " + str(columns_deleted1 + columns_deleted2))
-    print("Columns for manual correction: " + str(columns_manual))
-    print("Columns that have NaNs: " + str(columns_nan))
+    print_cleaning_summary(columns_deleted1 + columns_deleted2, columns_manual, columns_nan)
+    if schema_file_name is not None:
+        save_conversion_schema(schema=schema, schema_file_name=schema_file_name)
+    return data
+
+
+# Same as clean_data_ui, but column conversions are read from a saved conversion schema instead of asking the user
+def clean_data_batch(data, schema_file_name):
+    schema = load_conversion_schema(schema_file_name)
+    [data, columns_deleted1] = remove_low_variety_columns(data)
+    [data, columns_manual, columns_deleted2] = convert_datatype_batch(data, schema)
+    [data, columns_nan] = identify_cols_with_nan(data)
+    print_cleaning_summary(columns_deleted1 + columns_deleted2, columns_manual, columns_nan)
     return data
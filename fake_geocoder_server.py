@@ -0,0 +1,168 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from async_geocoder import async_geocoder
+
+##################################
+# Local stand-in geocoding server #
+##################################
+
+'''
+Nominatim compatible /search endpoint on localhost, for measuring the geocoding clients without network access.
+Places come from a gazetteer dict (city name to latitude and longitude), other names get made up coordinates in Israel,
+except the not_found names. The server can answer slowly (latency), fail at random (failure_rate, status 503),
+and refuse calls above rate_limit per second (status 429 with Retry-After), so retries and rate compliance show up
+in its request log.
+'''
+
+
+# Made up coordinates in Israel for a city name, the same each time
+def fake_coordinates(city_name):
+    digest = hashlib.md5(city_name.encode("utf-8")).digest()
+    latitude = 29.5 + 3.8 * digest[0] / 255
+    longitude = 34.3 + 1.6 * digest[1] / 255
+    return latitude, longitude
+
+
+class FakeGeocoderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        request_time = time.monotonic()
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            recent = [t for t in server.accepted_times if request_time - t < 1]
+            status = 200
+            if server.rate_limit is not None and len(recent) >= server.rate_limit:
+                status = 429
+            elif server.random.random() < server.failure_rate:
+                status = 503
+            else:
+                server.accepted_times.append(request_time)
+            server.request_log.append((request_time, status))
+        try:
+            self.answer(status)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    # Answer with status after the server latency, with the search results if the status is 200
+    def answer(self, status):
+        server = self.server
+        time.sleep(server.latency)
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/search":
+            status = 404
+        if status != 200:
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+        city_name = urllib.parse.parse_qs(url.query).get("q", [""])[0]
+        results = []
+        if city_name not in server.not_found:
+            latitude, longitude = server.gazetteer.get(city_name) or fake_coordinates(city_name)
+            results = [{"lat": str(latitude), "lon": str(longitude), "display_name": city_name}]
+        body = json.dumps(results, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # Requests are kept in the server request log instead
+        pass
+
+
+# Start the stand-in server on a free local port in a background thread, its url is server.url
+def start_fake_geocoder(gazetteer=None, not_found=(), latency=0.05, failure_rate=0.0, rate_limit=None, seed=0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGeocoderHandler)
+    server.daemon_threads = True
+    server.gazetteer = gazetteer or {}
+    server.not_found = set(not_found)
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.rate_limit = rate_limit
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.accepted_times = []
+    server.request_log = []  # (monotonic time, status) of each request
+    server.in_flight = 0
+    server.max_in_flight = 0  # Most requests answered at the same time
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_fake_geocoder(server):
+    server.shutdown()
+    server.server_close()
+
+
+# Request count, status counts, mean rate and the most requests in any window seconds of a server request log
+def request_rate_stats(request_log, window=1.0):
+    times = sorted(t for t, status in request_log)
+    status_counts = {}
+    for t, status in request_log:
+        status_counts[status] = status_counts.get(status, 0) + 1
+    max_in_window = 0
+    start = 0
+    for end in range(len(times)):
+        while times[end] - times[start] >= window:
+            start += 1
+        max_in_window = max(max_in_window, end - start + 1)
+    duration = times[-1] - times[0] if len(times) > 1 else 0
+    mean_rate = (len(times) - 1) / duration if duration > 0 else 0
+    return {"requests": len(times), "status": status_counts, "mean_rate": mean_rate,
+            "max_in_window": max_in_window, "window": window}
+
+
+# Geocode city_count made up cities through the client and print throughput and the rate seen by the server
+def measure_async_geocoder(city_count=200, rate=10, concurrency=8, latency=0.2, failure_rate=0.05, rate_limit=None):
+    server = start_fake_geocoder(latency=latency, failure_rate=failure_rate, rate_limit=rate_limit,
+                                 not_found=["city 0"])
+    try:
+        city_names = ["city %d" % ind for ind in range(city_count)]
+        geocoder = async_geocoder(url=server.url, rate=rate, burst=1, concurrency=concurrency, backoff=0.1)
+        start = time.perf_counter()
+        geocoded = dict(geocoder(city_names))
+        seconds = time.perf_counter() - start
+    finally:
+        stop_fake_geocoder(server)
+    stats = request_rate_stats(server.request_log)
+    print("Geocoded %d of %d cities in %.2f seconds (%.1f cities per second)" % (len(geocoded), city_count, seconds,
+                                                                              len(geocoded) / seconds))
+    print("One at a time it would take at least %.2f seconds" % (city_count * latency))
+    print("Server saw " + str(stats))
+    print("Token bucket allows at most %d requests in %.1f seconds" % (1 + rate * stats["window"], stats["window"]))
+    return stats
+
+
+if __name__ == "__main__":
+    measure_async_geocoder()
@@ -18,257 +18,398 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
-import os
-
 import numpy as np
 import pandas as pd
 
 import visualize
 from data_cleaning import data_value_cleaining, dataframe_by_column_value_separator
 from data_cleaning import shorten_name
-from geoloc_for_map import geoloc_loader
+from geo_clusters import cluster_emissions, cluster_map_frames, cluster_summary, cluster_sweep, factory_clusters
+from geoloc_for_map import geocode_lookup, geoloc_loader
+from instrumentation import annotate_span, frame_mb, is_tracing, report_error, traced
+from output_paths import output_folder
+from save_data import export_to_csv
 
 
 ####################################
 # Format data for graph formation #
 ####################################
 
-# Pivot dataframe, then remove NaN and zeros, sort descending from pivot table and return it
-def pivot_sort_clean(data, by, values):
-    pv = pd.pivot_table(data=data, values=values, index=by, aggfunc=np.sum)
-    pv.dropna(axis=0, how='any', inplace=True)
-    pv = pv.loc[~(pv == 0).any(axis=1)]
-    pv_sorted = pv.sort_values(by=pv.columns[0], ascending=False)
-    return pv_sorted
+# Dimensions and emission values of the aggregation cube shared by the emission charts
+cube_dimensions = ["SugPlita", "KvutzatMezahamim", "SugPeilutAtarSvivati", "TchumPeilutAtarSvivati", "AnafAtarSvivati"]
+cube_values = ["KamutPlita", "KamutPlitaBeTeunot", "KamutPlitaLoBeTeunot"]
+
+
+# Label of missing values of categorical dimensions while the cube is grouped. pandas drops the NaN groups of
+# categorical columns even with dropna=False, so they are grouped under this label and set back to NaN in the cube
+missing_dimension = "__missing__"
+
+
+# Sums emissions by all the cube dimensions in one pass over the rows.
+# The cube is computed once per run and charts roll up from its cells instead of scanning the rows.
+# NaN dimension values are kept so roll ups by other dimensions still include those rows.
+# Categorical dimensions keep the categories of data, in their sorted order (groups reorder them by appearance)
+@traced
+def emission_cube(data):
+    keys = []
+    for col in cube_dimensions:
+        values = data[col]
+        if isinstance(values.dtype, pd.CategoricalDtype) and values.isnull().any():
+            values = values.cat.add_categories([missing_dimension]).fillna(missing_dimension)
+        keys.append(values)
+    cube = data[cube_values].groupby(keys, dropna=False, sort=False, observed=True).sum().reset_index()
+    for col in cube_dimensions:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            # Equal dtypes ignore the category order, so the categories are set. The missing label is dropped to NaN
+            cube[col] = cube[col].cat.set_categories(data[col].cat.categories)
+    return cube
+
+
+# Roll up cube cells to sums by the by columns, like a pivot table of the rows (columns in the same sorted order).
+# Labels of the shorten columns are cut to how_short characters, as they are displayed, before grouping.
+def cube_rollup(cube, by, values, shorten=(), how_short=40):
+    cube = shorten_name(dataframe=cube, cols=[col for col in by if col in shorten], how_short=how_short)
+    pv = cube.groupby(by, observed=True)[sorted(values)].sum().sort_index()
+    return pv
 
 
-# Pivot dataframe, then remove NaN and zeros from  pivot table and return it
-def pivot_sort(data, by, values):
-    pv = pd.pivot_table(data=data, values=values, index=by, aggfunc=np.sum)
+# Yields the emission type, pollutant group and their cube cells
+def cube_emission_slices(cube):
+    cells = cube.dropna(axis=0, how='any', subset=["SugPlita", "KvutzatMezahamim"])
+    slices = cells.groupby(["SugPlita", "KvutzatMezahamim"], sort=False, observed=True)
+    for (emission_type, pollutant_group), slice_cells in slices:
+        yield emission_type, pollutant_group, slice_cells
+
+
+# Pivot dataframe (or roll up the cube if given), then remove NaN and zeros, sort descending from pivot table and return it.
+# Only categories present in the data are pivoted (observed), pandas leaves them in order of appearance so the pivot
+# is sorted by index, as it is for text columns
+def pivot_sort_clean(data, by, values, cube=None, shorten=()):
+    if cube is None:
+        pv = pd.pivot_table(data=data, values=values, index=by, aggfunc=np.sum, observed=True).sort_index()
+    else:
+        pv = cube_rollup(cube=cube, by=by, values=values, shorten=shorten)
     pv.dropna(axis=0, how='any', inplace=True)
     pv = pv.loc[~(pv == 0).any(axis=1)]
-    return pv
-
+    pv_sorted = pv.sort_values(by=pv.columns[0], ascending=False)
+    return pv_sorted
 
-# Prepare dataframe for comparing accidental and non accidental emissions by emission type in one graphs
-def accident_non_acci_graph_generator(data, x_val_col, folder_name, is_log=True):
-    try:
-        data = shorten_name(dataframe=data, cols=[x_val_col], how_short=40)
-    except Exception as e:
-        print("Error during name shortening - ")
-        print(e)
 
+# Bar chart jobs for each emission type and pollutant group, rolled up from the cube by x_val_col.
+# x_val_col labels are shortened to 40 characters before the roll up if x_val_col is in shorten
+def cube_bar_chart_jobs(cube, x_val_col, data_series, title_template, output_folder_name, legend=None, is_log=False,
+                        shorten=()):
+    jobs = []
+    col_name = "מוצר"
+    for emission_type, pollutant_group, slice_cells in cube_emission_slices(cube):
+        pv = cube_rollup(cube=slice_cells, by=[x_val_col], values=data_series, shorten=shorten)
+        pv.dropna(axis=0, how='any', inplace=True)
+        pv = pv.loc[~(pv == 0).all(axis=1)]
+        if pv.size != 0:
+            compare_log = legend is not None and visualize.is_presentation_comparison(
+                col_by=x_val_col, emission_type=emission_type, pollutant_group=pollutant_group)
+            jobs.append(visualize.bar_chart_job(pv=pv, title_heb=title_template.format(pollutant_group, emission_type,
+                                                                                       col_name),
+                                                col_name=col_name, output_folder_name=output_folder_name,
+                                                legend=legend, is_x_rtl=True, is_log=is_log, compare_log=compare_log))
+    return jobs
+
+
+# Prepare dataframe for comparing accidental and non accidental emissions by emission type in one graphs.
+# Pivots are rolled up from the emission cube (computed from data if not given).
+# Returns the bar chart jobs, which are rendered by visualize.render_jobs
+def accident_non_acci_graph_generator(data, x_val_col, folder_name, is_log=True, cube=None):
+    jobs = []
     try:
-        working_directory = os.getcwd()
-        graph_folder_name = folder_name
-        if not os.path.isdir(graph_folder_name):
-            os.mkdir(graph_folder_name)
-        full_output_folder = working_directory + "\\" + graph_folder_name
-        os.chdir(full_output_folder)
-
-        # cleaned_df = data_value_cleaining(data)  # Corrects Nans and specific emission column data
-        emission_type_dfs, emission_type_dfs_val_list = dataframe_by_column_value_separator(dataframe=data,
-                                                                                            col="SugPlita",
-                                                                                            rename_df=True)
-        for dataframe in emission_type_dfs:
-            col_of = "KvutzatMezahamim"
-            df = dataframe.copy(deep=True)
-            df.name = dataframe.name
-            df.dropna(axis=0, how='any', subset=[col_of], inplace=True)
-            emission_polutent, emission_polutent_val_list = dataframe_by_column_value_separator(dataframe=df,
-                                                                                                col=col_of,
-                                                                                                rename_df=False)
-
-            for ind, dataframe in enumerate(emission_polutent):
-                data_frame = dataframe.copy(deep=True)
-                data_frame.name = dataframe.name
-                data_frame.reset_index(inplace=True)
-                emission_polutent[ind] = shorten_name(dataframe=data_frame, cols=["SugPeilutAtarSvivati"], how_short=40)
-            title_heb = "פליטה של {} בתאונות ובשגרה ל{} לפי {}"
-            visualize.accidents_with_non_acci(col_by=x_val_col, col_of=col_of, dataframes=emission_polutent,
-                                              title_template=title_heb,
-                                              col_name="מוצר", output_folder_name=full_output_folder, is_x_rtl=True,
-                                              is_log=is_log)
-            os.chdir(working_directory)
+        full_output_folder = output_folder("figures", folder_name)
+        if cube is None:
+            cube = emission_cube(data)
+        title_heb = "פליטה של {} בתאונות ובשגרה ל{} לפי {}"
+        # Only the comparison charts shorten activity types, the accident charts show the full labels
+        jobs = cube_bar_chart_jobs(cube=cube, x_val_col=x_val_col,
+                                   data_series=['KamutPlitaLoBeTeunot', 'KamutPlitaBeTeunot'],
+                                   title_template=title_heb, output_folder_name=full_output_folder,
+                                   legend=['כמות פליטה בשגרה', 'כמות פליטה בתאונות'], is_log=is_log,
+                                   shorten=["SugPeilutAtarSvivati"])
     except Exception as e:
-        os.chdir(working_directory)
-        print("Error during generating accidental and non accidental comparing visualization")
-        print(e)
+        report_error("Error during generating accidental and non accidental comparing visualization", e)
+    return jobs
 
 
-# Prepare dataframe for comparing accidental or non accidental emissions by emission type in two graph, one for accidents and one for non-accidents
-def accidental_graph_generator(data, x_val_col, folder_name, is_log=False):
+# Prepare dataframe for comparing accidental or non accidental emissions by emission type in two graph, one for accidents and one for non-accidents.
+# Pivots are rolled up from the emission cube (computed from data if not given).
+# Returns the bar chart jobs, which are rendered by visualize.render_jobs
+def accidental_graph_generator(data, x_val_col, folder_name, is_log=False, cube=None):
+    jobs = []
     try:
-        working_direcotry = os.getcwd()
         if is_log:
             folder_name += " log"
-        graph_folder_name = folder_name
-        if not os.path.isdir(graph_folder_name):
-            os.mkdir(graph_folder_name)
-        os.chdir(graph_folder_name)
-
-        cleaned_df = data_value_cleaining(data)  # Corrects Nans and specific emission column data
-        emission_type_dfs, emission_type_dfs_val_list = dataframe_by_column_value_separator(dataframe=cleaned_df,
-                                                                                            col="SugPlita",
-                                                                                            rename_df=True)
-        for dataframe in emission_type_dfs:
-            col_of = "KvutzatMezahamim"
-            df = dataframe.copy(deep=True)
-            df.name = dataframe.name
-            df.dropna(axis=0, how='any', subset=[col_of], inplace=True)
-            emission_polutent, emission_polutent_val_list = dataframe_by_column_value_separator(dataframe=df,
-                                                                                                col=col_of,
-                                                                                                rename_df=False)
-
-            for data_frame in emission_polutent:
-                data_frame.reset_index(inplace=True)
-
-            title_heb = "פליטה של {} בתאונות ל{} לפי {}"
-            visualize.accidents_or_non_acci(dataframes=emission_polutent, col_by=x_val_col, col_of=col_of,
-                                            title_template=title_heb, col_name="מוצר",
-                                            data_series=['KamutPlitaBeTeunot'],
-                                            is_x_rtl=True, is_log=is_log)
-        os.chdir(working_direcotry)
+        full_output_folder = output_folder("figures", folder_name)
+        if cube is None:
+            cleaned_df = data_value_cleaining(data)  # Cleans raw data, cleaned data is returned as is
+            cube = emission_cube(cleaned_df)
+        title_heb = "פליטה של {} בתאונות ל{} לפי {}"
+        jobs = cube_bar_chart_jobs(cube=cube, x_val_col=x_val_col, data_series=['KamutPlitaBeTeunot'],
+                                   title_template=title_heb, output_folder_name=full_output_folder, is_log=is_log)
     except Exception as e:
-        os.chdir(working_direcotry)
-        print("Error during generating accidental emmision visualization")
-        print(e)
-
-
-# Creates and saves bar charts comparing industry type or products by their amount of accidents and non accidental emissions
-def accidents_non_accidents_shotgun(data, x_val_col, is_log=False, output_folder="Output_files"):
-    current_directory = os.getcwd()
+        report_error("Error during generating accidental emmision visualization", e)
+    return jobs
+
+
+# Creates and saves bar charts comparing industry type or products by their amount of accidents and non accidental emissions.
+# Charts are rendered in parallel by a pool of workers processes (all CPUs if None).
+# The emission cube is shared by all the charts, computed from data if not given. The rows are never copied: charts
+# roll up cube slices, and only the small pivots of the jobs are sent to the workers. When traced, the memory of
+# the data, the cube and the job pivots is recorded in the span.
+@traced
+def accidents_non_accidents_shotgun(data, x_val_col, is_log=False, workers=None, cube=None):
+    jobs = []
+    if cube is None:
+        cube = emission_cube(data)
     try:
-        accident_non_acci_graph_generator(data=data, x_val_col=x_val_col,
-                                          folder_name=output_folder + "\\accidents compare to non-accidents graphs Log")
+        jobs += accident_non_acci_graph_generator(data=data, x_val_col=x_val_col,
+                                                  folder_name="accidents compare to non-accidents graphs Log",
+                                                  cube=cube)
     except Exception as e:
-        print("Error during brut-force emission visualization - comparing accidents and non accidents")
-        print(e)
+        report_error("Error during brut-force emission visualization - comparing accidents and non accidents", e)
     try:
-        accidental_graph_generator(data=data, x_val_col=x_val_col, folder_name=output_folder + "\\accidents graphs",
-                                   is_log=is_log)
+        jobs += accidental_graph_generator(data=data, x_val_col=x_val_col, folder_name="accidents graphs",
+                                           is_log=is_log, cube=cube)
     except Exception as e:
-        print("Error during brut-force emission visualization - accident data")
-        print(e)
+        report_error("Error during brut-force emission visualization - accident data", e)
     try:
-        accidental_graph_generator(data=data, x_val_col=x_val_col, folder_name=output_folder + "\\non accidents graphs",
-                                   is_log=is_log)
+        jobs += accidental_graph_generator(data=data, x_val_col=x_val_col, folder_name="non accidents graphs",
+                                           is_log=is_log, cube=cube)
     except Exception as e:
-        print("Error during brut-force emission visualization - non accident data")
-        print(e)
-    os.chdir(current_directory)
-
-
-# Formates data of intustry types and products and generates dot leaf and violin plots
-def accident_anaylsis(data, cutoff=0):
-    data = shorten_name(dataframe=data, cols=['SugPeilutAtarSvivati', 'TchumPeilutAtarSvivati', 'AnafAtarSvivati'],
-                        how_short=40)
-    try:
-        accidents = pivot_sort_clean(data=data,
-                                     by=['SugPeilutAtarSvivati', 'TchumPeilutAtarSvivati', 'AnafAtarSvivati'],
-                                     values=['KamutPlitaBeTeunot'])
-        accidents = accidents.reset_index()
-        non_accidents = pivot_sort_clean(data=data,
-                                         by=['SugPeilutAtarSvivati', 'TchumPeilutAtarSvivati', 'AnafAtarSvivati'],
-                                         values=['KamutPlitaLoBeTeunot'])
-        non_accidents = non_accidents.reset_index()
-
-        visualize.multi_feat_scatter(data=accidents, filename="Accidental Emissionsv All Data",
+        report_error("Error during brut-force emission visualization - non accident data", e)
+    if is_tracing():
+        annotate_span(data_mb=frame_mb(data), cube_mb=frame_mb(cube),
+                      jobs_mb=sum(frame_mb(job["pv"]) for job in jobs))
+    visualize.render_jobs(jobs, workers=workers)
+
+
+# Industry columns of the accident analysis, and the emissions of its outlier rankings with their chart titles
+industry_cols = ['SugPeilutAtarSvivati', 'TchumPeilutAtarSvivati', 'AnafAtarSvivati']
+ranked_emissions = {"KamutPlitaBeTeunot": "Accidental Emissions", "KamutPlitaLoBeTeunot": "Non Accidental Emissions"}
+
+
+# Accidental and non accidental emissions by industry, each sorted descending (pivots rolled up from the cube if given)
+@traced
+def industry_emission_rankings(data, cube=None):
+    rankings = {}
+    for emission in ranked_emissions:
+        ranking = pivot_sort_clean(data=data, by=industry_cols, values=[emission], cube=cube, shorten=industry_cols)
+        rankings[emission] = ranking.reset_index()
+    return rankings
+
+
+# Charts which do not depend on the outlier cutoff - scatter plots of all data and violin plots.
+# Returns the shared altair data file (None if altair_shared_data is False)
+def accident_full_data_charts(data, rankings, altair_shared_data=True):
+    data_url = None
+    if altair_shared_data:
+        emissions = pd.concat(rankings.values()).melt(id_vars=industry_cols, var_name="Emission",
+                                                      value_name="Amount").dropna(subset=["Amount"])
+        data_url = visualize.altair_dataset(data=emissions, name="emissions_by_industry")
+        visualize.multi_feat_scatter_shared(data_url=data_url, filename="Emissions All Data",
+                                            x_col='SugPeilutAtarSvivati', y_col='TchumPeilutAtarSvivati',
+                                            value_col="Amount", color_col='AnafAtarSvivati', type_col="Emission",
+                                            type_titles=ranked_emissions)
+    else:
+        visualize.multi_feat_scatter(data=rankings['KamutPlitaBeTeunot'], filename="Accidental Emissionsv All Data",
                                      x_col='SugPeilutAtarSvivati', y_col='TchumPeilutAtarSvivati',
                                      size_col='KamutPlitaBeTeunot', color_col='AnafAtarSvivati')
-        visualize.multi_feat_scatter(data=non_accidents, filename="Non Accidental Emissions All Data",
+        visualize.multi_feat_scatter(data=rankings['KamutPlitaLoBeTeunot'], filename="Non Accidental Emissions All Data",
                                      x_col='SugPeilutAtarSvivati', y_col='TchumPeilutAtarSvivati',
                                      size_col='KamutPlitaLoBeTeunot', color_col='AnafAtarSvivati')
 
-        visualize.violin_emissions(data=data, x_col='AnafAtarSvivati', y_col="KamutPlita", hue="Accidental", split=True,
-                                   figure_name="Emissions" + "-" + "AnafAtarSvivati",
-                                   fig_title="פליטה בתאונות ובשגרה לפי ענף תעשייתי", is_x_rtl=True)
-        visualize.violin_emissions(data=data, x_col='TchumPeilutAtarSvivati', y_col="KamutPlita", hue="Accidental",
-                                   split=True, figure_name="Emissions" + "-" + "TchumPeilutAtarSvivati",
-                                   fig_title="פליטה בתאונות ובשגרה לפי תחום תעשייתי", is_x_rtl=True)
-        visualize.violin_emissions(data=data, x_col='SugPeilutAtarSvivati', y_col="KamutPlita", hue="Accidental",
-                                   split=True, figure_name="Emissions" + "-" + "SugPeilutAtarSvivati",
-                                   fig_title="פליטה בתאונות ובשגרה לפי מוצר", is_x_rtl=True)
-
-        visualize.multi_feat_scatter(data=accidents.iloc[cutoff:], filename="Accidental Emissions",
+    visualize.violin_emissions(data=data, x_col='AnafAtarSvivati', y_col="KamutPlita", hue="Accidental", split=True,
+                               figure_name="Emissions" + "-" + "AnafAtarSvivati",
+                               fig_title="פליטה בתאונות ובשגרה לפי ענף תעשייתי", is_x_rtl=True)
+    visualize.violin_emissions(data=data, x_col='TchumPeilutAtarSvivati', y_col="KamutPlita", hue="Accidental",
+                               split=True, figure_name="Emissions" + "-" + "TchumPeilutAtarSvivati",
+                               fig_title="פליטה בתאונות ובשגרה לפי תחום תעשייתי", is_x_rtl=True)
+    visualize.violin_emissions(data=data, x_col='SugPeilutAtarSvivati', y_col="KamutPlita", hue="Accidental",
+                               split=True, figure_name="Emissions" + "-" + "SugPeilutAtarSvivati",
+                               fig_title="פליטה בתאונות ובשגרה לפי מוצר", is_x_rtl=True)
+    return data_url
+
+
+# Scatter plots of the emissions left after removing the top cutoff outliers.
+# file_suffix is added to the chart file names, so charts of different cutoffs do not overwrite each other
+def accident_cutoff_charts(rankings, cutoff, data_url=None, file_suffix=""):
+    if data_url is not None:
+        visualize.multi_feat_scatter_shared(data_url=data_url, filename="Emissions" + file_suffix,
+                                            x_col='SugPeilutAtarSvivati', y_col='TchumPeilutAtarSvivati',
+                                            value_col="Amount", color_col='AnafAtarSvivati', type_col="Emission",
+                                            type_titles=ranked_emissions, cutoff=cutoff)
+    else:
+        visualize.multi_feat_scatter(data=rankings['KamutPlitaBeTeunot'].iloc[cutoff:],
+                                     filename="Accidental Emissions" + file_suffix,
                                      x_col='SugPeilutAtarSvivati', y_col='TchumPeilutAtarSvivati',
                                      size_col='KamutPlitaBeTeunot', color_col='AnafAtarSvivati')
-        visualize.multi_feat_scatter(data=non_accidents.iloc[cutoff:], filename="Non Accidental Emissions",
+        visualize.multi_feat_scatter(data=rankings['KamutPlitaLoBeTeunot'].iloc[cutoff:],
+                                     filename="Non Accidental Emissions" + file_suffix,
                                      x_col='SugPeilutAtarSvivati', y_col='TchumPeilutAtarSvivati',
                                      size_col='KamutPlitaLoBeTeunot', color_col='AnafAtarSvivati')
 
-        if cutoff != 0:
-            print("Accidental emissions: top " + str(cutoff) + " outliers removed were:")
-            print(accidents.iloc[cutoff])
-            print("Non-Accidental emissions: top " + str(cutoff) + " outliers removed were:")
-            print(non_accidents.iloc[cutoff])
-    except Exception as e:
-        print("Error during emission violin-plot generation")
-        print(e)
-
 
-# User input whether cutoff of outlier removal was correct
-def accident_cutoff_check_ui(data, cutoff_val):
+# Prints the first emissions left after the cutoff
+def print_cutoff_outliers(rankings, cutoff):
+    if cutoff != 0:
+        print("Accidental emissions: top " + str(cutoff) + " outliers removed were:")
+        print(rankings['KamutPlitaBeTeunot'].iloc[cutoff])
+        print("Non-Accidental emissions: top " + str(cutoff) + " outliers removed were:")
+        print(rankings['KamutPlitaLoBeTeunot'].iloc[cutoff])
+
+
+# Summary of the emissions left after removing the top cutoff values, for each cutoff.
+# Sums of the sorted values (and of their squares) are computed once, so each cutoff takes constant time
+def cutoff_summary(ranking, emission, cutoffs):
+    values = ranking[emission].to_numpy(dtype=float)
+    total = values.sum()
+    tail_sum = np.append(np.cumsum(values[::-1])[::-1], 0)  # Sum of the values from each position to the end
+    tail_square_sum = np.append(np.cumsum(values[::-1] ** 2)[::-1], 0)
+    summary = []
+    for cutoff in cutoffs:
+        rows = len(values) - cutoff
+        if rows <= 0:
+            continue
+        mean = tail_sum[cutoff] / rows
+        summary.append({"emission": emission, "cutoff": cutoff, "rows": rows,
+                        "removed_share": 1 - tail_sum[cutoff] / total if total else 0, "max": values[cutoff],
+                        "mean": mean, "median": values[cutoff + rows // 2] if rows % 2 else
+                        (values[cutoff + rows // 2 - 1] + values[cutoff + rows // 2]) / 2,
+                        "std": np.sqrt(max(tail_square_sum[cutoff] / rows - mean ** 2, 0)),
+                        "max_to_mean": values[cutoff] / mean if mean else np.nan})
+    return summary
+
+
+# Top top_count emissions of a ranking with their rank, share of all emissions and cumulative share
+def ranked_outliers(ranking, emission, top_count):
+    outliers = ranking.iloc[:top_count].copy()
+    outliers.insert(0, "rank", np.arange(1, len(outliers) + 1))
+    share = outliers[emission] / ranking[emission].sum()
+    outliers["share"] = share.values
+    outliers["cumulative_share"] = share.cumsum().values
+    return outliers
+
+
+# Evaluates a list of outlier cutoffs without user input. Emissions by industry are sorted once, charts which do not
+# depend on the cutoff are rendered once, and the scatter plots of each cutoff are rendered (if render is True).
+# Saves the summary of each cutoff and the ranked outliers (top of the largest cutoff) as csv, and returns the summary
+@traced
+def outlier_sweep(data, cutoffs, cube=None, altair_shared_data=True, render=True):
+    summary = None
     try:
-        Flag = True
-        while Flag:
-            print("Is the cutoff of " + str(cutoff_val) + " removing enough of the outliers? y/n")
-            input_val = input()
-            if input_val == "y":
-                Flag = False
-                return cutoff_val
-            elif input_val == "n":
-                Flag = False
-                cutoff_val = accident_analysis_ui(data)
-                return cutoff_val
-            else:
-                print("Input should be y or n")
+        data = shorten_name(dataframe=data, cols=industry_cols, how_short=40)
+        rankings = industry_emission_rankings(data=data, cube=cube)
+        summary = []
+        outliers = []
+        for emission, ranking in rankings.items():
+            summary += cutoff_summary(ranking=ranking, emission=emission, cutoffs=cutoffs)
+            emission_outliers = ranked_outliers(ranking=ranking, emission=emission, top_count=max(cutoffs))
+            outliers.append(emission_outliers.rename(columns={emission: "Amount"}).assign(emission=emission))
+        summary = pd.DataFrame(summary)
+        print("Outlier cutoff summary:")
+        print(summary)
+        export_to_csv(dataframe=summary, save_file_name="outlier cutoff summary ")
+        export_to_csv(dataframe=pd.concat(outliers, ignore_index=True), save_file_name="ranked outliers ")
+    except Exception as e:
+        report_error("Error during outlier cutoff sweep", e)
+        return summary
+
+    if render:
+        try:
+            data_url = accident_full_data_charts(data=data, rankings=rankings, altair_shared_data=altair_shared_data)
+            for cutoff in cutoffs:
+                accident_cutoff_charts(rankings=rankings, cutoff=cutoff, data_url=data_url,
+                                       file_suffix=" cutoff " + str(cutoff))
+        except Exception as e:
+            report_error("Error during emission violin-plot generation", e)
+    return summary
+
+
+# Formates data of intustry types and products and generates dot leaf and violin plots.
+# Pivots are rolled up from the emission cube if given.
+# With altair_shared_data the scatter plots of all data and of the cutoff use one data file, and the cutoff is a filter
+# in the chart, instead of each html having its own copy of the data
+@traced
+def accident_anaylsis(data, cutoff=0, cube=None, altair_shared_data=True):
+    data = shorten_name(dataframe=data, cols=industry_cols, how_short=40)
+    try:
+        rankings = industry_emission_rankings(data=data, cube=cube)
+        data_url = accident_full_data_charts(data=data, rankings=rankings, altair_shared_data=altair_shared_data)
+        accident_cutoff_charts(rankings=rankings, cutoff=cutoff, data_url=data_url)
+        print_cutoff_outliers(rankings=rankings, cutoff=cutoff)
     except Exception as e:
-        print("Error during outlier cutoff setting")
-        print(e)
+        report_error("Error during emission violin-plot generation", e)
 
 
-# Top outlier removal by cutoff input and check
-def accident_analysis_ui(data):
+# User input whether cutoff of outlier removal was correct
+def accident_cutoff_check_ui(cutoff_val):
+    while True:
+        print("Is the cutoff of " + str(cutoff_val) + " removing enough of the outliers? y/n")
+        input_val = input()
+        if input_val == "y":
+            return True
+        elif input_val == "n":
+            return False
+        else:
+            print("Input should be y or n")
+
+
+# User input of the number of top outliers to remove
+def cutoff_input_ui(data):
+    while True:
+        try:
+            print("Enter how many of the top out-layers to remove")
+            input_val = int(input())
+            if input_val > 0 and input_val < data.size:
+                return input_val
+            print("Input should be a number between 1 and " + str(data.size))
+        except ValueError:
+            print("Input should be a number between 1 and " + str(data.size))
+
+
+# Top outlier removal by cutoff input and check, repeated until the cutoff is confirmed.
+# Emissions are sorted and charts which do not depend on the cutoff are rendered once, before the first cutoff
+def accident_analysis_ui(data, cube=None, altair_shared_data=True):
     try:
         print("All Emissions Description:")
         emmisions_desc = data[['KamutPlita', 'KamutPlitaLoBeTeunot', 'KamutPlitaBeTeunot']].describe()
         print(emmisions_desc)
 
-        Flag = True
-        while Flag:
-            try:
-                print("Enter how many of the top out-layers to remove")
-                input_val = int(input())
-                if input_val > 0 and input_val < data.size:
-                    Flag = False
-                else:
-                    print("Input should be a number between 1 and " + str(data.size))
-            except ValueError:
-                print("Input should be a number between 1 and " + str(data.size))
-        accident_anaylsis(data=data, cutoff=input_val)
-        cutoff_val = accident_cutoff_check_ui(data, cutoff_val=input_val)
-        return cutoff_val
+        data = shorten_name(dataframe=data, cols=industry_cols, how_short=40)
+        rankings = industry_emission_rankings(data=data, cube=cube)
+        data_url = accident_full_data_charts(data=data, rankings=rankings, altair_shared_data=altair_shared_data)
+        while True:
+            cutoff_val = cutoff_input_ui(data)
+            accident_cutoff_charts(rankings=rankings, cutoff=cutoff_val, data_url=data_url)
+            print_cutoff_outliers(rankings=rankings, cutoff=cutoff_val)
+            if accident_cutoff_check_ui(cutoff_val):
+                return cutoff_val
     except Exception as e:
-        print("Error in outlier cutoff dialog")
-        print(e)
+        report_error("Error in outlier cutoff dialog", e)
 
 
-def industry_geoloc(data, city_col, industry_col, pivot_by, values, output_folder_name="Output_files"):
+# Cities missing from the geocode store are geocoded by the geocoder (Nominatim api if None).
+# If single_document is True, the circle maps of all industries are one map with an industry selector.
+# store_file_name is the geocode store file (city_geocodes.json in the output folder if None)
+@traced
+def industry_geoloc(data, city_col, industry_col, pivot_by, values, geocoder=None, single_document=True,
+                    store_file_name=None):
     try:
         # Translate cities to geolocations
-        geoloc = geoloc_loader(data=data, city_col=city_col)
+        geocode_store = geoloc_loader(data=data, city_col=city_col, store_file_name=store_file_name,
+                                      geocoder=geocoder)
     except Exception as e:
-        print("Error during geolocation retrieval")
-        print(e)
-    current_folder = os.getcwd()
+        report_error("Error during geolocation retrieval", e)
 
     try:
-        # Add geolocation column
-        data_geoloc = pd.merge(data, geoloc, left_on=city_col, right_on="yeshuv", how='left')
-        # Separates geolocation column into lat lon and alt
-        data_geoloc[['latitude', 'longitude', 'altitude']] = pd.DataFrame(data_geoloc['point'].tolist(),
-                                                                          index=data_geoloc.index)
+        # Add geolocation columns to a shallow copy, data columns are shared and not copied
+        data_geoloc = data.copy(deep=False)
+        data_geoloc['latitude'], data_geoloc['longitude'] = geocode_lookup(geocode_store, data[city_col])
         # Remove NaN as map ha trouble with it
         data_geoloc.dropna(axis=0, how='any', subset=['latitude', 'longitude'], inplace=True)
 
@@ -276,34 +417,82 @@ def industry_geoloc(data, city_col, industry_col, pivot_by, values, output_folde
                                                                                  col=industry_col, rename_df=True)
 
     except Exception as e:
-        print("Error during geoloc data addition to main data")
-        print(e)
+        report_error("Error during geoloc data addition to main data", e)
 
     try:
         visualize.industry_map(data_list=category_df, data_values_list=category_dfs_val_list, industry_col=industry_col)
     except Exception as e:
-        print("Error during map visualization with dots (folium)")
-        print(e)
+        report_error("Error during map visualization with dots (folium)", e)
 
     try:
         pivots = []
         for df in category_df:
             df = df.sample(frac=1).drop_duplicates(['MisparTaagidShutfutMenifa'])
-            pv = pd.pivot_table(data=df, values=values, index=[pivot_by, 'latitude', 'longitude'], aggfunc="count")
+            pv = pd.pivot_table(data=df, values=values, index=[pivot_by, 'latitude', 'longitude'], aggfunc="count",
+                                observed=True)
             pv = pv.reset_index()
             pivots.append(pv)
 
         visualize.industry_size_map(data_list=pivots, data_values_list=category_dfs_val_list,
-                                    industry_col=industry_col)
+                                    industry_col=industry_col, single_document=single_document)
+    except Exception as e:
+        report_error("Error during map visualization with circles (bokeh)", e)
+
+
+# Finds industrial geographical clusters - places with at least min_size factories within eps_km (DBSCAN).
+# Saves cluster summaries and emissions by pollutant group as csv, and maps emission of value by cluster for each
+# pollutant group. A sweep of the cluster count over radiuses and minimal sizes is saved too if sweep_eps is given
+@traced
+def industry_clusters(data, city_col, eps_km=5, min_size=5, value="KamutPlita", by="KvutzatMezahamim",
+                      sweep_eps=None, sweep_min_sizes=(3, 5, 10, 20), geocoder=None, store_file_name=None):
+    try:
+        geocode_store = geoloc_loader(data=data, city_col=city_col, store_file_name=store_file_name,
+                                      geocoder=geocoder)
+        data_geoloc = data.copy(deep=False)
+        data_geoloc['latitude'], data_geoloc['longitude'] = geocode_lookup(geocode_store, data[city_col])
+    except Exception as e:
+        report_error("Error during geolocation retrieval", e)
+        return
+
+    try:
+        if sweep_eps is not None:
+            sweep = cluster_sweep(data=data_geoloc, eps_values=sweep_eps, min_sizes=sweep_min_sizes)
+            export_to_csv(dataframe=sweep, save_file_name="industry cluster sweep ")
+        clustered = factory_clusters(data=data_geoloc, eps_km=eps_km, min_size=min_size)
+        summary = cluster_summary(clustered=clustered, values=cube_values, city_col=city_col)
+        emissions = cluster_emissions(clustered=clustered, values=cube_values, by=by)
+        export_to_csv(dataframe=summary, save_file_name="industry clusters %g km %d factories " % (eps_km, min_size))
+        export_to_csv(dataframe=emissions,
+                      save_file_name="industry cluster emissions %g km %d factories " % (eps_km, min_size))
+        print("%d industrial clusters found" % len(summary))
+    except Exception as e:
+        report_error("Error during industrial clustering", e)
+        return
+    if len(summary) == 0:
+        return  # No clusters to map
+
+    try:
+        data_list, data_values_list = cluster_map_frames(summary=summary, emissions=emissions, value=value, by=by)
+        if data_list != []:  # Empty when no cluster has emissions of value
+            visualize.industry_size_map(data_list=data_list, data_values_list=data_values_list, industry_col=value,
+                                        size_col="size", size_scale=1, single_document=True,
+                                        file_name="map clusters %g km %s" % (eps_km, value))
+    except Exception as e:
+        report_error("Error during cluster map visualization with circles (bokeh)", e)
+
+    try:
+        members = clustered.loc[clustered["cluster"] != -1]
+        visualize.industry_map(data_list=[members], data_values_list=["clusters %g km" % eps_km],
+                               industry_col="industrial")
     except Exception as e:
-        print("Error during map visualization with circles (bokeh)")
-        print(e)
-    os.chdir(current_folder)
+        report_error("Error during cluster map visualization with dots (folium)", e)
 
 
-# Subset dataframe to plot waste production during last year
+# Subset dataframe to plot waste production during last year. Total columns are added to a copy, data is not changed
+@traced
 def waste(data):
     try:
+        data = data.copy(deep=False)
         data["total_dangerous_waste"] = data["SachTipulPsoletLoMesukenet"] + data["SachSilukPsoletLoMesukenet"]
         data["total_non_dangerous_waste"] = data["SachTipulPsoletLoMesukenet"] + data["SachSilukPsoletLoMesukenet"]
         data["total_waste"] = data["total_dangerous_waste"] + data["total_non_dangerous_waste"]
@@ -312,5 +501,4 @@ def waste(data):
         data_last_year = data.mask(mask)
         visualize.waste_graph(data_last_year)
     except Exception as e:
-        print("Error during waste visualization generation")
-        print(e)
+        report_error("Error during waste visualization generation", e)
@@ -0,0 +1,215 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+import pandas as pd
+
+##############################
+# Industrial geographical    #
+# clusters                   #
+##############################
+
+earth_radius_km = 6371.0
+km_per_degree = earth_radius_km * np.pi / 180  # Along a meridian
+
+
+# Great circle distance in km between points given in degrees (numpy arrays are broadcast)
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(np.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = np.sin((latitude2 - latitude1) / 2) ** 2 + \
+        np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+# Spatial grid index - points sorted by square cells of at least cell_km on each side.
+# Returns the cell key of each point, the point positions sorted by cell key, the sorted keys and the key of one row step
+def grid_index(latitude, longitude, cell_km):
+    lon_km_per_degree = km_per_degree * np.cos(np.radians(np.abs(latitude).max()))  # Narrowest cell, furthest from equator
+    rows = np.floor(latitude * km_per_degree / cell_km).astype(np.int64)
+    cols = np.floor(longitude * lon_km_per_degree / cell_km).astype(np.int64)
+    row_step = cols.max() - cols.min() + 3  # Margin columns, so a column step never wraps into the next row
+    keys = (rows - rows.min() + 1) * row_step + (cols - cols.min() + 1)
+    order = np.argsort(keys, kind="stable")
+    return keys, order, keys[order], row_step
+
+
+# Cells after a cell in grid order which can hold its neighbors, so each pair of cells is compared once
+half_neighborhood = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+# All pairs of points which are at most eps_km apart, found by comparing points of neighboring grid cells only
+def neighbor_pairs(latitude, longitude, eps_km):
+    keys, order, sorted_keys, row_step = grid_index(latitude, longitude, eps_km)
+    first = [np.empty(0, dtype=np.int64)]
+    second = [np.empty(0, dtype=np.int64)]
+    for d_row, d_col in half_neighborhood:
+        # Candidate pairs - each point with every point of the neighbor cell
+        neighbor_keys = keys + d_row * row_step + d_col
+        starts = np.searchsorted(sorted_keys, neighbor_keys, side="left")
+        counts = np.searchsorted(sorted_keys, neighbor_keys, side="right") - starts
+        points = np.repeat(np.arange(len(keys)), counts)
+        within_cell = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        others = order[np.repeat(starts, counts) + within_cell]
+        if (d_row, d_col) == (0, 0):  # Pairs within a cell once, without pairs of a point with itself
+            keep = points < others
+            points, others = points[keep], others[keep]
+        near = haversine_km(latitude[points], longitude[points], latitude[others], longitude[others]) <= eps_km
+        first.append(points[near])
+        second.append(others[near])
+    return np.concatenate(first), np.concatenate(second)
+
+
+# Root of each point after joining the pairs (union find with path halving)
+def connected_roots(point_count, first, second):
+    parent = np.arange(point_count)
+
+    def root(point):
+        while parent[point] != point:
+            parent[point] = parent[parent[point]]
+            point = parent[point]
+        return point
+
+    for point1, point2 in zip(first, second):
+        root1, root2 = root(point1), root(point2)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+    return np.array([root(point) for point in range(point_count)], dtype=np.int64)
+
+
+# DBSCAN cluster labels of points from their neighbor pairs. A point is a core point if the weight of its neighborhood
+# (itself included) is at least min_size. Core neighbors are in the same cluster, and other points next to a core point
+# join its cluster. Noise is labeled -1, clusters are numbered from the heaviest
+def dbscan_labels(weights, first, second, min_size):
+    weights = np.asarray(weights, dtype=float)
+    neighborhood_weight = weights.copy()
+    np.add.at(neighborhood_weight, first, weights[second])
+    np.add.at(neighborhood_weight, second, weights[first])
+    core = neighborhood_weight >= min_size
+
+    core_pairs = core[first] & core[second]
+    roots = connected_roots(len(weights), first[core_pairs], second[core_pairs])
+    labels = np.where(core, roots, -1)
+    # Border points join the cluster of their first core neighbor
+    border = np.concatenate([first[core[second] & ~core[first]], second[core[first] & ~core[second]]])
+    border_core = np.concatenate([second[core[second] & ~core[first]], first[core[first] & ~core[second]]])
+    border, first_core = np.unique(border, return_index=True)
+    labels[border] = roots[border_core[first_core]]
+
+    clustered = labels != -1
+    cluster_roots, cluster_ind = np.unique(labels[clustered], return_inverse=True)
+    cluster_weight = np.bincount(cluster_ind, weights=weights[clustered])
+    rank = np.empty(len(cluster_roots), dtype=np.int64)
+    rank[np.argsort(-cluster_weight, kind="stable")] = np.arange(len(cluster_roots))
+    labels[clustered] = rank[cluster_ind]
+    return labels
+
+
+# DBSCAN clustering of points by haversine distance, with a grid index for neighbor search.
+# weights counts each point as several points (factories sharing a city location)
+def dbscan_haversine(latitude, longitude, eps_km, min_size, weights=None):
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    if weights is None:
+        weights = np.ones(len(latitude))
+    first, second = neighbor_pairs(latitude, longitude, eps_km)
+    return dbscan_labels(weights, first, second, min_size)
+
+
+# Locations of the factories of geocoded data, each location with its number of factories
+def factory_locations(data, site_col="MisparTaagidShutfutMenifa"):
+    located = data.dropna(axis=0, how='any', subset=["latitude", "longitude"])
+    sites = located.drop_duplicates([site_col])
+    locations = sites.groupby(["latitude", "longitude"]).size().reset_index(name="factories")
+    return locations
+
+
+# Adds a cluster column to geocoded data (rows without location are removed), -1 for factories which are not clustered.
+# Clusters are places with at least min_size factories within eps_km
+def factory_clusters(data, eps_km=5, min_size=5, site_col="MisparTaagidShutfutMenifa"):
+    locations = factory_locations(data, site_col=site_col)
+    locations["cluster"] = dbscan_haversine(locations["latitude"].values, locations["longitude"].values,
+                                            eps_km=eps_km, min_size=min_size, weights=locations["factories"].values)
+    located = data.dropna(axis=0, how='any', subset=["latitude", "longitude"])
+    clustered = located.merge(locations[["latitude", "longitude", "cluster"]], on=["latitude", "longitude"],
+                              how="left")
+    return clustered
+
+
+# Cluster count and sizes for each radius and minimal cluster size. Neighbors are found once for each radius
+def cluster_sweep(data, eps_values, min_sizes, site_col="MisparTaagidShutfutMenifa"):
+    locations = factory_locations(data, site_col=site_col)
+    latitude = locations["latitude"].values
+    longitude = locations["longitude"].values
+    weights = locations["factories"].values
+    sweep = []
+    for eps_km in eps_values:
+        first, second = neighbor_pairs(latitude, longitude, eps_km)
+        for min_size in min_sizes:
+            labels = dbscan_labels(weights, first, second, min_size)
+            cluster_factories = np.bincount(labels[labels != -1], weights=weights[labels != -1])
+            sweep.append({"eps_km": eps_km, "min_size": min_size, "clusters": len(cluster_factories),
+                          "clustered_factories": int(cluster_factories.sum()),
+                          "noise_factories": int(weights[labels == -1].sum()),
+                          "largest_cluster": int(cluster_factories.max()) if len(cluster_factories) else 0})
+    return pd.DataFrame(sweep)
+
+
+# Summary of each cluster - centroid of its factories, radius (km from centroid to the furthest factory),
+# factory count, its cities from the one with most factories, and emission totals of values
+def cluster_summary(clustered, values, city_col="YeshuvAtarSvivatiMenifa", site_col="MisparTaagidShutfutMenifa"):
+    members = clustered.loc[clustered["cluster"] != -1]
+    sites = members.drop_duplicates([site_col])
+    summary = sites.groupby("cluster").agg(latitude=("latitude", "mean"), longitude=("longitude", "mean"),
+                                           factories=(site_col, "size"))
+    sites_centroid = summary.loc[sites["cluster"]]
+    sites_distance = haversine_km(sites["latitude"].values, sites["longitude"].values,
+                                  sites_centroid["latitude"].values, sites_centroid["longitude"].values)
+    summary["radius_km"] = pd.Series(sites_distance).groupby(sites["cluster"].values).max()
+    summary["cities"] = sites.groupby("cluster")[city_col].agg(
+        lambda cities: ", ".join(cities.value_counts().loc[lambda counts: counts > 0].index))
+    summary[values] = members.groupby("cluster")[values].sum()
+    return summary
+
+
+# Emission totals of values for each cluster and each value of by (pollutant group)
+def cluster_emissions(clustered, values, by="KvutzatMezahamim"):
+    members = clustered.loc[clustered["cluster"] != -1]
+    return members.groupby(["cluster", by], observed=True)[values].sum().sort_index()
+
+
+# Map input of clusters for visualize.industry_size_map - for each value of by a dataframe of the clusters
+# (centroid, names of cities in YeshuvAtarSvivatiMenifa, emission total of value and marker size), and the by values.
+# Marker sizes are 5 to max_size, by the square root of emissions
+def cluster_map_frames(summary, emissions, value, by="KvutzatMezahamim", max_size=50):
+    data_list = []
+    data_values_list = []
+    by_emissions = emissions[value].unstack(by)
+    for by_value in by_emissions.columns:
+        frame = summary[["latitude", "longitude"]].copy()
+        frame["YeshuvAtarSvivatiMenifa"] = ["%d: %s" % (cluster, cities[0:60]) for cluster, cities in
+                                            summary["cities"].items()]
+        frame[value] = by_emissions[by_value]
+        frame = frame.loc[frame[value] > 0]
+        if frame.empty:
+            continue
+        frame["size"] = 5 + (max_size - 5) * np.sqrt(frame[value] / frame[value].max())
+        data_list.append(frame.reset_index())
+        data_values_list.append(str(by_value))
+    return data_list, data_values_list
@@ -18,15 +18,24 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
+import difflib
+import functools
+import json
 import multiprocessing
 import os
+import re
+import time
+import unicodedata
 
 import geopy
+import numpy as np
 import pandas as pd
 from geopy.extra.rate_limiter import RateLimiter
+from geopy.location import Location
 
-from load_data import load_data_from_pickle
-from save_data import save_as_pickel
+from async_geocoder import async_geocoder
+from instrumentation import report_error, traced
+from output_paths import input_path, output_path
 
 
 #######################
@@ -40,35 +49,264 @@ def convert_city_to_geoloc_multithreading(data, city_col):
     geoloc_df["Yeshuv"] = data[city_col].unique()
     geoloc_df.dropna(axis=0, how='any', inplace=True)
     geoloc_list = geoloc_df["Yeshuv"].to_list()
-    locator = geopy.Nominatim(country_bias='Israel', user_agent="myGeocoder", timeout=4)
-    geocode_rate_limited = RateLimiter(locator.geocode,
+    locator = geopy.Nominatim(user_agent="myGeocoder", timeout=4)
+    geocode_rate_limited = RateLimiter(functools.partial(locator.geocode, country_codes=nominatim_country_codes),
                                        min_delay_seconds=1.5)  # delay between geocoding calls, pre-requisite of API
     pool = multiprocessing.Pool(processes=1)  # multiprocessing.cpu_count() gives 12 CPUs
     addresses = pool.map(geocode_rate_limited, geoloc_list)
     return addresses
 
 
-def convert_city_to_geoloc(data, city_col):
+# City names of data and their geolocations, by the geocoder (Nominatim api if None)
+def convert_city_to_geoloc(data, city_col, geocoder=None):
+    if geocoder is None:
+        geocoder = nominatim_geocoder()
     geoloc_df = pd.DataFrame()
     geoloc_df["yeshuv"] = data[city_col].unique()
     geoloc_df.dropna(axis=0, how='any', inplace=True)
-    locator = geopy.Nominatim(country_bias='Israel', user_agent="myGeocoder", timeout=4)
-    geocode = RateLimiter(locator.geocode, min_delay_seconds=1.5)  # delay between geocoding calls, pre-requisite of API
-    geoloc_df['location'] = geoloc_df['yeshuv'].apply(geocode)  # create location column
+    locations = dict(geocoder(geoloc_df['yeshuv'].to_list()))
+    geoloc_df['location'] = geoloc_df['yeshuv'].map(locations)  # create location column
     geoloc_df['point'] = geoloc_df['location'].apply(lambda loc: tuple(
         loc.point) if loc else None)  # create longitude, laatitude and altitude from location column (returns tuple)
     return geoloc_df
 
 
-def geoloc_loader(data, city_col):
-    pickel_name = "city_geolocations"
-    if 'latitude' in data.columns:
-        pass
-    elif os.path.isfile(os.getcwd() + "\\" + pickel_name + ".pkl"):
-        geoloc = load_data_from_pickle(pickle_file_name=pickel_name)
+#######################
+# Geocoders           #
+#######################
+
+# A geocoder gets a list of unique city names and yields (city name, location) pairs.
+# location is a geopy location, or None if the city was not found. Geocoders are made by the functions in geocoders.
+
+# Nominatim results are limited to these countries (geopy 2 has no country_bias option)
+nominatim_country_codes = "il"
+
+
+# Geocoder sending one city at a time to the Nominatim api, with min_delay_seconds between calls as required by the api
+# (parallel calls are not allowed). Stops at the first api error, the remaining cities are not yielded.
+# The api client is made when the first city is geocoded, so runs where all cities are in the geocode store never make
+# it, and an error making it stops geocoding like an api error
+def nominatim_geocoder(min_delay_seconds=1.5, timeout=4):
+    client = {}
+
+    def geocoder(city_names):
+        for city_name in city_names:
+            try:
+                if "geocode" not in client:
+                    locator = geopy.Nominatim(user_agent="myGeocoder", timeout=timeout)
+                    client["geocode"] = RateLimiter(
+                        functools.partial(locator.geocode, country_codes=nominatim_country_codes),
+                        min_delay_seconds=min_delay_seconds, swallow_exceptions=False)
+                location = client["geocode"](city_name)
+            except Exception as e:
+                report_error("Geocoding stopped at " + str(city_name), e)
+                return
+            yield city_name, location
+
+    return geocoder
+
+
+# Spelling skeleton of a normalized city name - without punctuation and spaces, and with doubled vav and yod made single
+# (full and defective Hebrew spelling), so spelling variants of a name have the same skeleton
+def city_name_skeleton(key):
+    skeleton = re.sub(r"[\s\-'\"().,]", "", key)
+    skeleton = skeleton.replace("וו", "ו").replace("יי", "י")
+    return skeleton
+
+
+# Load a gazetteer of localities, one row for each name variant with its normalized key and skeleton.
+# The file is a csv with name, latitude and longitude columns (optional altitude, and variants column of names separated
+# by |), or a pickle of the legacy geocodes (yeshuv and point columns).
+def load_gazetteer(gazetteer_file_name):
+    if gazetteer_file_name.endswith(".pkl"):
+        legacy = pd.read_pickle(gazetteer_file_name).dropna(axis=0, how='any', subset=["point"])
+        gazetteer = pd.DataFrame(legacy["point"].tolist(), columns=["latitude", "longitude", "altitude"])
+        gazetteer["name"] = legacy["yeshuv"].to_list()
     else:
-        geoloc_df = convert_city_to_geoloc(data=data, city_col=city_col)
-        save_as_pickel(dataframe=geoloc_df, save_file_name=pickel_name)
-        geoloc = load_data_from_pickle(pickle_file_name=pickel_name)
-    # geoloc_dict = dict(zip(geoloc["yeshuv"], geoloc['point']))
-    return geoloc
+        gazetteer = pd.read_csv(gazetteer_file_name, encoding="utf-8")
+        if "altitude" not in gazetteer.columns:
+            gazetteer["altitude"] = 0.0
+    gazetteer["address"] = gazetteer["name"]
+    if "variants" in gazetteer.columns:
+        gazetteer["name"] = (gazetteer["name"] + "|" + gazetteer["variants"].fillna("")).str.split("|")
+        gazetteer = gazetteer.explode("name")
+        gazetteer = gazetteer.loc[gazetteer["name"].str.strip() != ""]
+    gazetteer["key"] = gazetteer["name"].map(normalize_city_name)
+    gazetteer["skeleton"] = gazetteer["key"].map(city_name_skeleton)
+    gazetteer = gazetteer.drop_duplicates(["key"]).reset_index(drop=True)
+    return gazetteer[["name", "key", "skeleton", "address", "latitude", "longitude", "altitude"]]
+
+
+# Geocoder looking up cities in a local gazetteer (the legacy geocodes if None), without network access.
+# All names are matched at once by normalized name, then unmatched names by spelling skeleton,
+# and the rest by the closest skeleton (difflib ratio of at least fuzzy_cutoff)
+def gazetteer_geocoder(gazetteer_file_name=None, fuzzy_cutoff=0.85):
+    if gazetteer_file_name is None:
+        gazetteer_file_name = input_path(legacy_geocode_name + ".pkl")
+    gazetteer = load_gazetteer(gazetteer_file_name)
+    key_index = pd.Index(gazetteer["key"])
+    skeleton_rows = gazetteer.drop_duplicates(["skeleton"])
+    skeleton_index = pd.Index(skeleton_rows["skeleton"])
+    skeleton_list = skeleton_index.to_list()
+
+    def geocoder(city_names):
+        keys = pd.Series(city_names, dtype=object).map(normalize_city_name)
+        rows = key_index.get_indexer(keys)
+        unmatched = np.flatnonzero(rows == -1)
+        skeletons = keys.iloc[unmatched].map(city_name_skeleton)
+        skeleton_matches = skeleton_index.get_indexer(skeletons)
+        for ind, skeleton, match in zip(unmatched, skeletons, skeleton_matches):
+            if match == -1:
+                close = difflib.get_close_matches(skeleton, skeleton_list, n=1, cutoff=fuzzy_cutoff)
+                if close == []:
+                    continue
+                match = skeleton_index.get_loc(close[0])
+            rows[ind] = skeleton_rows.index[match]
+        for city_name, row in zip(city_names, rows):
+            location = None
+            if row != -1:
+                place = gazetteer.iloc[row]
+                location = Location(place["address"], (place["latitude"], place["longitude"], place["altitude"]), {})
+            yield city_name, location
+
+    return geocoder
+
+
+# Geocoder makers by name. async_geocoder calls a self-hosted server, with concurrent rate limited calls
+geocoders = {"nominatim": nominatim_geocoder, "gazetteer": gazetteer_geocoder, "async": async_geocoder}
+
+
+#######################
+# Geocode store       #
+#######################
+
+# Geocodes are stored per city in a json file, so only cities which were not geocoded before are sent to the api.
+# Cities the api could not find are stored too (no coordinates), and are retried after negative_ttl seconds.
+geocode_store_name = "city_geocodes.json"
+legacy_geocode_name = "city_geolocations"
+negative_ttl = 30 * 24 * 60 * 60
+
+
+# Store key of a city name - unicode normal form, single spaces and one form of hyphen and of Hebrew quote marks
+def normalize_city_name(city_name):
+    name = unicodedata.normalize("NFC", str(city_name)).strip().lower()
+    name = re.sub(r"\s+", " ", name)
+    name = re.sub(r"\s*[-\u05be\u2010-\u2015]\s*", "-", name)
+    name = re.sub("[\u05f3\u2019`]", "'", name)
+    name = re.sub("[\u05f4\u201c\u201d]", '"', name)
+    return name
+
+
+# Store entry of a geocoding result, location is a geopy location or None if the city was not found
+def geocode_entry(city_name, location, resolved_at=None):
+    if resolved_at is None:
+        resolved_at = time.time()
+    entry = {"name": city_name, "latitude": None, "longitude": None, "altitude": None, "address": None,
+             "resolved_at": resolved_at}
+    if location:
+        entry.update({"latitude": location.latitude, "longitude": location.longitude,
+                      "altitude": location.altitude, "address": location.address})
+    return entry
+
+
+# Geocodes saved by the original all-or-nothing loader (city_geolocations.pkl), as store entries
+def legacy_geocode_entries(pickle_file_name):
+    legacy = pd.read_pickle(pickle_file_name)
+    resolved_at = os.path.getmtime(pickle_file_name)
+    store = {}
+    for city_name, location in zip(legacy["yeshuv"], legacy["location"]):
+        store[normalize_city_name(city_name)] = geocode_entry(city_name, location, resolved_at=resolved_at)
+    return store
+
+
+# Load the geocode store, which starts from the legacy geocodes if there is no store yet.
+# Resolve times in the future (clock changes, edited stores) are clamped to now, so negative entries still expire
+def load_geocode_store(store_file_name):
+    if os.path.isfile(store_file_name):
+        with open(store_file_name, "r", encoding="utf-8") as file1:
+            store = json.load(file1)
+        now = time.time()
+        for entry in store.values():
+            entry["resolved_at"] = min(entry["resolved_at"], now)
+        return store
+    legacy_file_name = input_path(legacy_geocode_name + ".pkl")
+    if os.path.isfile(legacy_file_name):
+        return legacy_geocode_entries(legacy_file_name)
+    return {}
+
+
+# Save the geocode store. It is written to a temporary file and then replaced, so an interrupted save keeps the old store
+def save_geocode_store(store, store_file_name):
+    with open(store_file_name + ".tmp", "w", encoding="utf-8") as file1:
+        json.dump(store, file1, ensure_ascii=False, indent=1)
+    os.replace(store_file_name + ".tmp", store_file_name)
+
+
+# True if the store has coordinates for the key, or a negative entry which is not older than negative_ttl
+def is_geocode_current(store, key, ttl=negative_ttl, now=None):
+    entry = store.get(key)
+    if entry is None:
+        return False
+    if entry["latitude"] is not None:
+        return True
+    if now is None:
+        now = time.time()
+    return now - entry["resolved_at"] < ttl
+
+
+# Unique city names (first spelling of each key) which are missing from the store or have an expired negative entry
+def missing_cities(store, city_names, ttl=negative_ttl):
+    now = time.time()
+    missing = {}
+    for city_name in pd.Series(city_names).dropna().unique():
+        key = normalize_city_name(city_name)
+        if key not in missing and not is_geocode_current(store, key, ttl=ttl, now=now):
+            missing[key] = city_name
+    return list(missing.values())
+
+
+# Geocode cities by the geocoder (Nominatim api if None) and add them to the store.
+# The store is saved every save_seconds while geocoding, so an interrupted run keeps the cities geocoded so far.
+# Cities the geocoder did not yield (api error) are not stored, and are tried again on the next run
+@traced
+def geocode_missing_cities(store, city_names, store_file_name, geocoder=None, save_seconds=5):
+    if city_names == []:
+        return store
+    if geocoder is None:
+        geocoder = nominatim_geocoder()
+    print("Geocoding %d cities" % len(city_names))
+    last_save = time.time()
+    for city_name, location in geocoder(city_names):
+        store[normalize_city_name(city_name)] = geocode_entry(city_name, location)
+        if time.time() - last_save > save_seconds:
+            save_geocode_store(store, store_file_name)
+            last_save = time.time()
+    save_geocode_store(store, store_file_name)
+    return store
+
+
+# Bulk lookup of city names in the store. Returns latitude and longitude arrays, NaN where there are no coordinates
+def geocode_lookup(store, city_names):
+    codes, uniques = pd.factorize(pd.Series(city_names))
+    latitude = np.full(len(uniques) + 1, np.nan)
+    longitude = np.full(len(uniques) + 1, np.nan)
+    for ind, city_name in enumerate(uniques):
+        entry = store.get(normalize_city_name(city_name))
+        if entry is not None and entry["latitude"] is not None:
+            latitude[ind] = entry["latitude"]
+            longitude[ind] = entry["longitude"]
+    return latitude[codes], longitude[codes]  # code -1 (NaN city) points to the last, NaN, element
+
+
+# Loads the geocode store (city_geocodes.json in the output folder if store_file_name is None) and geocodes only the
+# cities of data which are missing from it (Nominatim api if geocoder is None)
+@traced
+def geoloc_loader(data, city_col, store_file_name=None, ttl=negative_ttl, geocoder=None):
+    if store_file_name is None:
+        store_file_name = output_path("geocodes", geocode_store_name)
+    store = load_geocode_store(store_file_name)
+    if not os.path.isfile(store_file_name):
+        save_geocode_store(store, store_file_name)
+    store = geocode_missing_cities(store=store, city_names=missing_cities(store, data[city_col], ttl=ttl),
+                                   store_file_name=store_file_name, geocoder=geocoder)
+    return store
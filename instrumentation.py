@@ -0,0 +1,241 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+try:
+    import psutil  # Optional, gives the memory high mark where resource is missing (Windows)
+except ImportError:
+    psutil = None
+
+from output_paths import output_root
+
+#########################
+# Pipeline instruments  #
+#########################
+
+'''
+Spans measure a pipeline stage or a function call: wall time, CPU time, peak memory allocated by Python and numpy
+(tracemalloc, if memory is traced) while it ran, the process resident memory high mark, rows in and out, files written under the output root (by top level spans, the output folder is scanned only at their start and end) and errors reported in it.
+Spans nest, each records its parent, and the run is saved as a json trace. Nothing is measured until tracing is
+started, so the spans cost nothing in normal runs. The cProfile profiler of the hot paths is turned on separately.
+'''
+
+pipeline_trace = {"enabled": False, "trace_memory": False, "started": None, "spans": [], "open_spans": [],
+                  "profiler": None}
+
+
+# Start tracing the pipeline. trace_memory also traces allocations, which slows the run down.
+# If profile is True the whole run is profiled with cProfile too
+def start_trace(trace_memory=True, profile=False):
+    pipeline_trace.update({"enabled": True, "trace_memory": trace_memory, "started": time.time(), "spans": [],
+                           "open_spans": [], "profiler": None})
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile:
+        pipeline_trace["profiler"] = cProfile.Profile()
+        pipeline_trace["profiler"].enable()
+
+
+# Files under the output root and their modification times
+def output_files():
+    files = {}
+    root = output_root()
+    for folder, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(folder, file_name)
+            try:
+                files[os.path.relpath(path, root)] = os.path.getmtime(path)
+            except OSError:
+                pass
+    return files
+
+
+# Highest resident memory of the process so far (MB), available without tracing allocations.
+# ru_maxrss is in KB on Linux and in bytes on macOS. Elsewhere psutil gives the peak working set, None without it
+def max_rss_mb():
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return max_rss / 2 ** 20
+        return max_rss / 2 ** 10
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss) / 2 ** 20
+    return None
+
+
+# Number of rows of a dataframe or series, None for other values
+def row_count(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+# Memory of a dataframe (MB), including the text of object columns and the categories of categorical columns
+def frame_mb(dataframe):
+    return float(dataframe.memory_usage(index=True, deep=True).sum()) / 2 ** 20
+
+
+# True while the pipeline is traced, so callers can skip measurements which are only recorded in the trace
+def is_tracing():
+    return pipeline_trace["enabled"]
+
+
+# Adds fields (such as the memory of the frames a function works on) to the innermost open span
+def annotate_span(**values):
+    if pipeline_trace["enabled"] and pipeline_trace["open_spans"]:
+        pipeline_trace["open_spans"][-1].update(values)
+
+
+# Measures the code in the with block as a span named name. The span record is yielded so the block can add
+# rows_out (or any other field). kind is "stage" for pipeline stages and "function" for function calls
+@contextlib.contextmanager
+def span(name, kind="stage", rows_in=None):
+    if not pipeline_trace["enabled"]:
+        yield {}
+        return
+    open_spans = pipeline_trace["open_spans"]
+    record = {"id": len(pipeline_trace["spans"]), "parent": open_spans[-1]["id"] if open_spans else None,
+              "name": name, "kind": kind, "start_seconds": time.time() - pipeline_trace["started"],
+              "wall_seconds": None, "cpu_seconds": None, "start_mb": None, "peak_mb": None, "max_rss_mb": None,
+              "rows_in": rows_in,
+              "rows_out": None, "artifacts": None, "errors": []}
+    pipeline_trace["spans"].append(record)
+    trace_memory = pipeline_trace["trace_memory"] and tracemalloc.is_tracing()
+    if trace_memory:
+        # Peak so far belongs to the open spans, the peak is then reset to measure this span alone.
+        # Python 3.8 cannot reset the peak, the span peak is then the highest since tracing started
+        current, peak = tracemalloc.get_traced_memory()
+        for open_span in open_spans:
+            open_span["_peak"] = max(open_span["_peak"], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        record["start_mb"] = current / 2 ** 20
+        record["_peak"] = current
+    # Files are compared at the start and end of top level spans only, so nested spans do not scan the output folder
+    files_before = output_files() if open_spans == [] else None
+    open_spans.append(record)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = time.perf_counter() - wall_start
+        record["cpu_seconds"] = time.process_time() - cpu_start
+        open_spans.pop()
+        record["max_rss_mb"] = max_rss_mb()
+        if trace_memory:
+            peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+            record["peak_mb"] = peak / 2 ** 20
+            for open_span in open_spans:
+                open_span["_peak"] = max(open_span["_peak"], peak)
+        if files_before is not None:
+            record["artifacts"] = sorted(file_name for file_name, modified in output_files().items()
+                                         if files_before.get(file_name) != modified)
+
+
+# Decorator measuring each call of the function as a span. Rows in are the rows of the first dataframe argument,
+# rows out the rows of the returned dataframe
+def traced(function):
+    @functools.wraps(function)
+    def traced_function(*args, **kwargs):
+        if not pipeline_trace["enabled"]:
+            return function(*args, **kwargs)
+        rows_in = next((row_count(value) for value in list(args) + list(kwargs.values())
+                        if row_count(value) is not None), None)
+        with span(function.__module__ + "." + function.__name__, kind="function", rows_in=rows_in) as record:
+            result = function(*args, **kwargs)
+            record["rows_out"] = row_count(result)
+        return result
+
+    return traced_function
+
+
+# Prints an error caught by the pipeline and records it in the innermost open span
+def report_error(message, e):
+    print(message)
+    print(e)
+    if pipeline_trace["enabled"] and pipeline_trace["open_spans"]:
+        pipeline_trace["open_spans"][-1]["errors"].append(message + ": " + repr(e))
+
+
+# Stops tracing and saves the trace as json. If the run was profiled the profile is saved next to it
+# (.prof for pstats or snakeviz, and the top_functions functions by cumulative time as text).
+# run_info fields (such as cache statistics of the run) are added to the run record
+def save_trace(trace_file_name, top_functions=40, run_info=None):
+    if not pipeline_trace["enabled"]:
+        return None
+    profiler = pipeline_trace["profiler"]
+    profile_file_name = None
+    if profiler is not None:
+        profiler.disable()
+        profile_file_name = os.path.splitext(trace_file_name)[0] + ".prof"
+        profiler.dump_stats(profile_file_name)
+        profile_text = io.StringIO()
+        pstats.Stats(profiler, stream=profile_text).sort_stats("cumulative").print_stats(top_functions)
+        with open(os.path.splitext(trace_file_name)[0] + "_profile.txt", "w", encoding="utf-8") as file1:
+            file1.write(profile_text.getvalue())
+    if pipeline_trace["trace_memory"] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    trace = {
+        "run": {"started": pipeline_trace["started"], "wall_seconds": time.time() - pipeline_trace["started"],
+                "max_rss_mb": max_rss_mb(),
+                "python": platform.python_version(), "argv": sys.argv, "output_root": output_root(),
+                "trace_memory": pipeline_trace["trace_memory"],
+                "peak_per_span": hasattr(tracemalloc, "reset_peak"), "profile": profile_file_name},
+        "spans": pipeline_trace["spans"]
+    }
+    trace["run"].update(run_info or {})
+    with open(trace_file_name, "w", encoding="utf-8") as file1:
+        json.dump(trace, file1, ensure_ascii=False, indent=1)
+    pipeline_trace["enabled"] = False
+    print("Pipeline trace saved to " + trace_file_name)
+    return trace
+
+
+# One line for each stage span: time, memory, rows and number of files written
+def print_trace_summary(trace):
+    for record in trace["spans"]:
+        if record["kind"] != "stage":
+            continue
+        peak = "" if record["peak_mb"] is None else ", peak %.1f MB" % record["peak_mb"]
+        if record["peak_mb"] is not None and record.get("data_mb"):
+            peak += " (%.1f x data)" % (record["peak_mb"] / record["data_mb"])
+        files = "" if record["artifacts"] is None else ", %d files" % len(record["artifacts"])
+        print("%s: %.2f s wall, %.2f s CPU%s, rows %s -> %s%s%s" % (
+            record["name"], record["wall_seconds"], record["cpu_seconds"], peak, record["rows_in"],
+            record["rows_out"], files, ", %d errors" % len(record["errors"]) if record["errors"] else ""))
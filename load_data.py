@@ -18,10 +18,16 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
+import hashlib
+import json
 import os
 
+import numpy as np
 import pandas as pd
 
+from instrumentation import traced
+from output_paths import output_root
+
 
 ################
 # Loading data #
@@ -33,10 +39,177 @@ def load_data_from_csv(csv_file_name):
     return data_loaded
 
 
+# Numbers of a text column of a chunk, without thousands separators. Values which are not numbers become NaN.
+# Each distinct value is parsed once. The series .str accessor is not used: the series keeps it in a reference cycle,
+# which would hold the parsed chunk in memory until the next garbage collection
+def parse_chunk_numbers(values):
+    codes, uniques = pd.factorize(values)
+    numbers = pd.to_numeric(pd.Series([value.replace(",", "") for value in uniques], dtype=object), errors="coerce")
+    return np.append(numbers.to_numpy(dtype=np.float64), np.nan)[codes]  # Code -1 (NaN) maps to the last element
+
+
+# Convert numeric and date columns of one parsed chunk. Thousands separators are removed from numbers,
+# values which are not numbers or dates become NaN.
+def convert_chunk_dtypes(chunk, column_dtypes, date_format="%d/%m/%Y"):
+    for col, dtype in column_dtypes.items():
+        if col not in chunk.columns:
+            continue
+        if dtype == "numeric":
+            chunk[col] = parse_chunk_numbers(chunk[col])
+        elif dtype == "date":
+            chunk[col] = pd.to_datetime(chunk[col], format=date_format, errors="coerce")
+    return chunk
+
+
+# Numbers of one chunk in the narrowest type which keeps their values - whole numbers without NaN in the smallest
+# integer type, other numbers as float32
+def compact_numbers(values):
+    values = np.asarray(values)
+    if not np.isnan(values).any() and (values % 1 == 0).all():
+        return pd.to_numeric(values, downcast="integer")
+    return values.astype(np.float32)
+
+
+# Combine the compact numbers of the chunks of a column - integers if all chunks are whole numbers without NaN,
+# float32 otherwise, as if the whole column was compacted at once
+def combine_numbers(chunk_values):
+    if all(np.issubdtype(values.dtype, np.integer) for values in chunk_values):
+        return pd.to_numeric(np.concatenate(chunk_values), downcast="integer")
+    return np.concatenate([values.astype(np.float32, copy=False) for values in chunk_values])
+
+
+# Integer type of the codes of category_count categories, -1 is kept for missing values
+def category_code_dtype(category_count):
+    for dtype in [np.int8, np.int16, np.int32]:
+        if category_count < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+# Codes of the values of a chunk categorical in the categories of all the chunks so far, extended by the new
+# categories of the chunk. Only codes are kept for each chunk, so each category is stored once for the whole file.
+# Returns the extended categories and the codes
+def extend_category_codes(categories, values):
+    if categories is None:
+        categories = values.categories[:0]
+    new_categories = values.categories.difference(categories, sort=False)
+    if len(new_categories) > 0:
+        categories = categories.append(new_categories)
+    chunk_codes = np.append(categories.get_indexer(values.categories), -1)  # Code -1 (NaN) maps to the last element
+    codes = chunk_codes[values.codes]
+    return categories, codes.astype(category_code_dtype(len(categories)))
+
+
+# Load dataframe from csv in chunks of chunksize rows, reading only the usecols columns.
+# column_dtypes maps columns to "numeric", "category" or "date", which are applied as each chunk is parsed,
+# so parsing memory depends on the chunk size and not on the file size. Numeric columns are kept in the narrowest
+# type (compact_numbers) and text columns read as categories keep one copy of each value (extend_category_codes).
+@traced
+def load_data_from_csv_chunked(csv_file_name, usecols=None, column_dtypes=None, chunksize=100000):
+    if column_dtypes is None:
+        column_dtypes = {}
+    column_filter = None
+    if usecols is not None:
+        column_filter = lambda col: col in usecols  # Columns missing from the csv are ignored
+    reader_dtypes = {col: ("category" if dtype == "category" else str) for col, dtype in column_dtypes.items()}
+    reader = pd.read_csv(csv_file_name, index_col=None, na_values=['NA'], usecols=column_filter, chunksize=chunksize,
+                         dtype=reader_dtypes)
+    # Chunks are split into compact columns as they are read, so each parsed chunk is freed before the next one
+    column_order = None
+    column_chunks = {}
+    column_categories = {}
+    for chunk in reader:
+        chunk = convert_chunk_dtypes(chunk=chunk, column_dtypes=column_dtypes)
+        if column_order is None:
+            column_order = chunk.columns
+            column_chunks = {col: [] for col in column_order}
+        for col in column_order:
+            if isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                column_categories[col], codes = extend_category_codes(column_categories.get(col), chunk[col].array)
+                column_chunks[col].append(codes)
+            elif column_dtypes.get(col) == "numeric":
+                column_chunks[col].append(compact_numbers(chunk[col]))
+            else:
+                column_chunks[col].append(chunk[col].to_numpy(copy=True))  # Not a view keeping the chunk alive
+    if column_order is None:
+        return pd.read_csv(csv_file_name, index_col=None, usecols=column_filter, nrows=0)
+
+    # Columns are combined one at a time and their chunks released, so memory peaks at the data and one column,
+    # not at twice the data. Categories are sorted, so grouped results are in the same order as for text columns
+    data_loaded = pd.DataFrame(index=pd.RangeIndex(sum(len(values) for values in column_chunks[column_order[0]])))
+    for col in column_order:
+        values = column_chunks.pop(col)
+        if col in column_categories:
+            categories = column_categories.pop(col)
+            data_loaded[col] = pd.Categorical.from_codes(np.concatenate(values), categories=categories) \
+                .reorder_categories(categories.sort_values())
+        elif column_dtypes.get(col) == "numeric":
+            data_loaded[col] = combine_numbers(values)
+        else:
+            data_loaded[col] = np.concatenate(values)
+        del values
+    return data_loaded
+
+
 # load dataframe from pickle
-def load_data_from_pickle(pickle_file_name, output_folder_name=os.getcwd()):
-    working_direcotry = os.getcwd()
-    os.chdir(output_folder_name)
-    pickled_data = pd.read_pickle(pickle_file_name + ".pkl")
-    os.chdir(working_direcotry)
+def load_data_from_pickle(pickle_file_name, output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_root()
+    pickled_data = pd.read_pickle(os.path.join(output_folder_name, pickle_file_name + ".pkl"))
     return pickled_data
+
+
+# Hash of a file content, read in blocks so the csv is never fully loaded to memory
+def file_content_hash(file_name, block_size=2 ** 20):
+    file_hash = hashlib.sha256()
+    with open(file_name, "rb") as file1:
+        for block in iter(lambda: file1.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+# Cache key of cleaned data - changes when the source csv or the cleaning configuration change
+def data_cache_key(source_file_name, cleaning_config):
+    key_hash = hashlib.sha256()
+    key_hash.update(file_content_hash(source_file_name).encode("utf-8"))
+    key_hash.update(json.dumps(cleaning_config, sort_keys=True, default=str).encode("utf-8"))
+    return key_hash.hexdigest()[0:16]
+
+
+# Hash of the conversion actions of a schema file (None if there is no schema yet). The parsed content is hashed,
+# so the key does not change with the formatting of the file
+def conversion_schema_state(schema_file_name):
+    if schema_file_name is None or not os.path.isfile(schema_file_name):
+        return None
+    with open(schema_file_name, "r", encoding="utf-8") as file1:
+        schema = json.load(file1)
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Cleaning configuration including the conversion actions replayed from the schema file
+def schema_cleaning_config(cleaning_config, schema_file_name):
+    return dict(cleaning_config, conversion_schema=conversion_schema_state(schema_file_name))
+
+
+# Name of the cached data file (without extension) for a given cache key
+def cache_file_name(cache_name, cache_key):
+    return cache_name + "-" + cache_key
+
+
+# Check whether cleaned data was cached for the cache key
+def is_cached(cache_name, cache_key, output_folder_name):
+    file_name = os.path.join(output_folder_name, cache_file_name(cache_name, cache_key))
+    return os.path.isfile(file_name + ".parquet") and os.path.isfile(file_name + ".json")
+
+
+# Load cached data, only the requested columns are read from disk (all columns if None).
+# Requested columns which were removed during cleaning are skipped.
+@traced
+def load_data_from_cache(cache_name, cache_key, output_folder_name, columns=None):
+    file_name = os.path.join(output_folder_name, cache_file_name(cache_name, cache_key))
+    with open(file_name + ".json", "r", encoding="utf-8") as file1:
+        manifest = json.load(file1)
+    if columns is not None:
+        columns = [col for col in columns if col in manifest["columns"]]
+    cached_data = pd.read_parquet(file_name + ".parquet", columns=columns)
+    return cached_data
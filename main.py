@@ -19,11 +19,16 @@
 '''
 
 import os
+import time
 
 import generators
+import visualize
 from data_cleaning import data_value_cleaining, data_cleaning, shorten_product_name
-from load_data import load_data_from_pickle
-from save_data import create_output_folder
+from geoloc_for_map import geocoders
+from instrumentation import frame_mb, is_tracing, print_trace_summary, save_trace, span, start_trace
+from load_data import data_cache_key, is_cached, load_data_from_cache, schema_cleaning_config
+from output_paths import output_folder, output_path, set_output_root
+from register_columns import analysis_columns, ingestion_dtypes
 
 #########################
 # Data Analysis project #
@@ -50,7 +55,8 @@ Note - subtables for pivot are either masked or by creating a separate new table
 
 def main():
     '''
-    (1) Data Cleaning. Uses a non-graphic UI. Cleaned data is then pickled. If a pickled data file exists UI will not be called.
+    (1) Data Cleaning. Uses a non-graphic UI. Cleaned data is then cached in a columnar file keyed by the csv content and
+    cleaning configuration. If cached data for the key exists UI will not be called, and only the analysed columns are loaded.
     (1.1) Columns with low variability (less than two unique values) are removed.
     (1.2) Numeric columns description is displayed.
     (1.3) Non-numeric columns description is displayed.
@@ -59,29 +65,74 @@ def main():
     (1.6) Dialog asks whether to convert the column to int, bool, date (d/m/Y format), category or to record its name for future decision.
     Column where conversion fails are also recorded for further exploration.
     (1.7) Columns containing NaNs are listed. These are not all with empty cells as empty strings are not identified.
+    The dialog choices are saved as a conversion schema file. When it exists, cleaning applies it without the dialog.
     Specific column treatment: Comma removal from numeric values, accidental/non accidental/total emission calculated from data, non-dangerous waste column created.
     '''
 
     file_name = "MIFLAS_data.csv"
-    pickel_name = "cleanData"
+    cache_name = "cleanData"
     output_folder_name = "Output_files"
-    working_directory=os.getcwd()
-    create_output_folder(foldername=output_folder_name)
-    if os.path.isfile(
-            os.getcwd() + "\\" + output_folder_name + "\\" + pickel_name + ".pkl"):  # check if pickle file exists.
-        data_df = load_data_from_pickle(pickle_file_name=pickel_name, output_folder_name=output_folder_name)
-    else:
-        data_cleaning(file_to_load=file_name, pickel_name=pickel_name,
-                      output_folder_name=output_folder_name)  # Removes columns and adjusts data types
-        data_df = load_data_from_pickle(pickle_file_name=pickel_name, output_folder_name=output_folder_name)
-
-    data_df = shorten_product_name(dataframe=data_df, product_col="TchumPeilutAtarSvivati")
-    cleaned_df = data_value_cleaining(data_df)
-    os.chdir(working_directory)
+    # Column conversions chosen in the cleaning UI are saved here and replayed without prompts on later runs
+    schema_file_name = "conversion_schema.json"
+    # Csv is streamed in chunks of this many rows, converting the ingestion_dtypes columns while parsing
+    ingestion_chunksize = 100000
+    # Change cleaning_version when the cleaning code changes so previously cached data is not reused.
+    # The conversions replayed from the schema file are part of the configuration (none before the first run)
+    cleaning_config = schema_cleaning_config({"cleaning_version": 1, "usecols": analysis_columns,
+                                              "column_dtypes": ingestion_dtypes}, schema_file_name)
+    # Render figures off screen at a fixed size instead of maximizing a window for each of them
+    render_headless = True
+    # Cities are geocoded by the online api ("nominatim"), by a local table of localities ("gazetteer", no network)
+    # or by a self-hosted geocoding server ("async", its url and rate limits are set in geocoder_options)
+    geocoder_name = "nominatim"
+    geocoder_options = {}
+    # Outlier cutoffs evaluated without user input, or None to choose the cutoff in a dialog
+    outlier_cutoffs = [1, 2, 3, 5, 10, 20]
+    # Scatter charts read one shared data file, which browsers load when the output folder is served over http
+    # (python -m http.server). Set to False to embed the data in each chart, so they also open from disk
+    altair_shared_data = True
+    # Time, memory, rows and files written of each stage and of the main functions are saved as a json trace.
+    # Tracing memory allocations slows the run, profiling saves a cProfile profile of the run next to the trace
+    trace_pipeline = True
+    trace_memory = False
+    profile_pipeline = False
+    set_output_root(output_folder_name)  # All outputs are written by absolute path under this folder
+    if trace_pipeline:
+        start_trace(trace_memory=trace_memory, profile=profile_pipeline)
+    if render_headless:
+        visualize.set_headless_mode(figure_size=(19.2, 10.8), dpi=100)
+    with span("cleaning") as stage:
+        cache_folder = output_folder("cache")
+        cache_key = data_cache_key(source_file_name=file_name, cleaning_config=cleaning_config)
+        if not is_cached(cache_name=cache_name, cache_key=cache_key,
+                         output_folder_name=cache_folder):  # Source csv or cleaning changed since last run
+            # Removes columns and adjusts data types, returns the key the data is cached under
+            cache_key = data_cleaning(file_to_load=file_name, cache_name=cache_name, cache_key=cache_key,
+                                      cleaning_config=cleaning_config, output_folder_name=cache_folder,
+                                      usecols=analysis_columns, column_dtypes=ingestion_dtypes,
+                                      chunksize=ingestion_chunksize, schema_file_name=schema_file_name)
+        data_df = load_data_from_cache(cache_name=cache_name, cache_key=cache_key, output_folder_name=cache_folder,
+                                       columns=analysis_columns)
+        stage["rows_out"] = len(data_df)
+
+    with span("value_cleaning", rows_in=len(data_df)) as stage:
+        data_df = shorten_product_name(dataframe=data_df, product_col="TchumPeilutAtarSvivati")
+        cleaned_df = data_value_cleaining(data_df)
+        # Hebrew values used as tick labels (shortened for display) are corrected once for the whole run, so the
+        # charts take them from the label cache. Only the number of corrected labels is used here, it is traced
+        corrected_labels = visualize.correct_heb_mirror_values(dataframe=cleaned_df,
+                                                               cols=["SugPeilutAtarSvivati", "TchumPeilutAtarSvivati",
+                                                                     "AnafAtarSvivati"],
+                                                               how_short=40)
+        stage["heb_labels"] = sum(len(col_labels) for col_labels in corrected_labels.values())
+        # Emission sums by emission type, pollutant group and industry, shared by the emission charts
+        cube = generators.emission_cube(cleaned_df)
+        stage["rows_out"] = len(cleaned_df)
 
     ## Most polluting factories (waste)
     '''(2) Bar plots of 10 factories which produce the most waste, dangerous and non-dangerous.'''
-    generators.waste(data=cleaned_df)
+    with span("waste", rows_in=len(cleaned_df)):
+        generators.waste(data=cleaned_df)
     print("Waste analysis Done")
 
     ## Industries with most accidents
@@ -94,7 +145,12 @@ def main():
     '''
     (4) Violin plots created for accidental and non-accidental emission in industry fields using seaborn.
     '''
-    generators.accident_analysis_ui(data=cleaned_df)
+    with span("accident_analysis", rows_in=len(cleaned_df)):
+        if outlier_cutoffs is None:
+            generators.accident_analysis_ui(data=cleaned_df, cube=cube, altair_shared_data=altair_shared_data)
+        else:
+            generators.outlier_sweep(data=cleaned_df, cutoffs=outlier_cutoffs, cube=cube,
+                                     altair_shared_data=altair_shared_data)
     print("Accident analysis Done")
 
     ''' 
@@ -102,28 +158,49 @@ def main():
     Optional: Crate a bar plot comparing all possible options of emission type and destination, with logarithmic y axis. 
     Optional: Create on two-graph plot (2 subplots) demonstrating the effect of y log scale on inorganic emissions to water sources (by product). 
     Graphs saved as png files in the output folder.
-    Note- all optimal plots render by visibly maximizing figure window, causing a flickering affect. 
+    Note- unless rendering headless, all optimal plots render by visibly maximizing figure window, causing a flickering affect. 
     '''
-    generators.accidents_non_accidents_shotgun(data=cleaned_df,x_val_col='SugPeilutAtarSvivati', is_log=False)
-    generators.accidents_non_accidents_shotgun(data=cleaned_df,x_val_col='TchumPeilutAtarSvivati', is_log=False)
-    generators.accidents_non_accidents_shotgun(data=cleaned_df,x_val_col='SugPeilutAtarSvivati', is_log=True)
-    generators.accidents_non_accidents_shotgun(data=cleaned_df,x_val_col='TchumPeilutAtarSvivati', is_log=True)
+    render_workers = os.cpu_count()  # Processes rendering the shotgun charts in parallel
+    with span("shotgun", rows_in=len(cleaned_df)) as record:
+        if is_tracing():
+            record["data_mb"] = frame_mb(cleaned_df)  # Peak memory of the stage is compared to the data it charts
+        generators.accidents_non_accidents_shotgun(data=cleaned_df, x_val_col='SugPeilutAtarSvivati', is_log=False,
+                                                   workers=render_workers, cube=cube)
+        generators.accidents_non_accidents_shotgun(data=cleaned_df, x_val_col='TchumPeilutAtarSvivati',
+                                                   is_log=False, workers=render_workers, cube=cube)
+        generators.accidents_non_accidents_shotgun(data=cleaned_df, x_val_col='SugPeilutAtarSvivati', is_log=True,
+                                                   workers=render_workers, cube=cube)
+        generators.accidents_non_accidents_shotgun(data=cleaned_df, x_val_col='TchumPeilutAtarSvivati', is_log=True,
+                                                   workers=render_workers, cube=cube)
     print("Shotgun accident graphs Done")
 
     ## Industial geographical clusters
     '''
-    (5) Gepoy converts Hebrew city names to latitude and longitude. Geolocation data is pickled into output folder. If a pickled data geolocation file exists it will be used instead of accessing the geolocation server.
+    (5) Gepoy converts Hebrew city names to latitude and longitude. Geolocations are kept per city in a geocode store (city_geocodes.json in the output folder, started from city_geolocations.pkl if it exists). Only cities missing from the store are sent to the geolocation server. Cities the server could not find are retried after 30 days. Without network access set geocoder_name in main.py to "gazetteer", which looks the cities up in a local table of localities (city_geolocations.pkl, or a csv with name, latitude, longitude and optional variants columns) with fuzzy matching of spelling variants.
     (6) Number of factories in each field plotted on map using geoviews. bokeh provides interactivity. Circle size indicates number of factories in the city. Circle color changes between graphs. Graphs saved as HTML in a subfolder of the output folder.
     Optional: plotting using Folium, non-interactive map (no tooltips or different circle sizes). Circle color changes between graphs. Graphs saved as HTML in a subfolder of the output folder.
     '''
-    os.chdir(working_directory)
-    generators.industry_geoloc(data=cleaned_df, city_col="YeshuvAtarSvivatiMenifa", industry_col="AnafAtarSvivati",
-                               pivot_by="YeshuvAtarSvivatiMenifa", values="AnafAtarSvivati")
-    generators.industry_geoloc(data=cleaned_df, city_col="YeshuvAtarSvivatiMenifa",
-                               industry_col="TchumPeilutAtarSvivati", pivot_by="YeshuvAtarSvivatiMenifa",
-                               values="TchumPeilutAtarSvivati")
+    geocoder = geocoders[geocoder_name](**geocoder_options)
+    with span("geo_maps", rows_in=len(cleaned_df)):
+        generators.industry_geoloc(data=cleaned_df, city_col="YeshuvAtarSvivatiMenifa",
+                                   industry_col="AnafAtarSvivati", pivot_by="YeshuvAtarSvivatiMenifa",
+                                   values="AnafAtarSvivati", geocoder=geocoder)
+        generators.industry_geoloc(data=cleaned_df, city_col="YeshuvAtarSvivatiMenifa",
+                                   industry_col="TchumPeilutAtarSvivati", pivot_by="YeshuvAtarSvivatiMenifa",
+                                   values="TchumPeilutAtarSvivati", geocoder=geocoder)
+
+    # Industrial clusters - places with at least 5 factories within 5 km, and a sweep of radius and cluster size
+    with span("geo_clusters", rows_in=len(cleaned_df)):
+        generators.industry_clusters(data=cleaned_df, city_col="YeshuvAtarSvivatiMenifa", eps_km=5, min_size=5,
+                                     sweep_eps=[1, 2, 5, 10, 20], geocoder=geocoder)
 
     print("Geographical analysis Done")
+    print("Hebrew label cache: " + str(visualize.heb_label_cache_stats()))
+    if trace_pipeline:
+        # Label cache hits and misses of the run (of the main process, render workers have their own caches)
+        trace = save_trace(output_path("reports", time.strftime("pipeline_trace_%Y%m%d_%H%M%S.json")),
+                           run_info={"heb_label_cache": visualize.heb_label_cache_stats()})
+        print_trace_summary(trace)
     print("Analysis Done!")
 
 
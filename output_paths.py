@@ -0,0 +1,75 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+
+################
+# Output paths #
+################
+
+# Absolute paths are resolved here so no module has to change the working directory.
+# The output root is kept in an environment variable so worker processes use the same folder.
+
+output_root_variable = "PRTR_OUTPUT_ROOT"
+
+# Folder of the project, where input files shipped with the project are kept
+project_folder = os.path.dirname(os.path.abspath(__file__))
+
+# Sub folder of each artifact family in the output root folder
+artifact_folders = {
+    "reports": "",  # Cleaning text reports
+    "cache": "",  # Cleaned data cache
+    "geocodes": "",  # Geocode store, written as cities are geocoded
+    "figures": "",  # Matplotlib figures, graph sets are saved in sub folders
+    "altair": "",  # Altair html charts
+    "folium": "map graphs - dots",
+    "geoviews": "map graphs - circles"
+}
+
+
+# Set the output root folder, relative folders are resolved from the current working directory
+def set_output_root(folder_name):
+    os.environ[output_root_variable] = os.path.abspath(folder_name)
+    return os.environ[output_root_variable]
+
+
+# Absolute path of the output root folder
+def output_root():
+    if output_root_variable not in os.environ:
+        set_output_root("Output_files")
+    return os.environ[output_root_variable]
+
+
+# Absolute path of an artifact family folder (and optional sub folders), created if missing.
+# makedirs with exist_ok is safe when several threads or processes create the same folder.
+def output_folder(family, *sub_folders):
+    folder = os.path.join(output_root(), artifact_folders[family], *sub_folders)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+# Absolute path of an output file of an artifact family
+def output_path(family, file_name, *sub_folders):
+    return os.path.join(output_folder(family, *sub_folders), file_name)
+
+
+# Absolute path of an input file shipped with the project
+def input_path(file_name):
+    return os.path.join(project_folder, file_name)
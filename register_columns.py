@@ -0,0 +1,45 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+####################
+# Register columns #
+####################
+
+# Columns converted while the csv is parsed. Numbers are kept in the narrowest type which holds them.
+# Text columns with few distinct values (the Hebrew dimensions and the raw emission values) are read as categories,
+# so each long string is stored once and group-bys run on the integer codes
+ingestion_dtypes = {"ShnatDivuach": "numeric", "MisparTaagidShutfutMenifa": "numeric",
+                    "SachTipulPsoletMesukenet": "numeric", "SachSilukPsoletMesukenet": "numeric",
+                    "SachTipulPsoletLoMesukenet": "numeric", "SachSilukPsoletLoMesukenet": "numeric",
+                    "SugPlita": "category", "KvutzatMezahamim": "category", "SugPeilutAtarSvivati": "category",
+                    "TchumPeilutAtarSvivati": "category", "AnafAtarSvivati": "category",
+                    "YeshuvAtarSvivatiMenifa": "category", "ShemAtarSvivatiMenifa": "category",
+                    "KamutPlita": "category", "KamutPlitaBeTeunot": "category"}
+# Columns each analysis stage reads, only these are loaded from the cache
+stage_columns = {
+    "value_cleaning": ["KamutPlita", "KamutPlitaBeTeunot", "SachTipulPsoletMesukenet", "SachSilukPsoletMesukenet",
+                       "SachTipulPsoletLoMesukenet", "SachSilukPsoletLoMesukenet"],
+    "waste": ["ShnatDivuach", "ShemAtarSvivatiMenifa"],
+    "accident_analysis": ["SugPeilutAtarSvivati", "TchumPeilutAtarSvivati", "AnafAtarSvivati"],
+    "shotgun": ["SugPlita", "KvutzatMezahamim", "SugPeilutAtarSvivati", "TchumPeilutAtarSvivati"],
+    "geoloc": ["YeshuvAtarSvivatiMenifa", "AnafAtarSvivati", "TchumPeilutAtarSvivati",
+               "MisparTaagidShutfutMenifa"]
+}
+analysis_columns = sorted(set().union(*stage_columns.values()))
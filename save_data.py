@@ -19,8 +19,11 @@
 '''
 
 import datetime as dt
+import json
 import os
 
+from output_paths import output_folder, output_root
+
 
 #################
 # File handling #
@@ -28,29 +31,39 @@ import os
 
 # Create folder
 def create_output_folder(foldername):
-    if not os.path.isdir(foldername):  # os.path.exists('mydirectory')
-        os.mkdir(foldername)
+    os.makedirs(foldername, exist_ok=True)
 
 
 # Export a dataframe to csv
-def export_to_csv(dataframe, save_file_name, output_folder_name=os.getcwd(), encoding='utf-8-sig'):
-    if not os.path.isdir(output_folder_name):
-        os.mkdir(output_folder_name)
-    os.chdir(output_folder_name)
+def export_to_csv(dataframe, save_file_name, output_folder_name=None, encoding='utf-8-sig'):
+    if output_folder_name is None:
+        output_folder_name = output_folder("reports")
+    create_output_folder(output_folder_name)
     now = str(dt.datetime.now().strftime("%y%m%d %H_%M"))
-    if not os.path.isdir("Output_files"):
-        os.mkdir("Output_files")
-    os.chdir("Output_files")
-    dataframe.to_csv(os.getcwd() + "\\" + save_file_name + now + ".csv", index=True, header=True, encoding=encoding)
-    os.chdir("..")
+    dataframe.to_csv(os.path.join(output_folder_name, save_file_name + now + ".csv"), index=True, header=True,
+                     encoding=encoding)
     print("Results saved as csv")
 
 
 # Picke a dataframe
-def save_as_pickel(dataframe, save_file_name, output_folder_name=os.getcwd()):
-    if not os.path.isdir(output_folder_name):
-        os.mkdir(output_folder_name)
-    os.chdir(output_folder_name)
-    dataframe.to_pickle("./" + save_file_name + ".pkl")  # Can be skipped after sucessful query and pickle save
-    os.chdir("..")
+def save_as_pickel(dataframe, save_file_name, output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_root()
+    create_output_folder(output_folder_name)
+    dataframe.to_pickle(os.path.join(output_folder_name, save_file_name + ".pkl"))
     print("Results pickled")
+
+
+# Cache cleaned dataframe in a compressed columnar file so stages can read only the columns they use.
+# A manifest with the column list and cleaning configuration is saved next to it.
+def save_to_cache(dataframe, cache_name, cache_key, cleaning_config, output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_folder("cache")
+    create_output_folder(output_folder_name)
+    file_name = os.path.join(output_folder_name, cache_name + "-" + cache_key)
+    dataframe.to_parquet(file_name + ".parquet", compression="snappy", index=False)
+    manifest = {"cache_key": cache_key, "columns": [str(col) for col in dataframe.columns],
+                "cleaning_config": cleaning_config}
+    with open(file_name + ".json", "w", encoding="utf-8") as file1:
+        json.dump(manifest, file1, ensure_ascii=False, indent=1, default=str)
+    print("Results cached")
@@ -0,0 +1,156 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_cleaning import emission_sentinel_classes, product_full_names
+from output_paths import input_path
+
+###########################
+# Synthetic PRTR dataset  #
+###########################
+
+'''
+Register shaped data for scaling runs and benchmarks, without the real csv.
+Columns, their text values and the cardinalities (factories, years, emission types, pollutant groups, activities,
+sectors, cities) follow the register, and only the number of rows changes with the size.
+Emission columns mix numbers, thousands separated numbers ("1,234.5"), the Hebrew sentinel values and empty cells.
+Waste columns are thousands separated numbers, one value for each factory and year.
+'''
+
+prtr_columns = ["MisparTaagidShutfutMenifa", "ShemAtarSvivatiMenifa", "YeshuvAtarSvivatiMenifa", "AnafAtarSvivati",
+                "SugPeilutAtarSvivati", "TchumPeilutAtarSvivati", "ShnatDivuach", "SugPlita", "KvutzatMezahamim",
+                "KamutPlita", "KamutPlitaBeTeunot", "SachTipulPsoletMesukenet", "SachSilukPsoletMesukenet",
+                "SachTipulPsoletLoMesukenet", "SachSilukPsoletLoMesukenet"]
+waste_columns = prtr_columns[-4:]
+
+report_years = list(range(2012, 2020))
+# Emission types (SugPlita) and their share of the rows, water emissions use the "discharge" sentinel values
+emission_types = {"אוויר": 0.6, "מקור מים": 0.15, "ים": 0.1, "קרקע": 0.05, "העברה לטיפול": 0.1}
+water_emission_types = ["מקור מים", "ים"]
+pollutant_groups = ["חומרים אנאורגניים", "מתכות כבדות", "חומרים אורגניים", "גזי חממה", "חומרים מסרטנים",
+                    "תרכובות אורגניות נדיפות", "חלקיקים", "חומרים מזיקים לשכבת האוזון"]
+activity_types = ["תעשייה", "אנרגיה", "טיפול בפסולת", "חקלאות", "תשתיות מים"]
+sectors = ["אנרגיה", "כימיה", "מתכת", "מזון", "פסולת", "מים וביוב", "חקלאות", "מינרלים", "נייר ודפוס", "פלסטיק"]
+fallback_cities = ["חיפה", "אשדוד", "באר שבע", "רמת חובב", "נתניה", "קריית גת", "אשקלון", "ירושלים", "חדרה",
+                   "נשר", "דימונה", "ערד", "מגדל העמק", "כרמיאל", "עכו", "רמלה"]
+
+# Sentinel values of each class, the first one for other emissions and the second for water emissions
+too_low_values = [value for value, value_class in emission_sentinel_classes.items() if value_class == "too_low"]
+non_accident_values = [value for value, value_class in emission_sentinel_classes.items()
+                       if value_class == "non_accident"]
+unavailable_value = [value for value, value_class in emission_sentinel_classes.items()
+                     if value_class == "unavailable"][0]
+
+# Share of the rows of each kind of value: number, too low, not in accident, unavailable and empty
+total_emission_shares = [0.55, 0.33, 0.0, 0.07, 0.05]
+accident_emission_shares = [0.04, 0.08, 0.78, 0.05, 0.05]
+
+
+# Cities of the factories, the localities of city_geolocations.pkl when it exists
+def synthetic_cities(pickle_file_name=None):
+    if pickle_file_name is None:
+        pickle_file_name = input_path("city_geolocations.pkl")
+    if not os.path.isfile(pickle_file_name):
+        return fallback_cities
+    return list(pd.read_pickle(pickle_file_name)["yeshuv"].dropna().unique())
+
+
+# Attributes of each factory, activity type and sector follow from the activity (TchumPeilutAtarSvivati).
+# Factory weights are skewed so a few factories report most rows. Base waste of each factory and year too.
+def synthetic_factories(factory_count=700, seed=0, cities=None):
+    rng = np.random.default_rng(seed)
+    if cities is None:
+        cities = synthetic_cities()
+    products = rng.integers(0, len(product_full_names), factory_count)
+    weights = rng.permutation(1 / np.arange(1, factory_count + 1) ** 0.8)
+    factories = pd.DataFrame({
+        "MisparTaagidShutfutMenifa": 510000000 + rng.choice(10 ** 6, factory_count, replace=False),
+        "ShemAtarSvivatiMenifa": ["מפעל %d" % number for number in range(1, factory_count + 1)],
+        "YeshuvAtarSvivatiMenifa": rng.choice(np.array(cities, dtype=object), factory_count),
+        "AnafAtarSvivati": np.array(sectors, dtype=object)[products % len(sectors)],
+        "SugPeilutAtarSvivati": np.array(activity_types, dtype=object)[products % len(activity_types)],
+        "TchumPeilutAtarSvivati": np.array(product_full_names, dtype=object)[products],
+        "weight": weights / weights.sum()
+    })
+    waste = rng.lognormal(mean=5, sigma=2.5, size=(factory_count, len(report_years), len(waste_columns)))
+    return factories, waste
+
+
+# Numbers as written in the register csv, with thousands separators
+def format_numbers(numbers):
+    return pd.Series(np.round(numbers, 3)).map("{:,}".format).to_numpy(dtype=object)
+
+
+# Text values of an emission column. shares are the shares of numbers, too low, not in accident, unavailable
+# and empty values. Sentinel values are in their water form where is_water.
+def emission_values(rng, rows, shares, is_water, mean, sigma):
+    kinds = rng.choice(len(shares), size=rows, p=shares)
+    values = np.full(rows, None, dtype=object)
+    numeric = kinds == 0
+    values[numeric] = format_numbers(rng.lognormal(mean=mean, sigma=sigma, size=int(numeric.sum())))
+    for kind, sentinel_values in ((1, too_low_values), (2, non_accident_values)):
+        values[kinds == kind] = np.where(is_water, sentinel_values[-1], sentinel_values[0])[kinds == kind]
+    values[kinds == 3] = unavailable_value
+    return values
+
+
+# Synthetic register rows of the factories (synthetic_factories), as text the way they are read from the csv
+def synthetic_prtr(rows, seed=0, factories=None):
+    if factories is None:
+        factories = synthetic_factories(seed=seed)
+    factory_table, waste = factories
+    rng = np.random.default_rng(seed)
+    factory = rng.choice(len(factory_table), size=rows, p=factory_table["weight"].to_numpy())
+    year = rng.integers(0, len(report_years), rows)
+    emission_type = rng.choice(np.array(list(emission_types.keys()), dtype=object), size=rows,
+                               p=list(emission_types.values()))
+    is_water = np.isin(emission_type, water_emission_types)
+
+    data = factory_table.drop(columns="weight").iloc[factory].reset_index(drop=True)
+    data["ShnatDivuach"] = np.array(report_years)[year]
+    data["SugPlita"] = emission_type
+    data["KvutzatMezahamim"] = rng.choice(np.array(pollutant_groups, dtype=object), size=rows)
+    data["KamutPlita"] = emission_values(rng, rows, total_emission_shares, is_water, mean=2, sigma=3)
+    data["KamutPlitaBeTeunot"] = emission_values(rng, rows, accident_emission_shares, is_water, mean=0, sigma=2)
+    waste_text = format_numbers(waste.ravel()).reshape(waste.shape)
+    for position, col in enumerate(waste_columns):
+        values = waste_text[factory, year, position]
+        values[rng.random(rows) < 0.05] = None
+        data[col] = values
+    return data[prtr_columns]
+
+
+# Writes a synthetic register csv of rows rows in chunks of chunk_rows rows, so any size fits in memory.
+# All chunks share the factories, each chunk has its own random stream.
+def write_synthetic_csv(file_name, rows, seed=0, chunk_rows=10 ** 6, factory_count=700):
+    factories = synthetic_factories(factory_count=factory_count, seed=seed)
+    for chunk_number, chunk_start in enumerate(range(0, rows, chunk_rows)):
+        chunk = synthetic_prtr(rows=min(chunk_rows, rows - chunk_start), seed=[seed, chunk_number],
+                               factories=factories)
+        chunk.to_csv(file_name, mode="w" if chunk_number == 0 else "a", header=chunk_number == 0, index=False)
+    return file_name
+
+
+if __name__ == "__main__":
+    write_synthetic_csv("MIFLAS_synthetic.csv", rows=10 ** 5)
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# Modules are at the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Output root in a temporary folder, for tests of functions which write reports, caches or charts
+@pytest.fixture
+def output_root_folder(tmp_path, monkeypatch):
+    monkeypatch.setenv("PRTR_OUTPUT_ROOT", str(tmp_path))
+    return tmp_path
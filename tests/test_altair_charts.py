@@ -0,0 +1,67 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+
+import pandas as pd
+
+from output_paths import output_folder
+from visualize import altair_data_url, altair_dataset, multi_feat_scatter_shared
+
+
+# Emissions of industries in the long form of the shared chart data
+def emission_amounts():
+    return pd.DataFrame({"SugPeilutAtarSvivati": ["a", "b", "a", "c"], "TchumPeilutAtarSvivati": ["x", "y", "y", "x"],
+                         "AnafAtarSvivati": ["metals", "food", "food", "metals"],
+                         "Emission": ["KamutPlitaBeTeunot", "KamutPlitaBeTeunot", "KamutPlitaLoBeTeunot",
+                                      "KamutPlitaLoBeTeunot"],
+                         "Amount": [1.0, 20.0, 300.0, 4000.0]})
+
+
+def test_data_url_is_relative_to_the_chart_folder(tmp_path):
+    data_file_name = str(tmp_path / "data" / "emissions.csv")
+    assert altair_data_url(data_file_name, str(tmp_path / "data")) == "emissions.csv"
+    assert altair_data_url(data_file_name, str(tmp_path / "charts" / "cutoffs")) == "../../data/emissions.csv"
+
+
+def test_chart_data_is_written_once_for_each_content(output_root_folder):
+    data_file_name = altair_dataset(emission_amounts(), name="emissions")
+    assert os.path.dirname(data_file_name) == os.path.normpath(output_folder("altair"))
+    modified = os.path.getmtime(data_file_name)
+    assert altair_dataset(emission_amounts(), name="emissions") == data_file_name
+    assert os.path.getmtime(data_file_name) == modified
+    assert altair_dataset(emission_amounts().iloc[1:], name="emissions") != data_file_name
+    pd.testing.assert_frame_equal(pd.read_csv(data_file_name), emission_amounts())
+
+
+def test_shared_data_charts_refer_to_the_data_file_instead_of_inlining_it(output_root_folder):
+    data_file_name = altair_dataset(emission_amounts(), name="emissions")
+    chart_folder = str(output_root_folder / "cutoffs")
+    os.makedirs(chart_folder)
+    for cutoff in [0, 1]:
+        multi_feat_scatter_shared(data_url=data_file_name, filename="Emissions cutoff %d" % cutoff,
+                                  x_col="SugPeilutAtarSvivati", y_col="TchumPeilutAtarSvivati", value_col="Amount",
+                                  color_col="AnafAtarSvivati", type_col="Emission",
+                                  type_titles={"KamutPlitaBeTeunot": "Accidental", "KamutPlitaLoBeTeunot": "Routine"},
+                                  cutoff=cutoff, output_folder_name=chart_folder)
+        with open(os.path.join(chart_folder, "Emissions cutoff %d.html" % cutoff), encoding="utf-8") as file1:
+            html = file1.read()
+        assert '"url": "../' + os.path.basename(data_file_name) + '"' in html
+        assert "4000" not in html
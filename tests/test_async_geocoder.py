@@ -0,0 +1,124 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import asyncio
+
+import pytest
+
+from async_geocoder import async_geocoder, take_token, token_bucket
+from fake_geocoder_server import request_rate_stats, start_fake_geocoder, stop_fake_geocoder
+
+
+# Geocode city_names through the client against a stand-in server.
+# Returns the geocoded locations by city and the stopped server, with its request log and most requests at a time
+def geocode_with_server(city_names, server_options, client_options):
+    server = start_fake_geocoder(**server_options)
+    try:
+        geocoder = async_geocoder(url=server.url, **client_options)
+        geocoded = dict(geocoder(city_names))
+    finally:
+        stop_fake_geocoder(server)
+    return geocoded, server
+
+
+# Clock of a token bucket which only moves when the bucket sleeps, so tests do not depend on the machine speed
+def fake_clock():
+    clock = {"now": 0.0}
+
+    async def sleep(seconds):
+        clock["now"] += seconds
+
+    return clock, sleep
+
+
+@pytest.mark.parametrize("rate, capacity", [(0, 1), (-1, 1), (1, 0), (1, 0.5)])
+def test_token_bucket_rejects_rates_and_capacities_which_never_give_a_token(rate, capacity):
+    with pytest.raises(ValueError):
+        token_bucket(rate, capacity)
+    with pytest.raises(ValueError):
+        async_geocoder(rate=rate, burst=capacity)
+
+
+def test_token_bucket_spaces_calls_by_rate_after_the_burst():
+    clock, sleep = fake_clock()
+
+    async def token_times(bucket, count):
+        times = []
+        for ind in range(count):
+            await take_token(bucket)
+            times.append(clock["now"])
+        return times
+
+    # A rate of a power of 2 calls per second, the fake clock moves by sleeps only and must reach token times exactly
+    bucket = token_bucket(rate=64, capacity=5, clock=lambda: clock["now"], sleep=sleep)
+    assert asyncio.run(token_times(bucket, 15)) == [0] * 5 + [ind / 64 for ind in range(1, 11)]
+    clock["now"] += 10  # The bucket refills up to its capacity only
+    assert asyncio.run(token_times(bucket, 6)) == [10 + 10 / 64] * 5 + [10 + 11 / 64]
+
+
+def test_client_keeps_to_the_rate_limit():
+    city_names = ["city %d" % ind for ind in range(30)]
+    geocoded, server = geocode_with_server(
+        city_names, server_options={"latency": 0.01}, client_options={"rate": 20, "burst": 1, "concurrency": 8})
+    assert sorted(geocoded) == sorted(city_names)
+    stats = request_rate_stats(server.request_log, window=1.0)
+    assert stats["status"] == {200: len(city_names)}
+    assert stats["max_in_window"] <= 1 + 20 * stats["window"]
+
+
+def test_client_retries_failed_calls_with_backoff():
+    city_names = ["city %d" % ind for ind in range(20)]
+    geocoded, server = geocode_with_server(
+        city_names, server_options={"latency": 0.01, "failure_rate": 0.3, "seed": 1},
+        client_options={"rate": 100, "burst": 5, "concurrency": 4, "retries": 8, "backoff": 0.01})
+    statuses = [status for request_time, status in server.request_log]
+    assert sorted(geocoded) == sorted(city_names)
+    assert statuses.count(503) > 0
+    assert statuses.count(200) == len(city_names)
+
+
+def test_client_backs_off_for_retry_after_of_a_busy_server():
+    city_names = ["city %d" % ind for ind in range(6)]
+    geocoded, server = geocode_with_server(
+        city_names, server_options={"latency": 0.01, "rate_limit": 3},
+        client_options={"rate": 100, "burst": 6, "concurrency": 6, "retries": 3, "backoff": 0.01})
+    statuses = [status for request_time, status in server.request_log]
+    assert sorted(geocoded) == sorted(city_names)
+    # Three cities are refused once and each is retried once. Retried within the 1 second Retry-After of the server,
+    # by the backoff alone, they would be refused again until the retries run out
+    assert statuses.count(429) == 3
+    assert statuses.count(200) == len(city_names)
+
+
+def test_client_geocodes_concurrently_up_to_concurrency():
+    city_names = ["city %d" % ind for ind in range(20)]
+    geocoded, server = geocode_with_server(
+        city_names, server_options={"latency": 0.2}, client_options={"rate": 1000, "burst": 20, "concurrency": 5})
+    assert len(geocoded) == len(city_names)
+    assert len(server.request_log) == len(city_names)
+    assert server.max_in_flight == 5
+
+
+def test_cities_not_found_are_geocoded_as_none():
+    geocoded, server = geocode_with_server(
+        ["city 0", "city 1"], server_options={"latency": 0.01, "not_found": ["city 0"]},
+        client_options={"rate": 100, "burst": 2})
+    assert geocoded["city 0"] is None
+    assert geocoded["city 1"].latitude > 29
@@ -0,0 +1,74 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import json
+
+import pandas as pd
+
+from load_data import data_cache_key, is_cached, load_data_from_cache, schema_cleaning_config
+from save_data import save_to_cache
+
+
+cleaning_config = {"cleaning_version": 1, "usecols": ["ShnatDivuach", "KamutPlita"], "column_dtypes": {}}
+
+
+def write_file(file_name, text):
+    with open(file_name, "w", encoding="utf-8") as file1:
+        file1.write(text)
+    return str(file_name)
+
+
+def test_cache_key_depends_on_the_csv_content_and_the_configuration(tmp_path):
+    csv_file_name = write_file(tmp_path / "data.csv", "ShnatDivuach,KamutPlita\n2018,1\n")
+    key = data_cache_key(csv_file_name, cleaning_config)
+    assert key == data_cache_key(csv_file_name, dict(reversed(list(cleaning_config.items()))))
+    assert key == data_cache_key(write_file(tmp_path / "copy.csv", "ShnatDivuach,KamutPlita\n2018,1\n"),
+                                 cleaning_config)  # Same content under another name
+    assert key != data_cache_key(write_file(tmp_path / "changed.csv", "ShnatDivuach,KamutPlita\n2018,2\n"),
+                                 cleaning_config)
+    assert key != data_cache_key(csv_file_name, dict(cleaning_config, cleaning_version=2))
+
+
+def test_cache_key_follows_the_conversion_schema_content_not_its_formatting(tmp_path):
+    csv_file_name = write_file(tmp_path / "data.csv", "ShnatDivuach,KamutPlita\n2018,1\n")
+    schema_file_name = str(tmp_path / "conversion_schema.json")
+    no_schema_key = data_cache_key(csv_file_name, schema_cleaning_config(cleaning_config, schema_file_name))
+    schema = {"ShnatDivuach": "int", "KamutPlita": "remove"}
+    keys = []
+    for indent in [None, 4]:
+        write_file(schema_file_name, json.dumps(schema, indent=indent))
+        keys.append(data_cache_key(csv_file_name, schema_cleaning_config(cleaning_config, schema_file_name)))
+    assert keys[0] == keys[1] != no_schema_key
+    write_file(schema_file_name, json.dumps(dict(schema, KamutPlita="unchanged")))
+    assert data_cache_key(csv_file_name, schema_cleaning_config(cleaning_config, schema_file_name)) != keys[0]
+
+
+def test_cached_data_is_loaded_back_with_its_dtypes(tmp_path):
+    data = pd.DataFrame({"ShnatDivuach": pd.Series([2018, 2019, 2020], dtype="int16"),
+                         "KamutPlita": [1.5, None, 3.0],
+                         "YeshuvAtarSvivatiMenifa": pd.Categorical(["חיפה", None, "עכו"])})
+    assert not is_cached("cleanData", "0123", str(tmp_path))
+    save_to_cache(data, "cleanData", "0123", cleaning_config, output_folder_name=str(tmp_path))
+    assert is_cached("cleanData", "0123", str(tmp_path))
+    assert not is_cached("cleanData", "4567", str(tmp_path))
+    pd.testing.assert_frame_equal(load_data_from_cache("cleanData", "0123", str(tmp_path)), data)
+    # Columns removed during cleaning are skipped
+    loaded = load_data_from_cache("cleanData", "0123", str(tmp_path), columns=["KamutPlita", "SugPlita"])
+    pd.testing.assert_frame_equal(loaded, data[["KamutPlita"]])
@@ -0,0 +1,171 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_cleaning import comma_removal, dataframe_by_column_value_separator, map_labels, product_full_names, \
+    product_short_names, scan_numeric_column, short_label, shorten_name, shorten_product_name
+
+
+# Rows of emission types (None for a missing type), numbered by their emission, types as text or as categories
+def emission_type_rows(types, categorical=False):
+    data = pd.DataFrame({"SugPlita": types, "KamutPlita": np.arange(len(types), dtype=float)})
+    if categorical:
+        data["SugPlita"] = data["SugPlita"].astype("category")
+    data.name = "emissions"
+    return data
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_single_value_gives_a_list_of_one_dataframe(categorical):
+    data = emission_type_rows(["אוויר", "אוויר", "אוויר"], categorical)
+    dataframes, values = dataframe_by_column_value_separator(data, "SugPlita")
+    assert isinstance(dataframes, list) and len(dataframes) == 1
+    assert list(values) == ["אוויר"]
+    pd.testing.assert_frame_equal(dataframes[0], data)
+    assert dataframes[0].name == "אוויר"
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_many_values_are_split_in_order_of_appearance(categorical):
+    data = emission_type_rows(["ים", "אוויר", "ים", "קרקע", "אוויר"], categorical)
+    dataframes, values = dataframe_by_column_value_separator(data, "SugPlita")
+    assert list(values) == ["ים", "אוויר", "קרקע"]
+    assert [dataframe.name for dataframe in dataframes] == ["ים", "אוויר", "קרקע"]
+    assert [dataframe["KamutPlita"].tolist() for dataframe in dataframes] == [[0, 2], [1, 4], [3]]
+    assert [list(dataframe.index) for dataframe in dataframes] == [[0, 2], [1, 4], [3]]
+
+    dataframes, values = dataframe_by_column_value_separator(data, "SugPlita", rename_df=False)
+    assert [dataframe.name for dataframe in dataframes] == ["emissions"] * 3
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_rows_with_nan_values_are_left_out(categorical):
+    data = emission_type_rows(["ים", None, "אוויר", np.nan, "ים"], categorical)
+    dataframes, values = dataframe_by_column_value_separator(data, "SugPlita")
+    assert list(values) == ["ים", "אוויר"]
+    assert [dataframe["KamutPlita"].tolist() for dataframe in dataframes] == [[0, 4], [2]]
+
+    dataframes, values = dataframe_by_column_value_separator(emission_type_rows([None, None]), "SugPlita")
+    assert dataframes == [] and len(values) == 0
+
+
+def test_lazy_partitions_are_made_as_they_are_reached():
+    data = emission_type_rows(["ים", "אוויר", "ים", None])
+    dataframes, values = dataframe_by_column_value_separator(data, "SugPlita", lazy=True)
+    assert isinstance(dataframes, types.GeneratorType)
+    eager, eager_values = dataframe_by_column_value_separator(data, "SugPlita")
+    assert list(values) == list(eager_values)
+    dataframes = list(dataframes)
+    assert len(dataframes) == len(eager) == 2
+    for lazy_frame, eager_frame in zip(dataframes, eager):
+        pd.testing.assert_frame_equal(lazy_frame, eager_frame)
+        assert lazy_frame.name == eager_frame.name
+
+
+def test_comma_removal_changes_only_text_columns():
+    data = pd.DataFrame({"KamutPlita": ["1,200", None, "3"], "ShnatDivuach": [2018, 2019, 2020],
+                         "SugPlita": pd.Categorical(["1,2", "a", "b"])})
+    data, removed_from = comma_removal(data, ["KamutPlita", "ShnatDivuach", "SugPlita", "MissingColumn"])
+    assert removed_from == ["KamutPlita"]
+    assert data["KamutPlita"].tolist() == ["1200", "נתון לא זמין", "3"]
+    assert data["ShnatDivuach"].tolist() == [2018, 2019, 2020]
+    assert data["SugPlita"].tolist() == ["1,2", "a", "b"]
+
+
+# Non number values of a column checked one distinct value at a time, the way the scanner replaced it
+def non_number_values_one_by_one(series):
+    non_num_values = []
+    for entry in series.dropna().unique():
+        try:
+            float(str(entry).replace(",", ""))
+        except ValueError:
+            non_num_values.append(entry)
+    return non_num_values
+
+
+def test_numeric_scan_finds_the_non_number_values_with_their_rows():
+    series = pd.Series(["1,200", "abc", None, "3", "abc", 5, "-", "2.5", np.nan, "-"], dtype=object)
+    numbers, non_numbers = scan_numeric_column(series)
+    np.testing.assert_array_equal(numbers, [1200, np.nan, np.nan, 3, np.nan, 5, np.nan, 2.5, np.nan, np.nan])
+    assert non_numbers["value"].tolist() == non_number_values_one_by_one(series) == ["abc", "-"]
+    assert non_numbers["count"].tolist() == [2, 2]
+    assert [list(rows) for rows in non_numbers["positions"]] == [[1, 4], [6, 9]]
+
+
+@pytest.mark.parametrize("values", [[None, np.nan], ["1", "2,000"], []])
+def test_numeric_scan_of_columns_without_non_numbers(values):
+    numbers, non_numbers = scan_numeric_column(pd.Series(values, dtype=object))
+    np.testing.assert_array_equal(numbers, pd.to_numeric([str(value).replace(",", "") for value in values],
+                                                         errors="coerce"))
+    assert len(non_numbers) == 0
+
+
+def test_short_label_cuts_text_and_keeps_other_values():
+    assert short_label("ייצור מתכות", 5) == "ייצור"
+    assert short_label("עכו", 5) == "עכו"
+    assert short_label(17, 1) == 17
+    assert np.isnan(short_label(np.nan, 1))
+
+
+# Industry names, two of them the same for their first 8 characters, and a missing name
+industry_names = ["ייצור מלט", "ייצור מלחים", "שחיטה", None, "ייצור מלט", "התפלת מים"]
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_labels_are_mapped_as_row_by_row(categorical):
+    series = pd.Series(industry_names, name="AnafAtarSvivati", index=np.arange(10, 16))
+    if categorical:
+        series = series.astype("category")
+    for how_short in [8, 100]:  # Two of the labels merge, or none
+        mapped = map_labels(series, lambda label: short_label(label, how_short))
+        expected = pd.Series([short_label(label, how_short) for label in series.astype(object)], name=series.name,
+                             index=series.index)
+        pd.testing.assert_series_equal(mapped.astype(object), expected.where(expected.notnull(), np.nan))
+        if categorical:
+            assert list(mapped.cat.categories) == sorted(expected.dropna().unique())
+        else:
+            assert mapped.dtype == object
+
+
+def test_category_codes_are_kept_when_no_labels_merge():
+    series = pd.Series(pd.Categorical(industry_names))
+    mapped = map_labels(series, lambda label: "(" + label + ")")
+    np.testing.assert_array_equal(mapped.cat.codes, series.cat.codes)
+    reversed_labels = map_labels(series, lambda label: label[::-1])  # Renamed categories are sorted again
+    assert list(reversed_labels.cat.categories) == sorted(reversed_labels.cat.categories)
+    assert reversed_labels.astype(object).tolist() == [label[::-1] if label else np.nan for label in industry_names]
+
+
+def test_shortened_frames_leave_the_original_unchanged():
+    data = pd.DataFrame({"AnafAtarSvivati": pd.Categorical(industry_names), "TchumPeilutAtarSvivati":
+                         [product_full_names[0], "unknown activity"] + [product_full_names[1]] * 4})
+    original = data.copy()
+    short = shorten_name(data, ["AnafAtarSvivati"], how_short=5)
+    products = shorten_product_name(data, "TchumPeilutAtarSvivati")
+    pd.testing.assert_frame_equal(data, original)
+    assert short["AnafAtarSvivati"].astype(object).tolist()[0:3] == ["ייצור", "ייצור", "שחיטה"]
+    assert products["TchumPeilutAtarSvivati"].tolist()[0:3] == [product_short_names[product_full_names[0]],
+                                                                 "unknown activity",
+                                                                 product_short_names[product_full_names[1]]]
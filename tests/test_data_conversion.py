@@ -0,0 +1,99 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import json
+
+import pandas as pd
+import pytest
+
+import data_conversion
+from load_data import load_data_from_csv_chunked
+from output_paths import output_path
+from register_columns import analysis_columns, ingestion_dtypes
+from synthetic_data import write_synthetic_csv
+
+
+# Synthetic register csv loaded in chunks the way main loads it, text columns are categories
+def chunked_frame(folder, rows=3000, chunksize=700):
+    csv_file_name = write_synthetic_csv(str(folder / "register.csv"), rows=rows, chunk_rows=1000)
+    return load_data_from_csv_chunked(csv_file_name, usecols=analysis_columns, column_dtypes=ingestion_dtypes,
+                                      chunksize=chunksize)
+
+
+def test_observe_data_describes_frames_without_object_columns(output_root_folder, capsys):
+    data = chunked_frame(output_root_folder)
+    data_conversion.observe_data(data)
+    output = capsys.readouterr().out
+    assert "Text Data Description:" in output
+    assert "YeshuvAtarSvivatiMenifa" in output.split("Text Data Description:")[1]
+
+
+def test_clean_data_ui_runs_on_a_chunked_frame_and_saves_the_schema(output_root_folder, monkeypatch):
+    data = chunked_frame(output_root_folder)
+    monkeypatch.setattr("builtins.input", lambda: "1")  # Every column remains unchanged
+    schema_file_name = str(output_root_folder / "conversion_schema.json")
+    cleaned = data_conversion.clean_data_ui(data, schema_file_name=schema_file_name)
+    with open(schema_file_name, encoding="utf-8") as file1:
+        schema = json.load(file1)
+    assert schema == {col: "unchanged" for col in cleaned.columns}
+    assert set(cleaned.columns) <= set(analysis_columns)
+
+
+# Frame with a column for each conversion, and a column with one value which is removed without asking
+def conversion_frame():
+    return pd.DataFrame({"ShnatDivuach": ["2018", "2019", "2020", "2019"],
+                         "TaarichDivuach": ["01/02/2019", "03/04/2020", "05/06/2021", "07/08/2022"],
+                         "SugPlita": ["air", "water", "air", None],
+                         "ShemMitkan": ["a", "b", "c", "d"],
+                         "KamutPlita": [1.5, 2.0, None, 4.0],
+                         "Medina": ["Israel"] * 4})
+
+
+# Lines of a report written by the cleaning
+def report_lines(report_name):
+    with open(output_path("reports", report_name), encoding="utf-8") as file1:
+        return file1.read().splitlines()
+
+
+def test_clean_data_batch_replays_the_choices_of_clean_data_ui(output_root_folder, monkeypatch):
+    answers = iter(["2", "4", "5", "7", "1"])  # int, date, category, remove, unchanged
+    monkeypatch.setattr("builtins.input", lambda: next(answers))
+    schema_file_name = str(output_root_folder / "conversion_schema.json")
+    by_ui = data_conversion.clean_data_ui(conversion_frame(), schema_file_name=schema_file_name)
+    monkeypatch.setattr("builtins.input", lambda: pytest.fail("Replay asked for input"))
+    by_batch = data_conversion.clean_data_batch(conversion_frame(), schema_file_name)
+    pd.testing.assert_frame_equal(by_batch, by_ui)
+    assert list(by_batch.columns) == ["ShnatDivuach", "TaarichDivuach", "SugPlita", "KamutPlita"]
+    assert [str(dtype) for dtype in by_batch.dtypes] == ["int64", "datetime64[ns]", "category", "float64"]
+    assert report_lines("ForManual.txt") == []  # Every column converted
+    assert report_lines("deletedColumns.txt") == ["Medina", "ShemMitkan"]
+
+
+def test_clean_data_batch_reports_failed_and_unknown_columns(output_root_folder):
+    schema_file_name = str(output_root_folder / "conversion_schema.json")
+    data_conversion.save_conversion_schema({"ShnatDivuach": "int", "TaarichDivuach": "int"}, schema_file_name)
+    data = conversion_frame()
+    data.loc[1, "ShnatDivuach"] = "unknown"
+    cleaned = data_conversion.clean_data_batch(data, schema_file_name)
+    pd.testing.assert_series_equal(cleaned["ShnatDivuach"], data["ShnatDivuach"])  # Left unchanged
+    assert report_lines("ForManual.txt") == [
+        "ShnatDivuach cannot be converted into int", "TaarichDivuach cannot be converted into int",
+        "SugPlita is not in conversion schema", "ShemMitkan is not in conversion schema",
+        "KamutPlita is not in conversion schema"]
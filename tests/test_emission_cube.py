@@ -0,0 +1,116 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import visualize
+from generators import accident_non_acci_graph_generator, accidental_graph_generator, \
+    accidents_non_accidents_shotgun, cube_dimensions, cube_rollup, cube_values, emission_cube
+from instrumentation import frame_mb, save_trace, start_trace
+
+
+# Rows with random dimension values (some of them NaN unless missing is False) and emissions,
+# dimensions as text or as categories
+def emission_rows(categorical, rows=2000, seed=0, missing=True):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col in cube_dimensions:
+        labels = [col + " " + str(value) for value in range(6)] + ([None] if missing else [])
+        values = rng.choice(np.array(labels, dtype=object), rows)
+        data[col] = pd.Categorical(values) if categorical else values
+    for col in cube_values:
+        data[col] = rng.gamma(1.0, 100.0, rows)
+    return pd.DataFrame(data)
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_cube_keeps_rows_with_missing_dimensions(categorical):
+    data = emission_rows(categorical)
+    cube = emission_cube(data)
+    assert np.allclose(cube[cube_values].sum(), data[cube_values].sum())
+    for col in cube_dimensions:
+        assert cube[col].isnull().sum() > 0
+        assert cube[col].dtype == data[col].dtype
+        if categorical:
+            assert list(cube[col].cat.categories) == list(data[col].cat.categories)
+
+
+def test_cube_keeps_category_order_without_missing_dimensions():
+    data = emission_rows(categorical=True, missing=False)
+    cube = emission_cube(data.iloc[::-1])  # Rows appear in another order than their categories
+    for col in cube_dimensions:
+        assert list(cube[col].cat.categories) == list(data[col].cat.categories)
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+@pytest.mark.parametrize("by", [[col] for col in cube_dimensions] + [list(pair) for pair in
+                                                                     itertools.combinations(cube_dimensions, 2)])
+def test_cube_rollups_match_pivot_tables_of_the_rows(categorical, by):
+    data = emission_rows(categorical)
+    values = ["KamutPlitaBeTeunot", "KamutPlitaLoBeTeunot"]
+    rollup = cube_rollup(cube=emission_cube(data), by=by, values=values)
+    # Pivot of the rows with text dimensions, as before the dimensions were categories
+    pivot = pd.pivot_table(data=data.astype({col: object for col in cube_dimensions}), values=values, index=by,
+                           aggfunc=np.sum).sort_index()
+    assert list(rollup.index) == list(pivot.index)
+    assert np.allclose(rollup.to_numpy(), pivot[sorted(values)].to_numpy())
+
+
+# Rows of one emission type and pollutant group, with two activity labels which differ after their first 40 characters
+def long_label_rows(x_val_col):
+    prefix = "א" * 40
+    data = emission_rows(categorical=True, missing=False)
+    data["SugPlita"] = "אוויר"
+    data["KvutzatMezahamim"] = "מתכות כבדות"
+    data[x_val_col] = pd.Categorical(np.where(np.arange(len(data)) % 2 == 0, prefix + " 1", prefix + " 2"))
+    return data
+
+
+@pytest.mark.parametrize("x_val_col", ["SugPeilutAtarSvivati", "TchumPeilutAtarSvivati"])
+def test_only_comparison_charts_shorten_activity_types(output_root_folder, x_val_col):
+    data = long_label_rows(x_val_col)
+    cube = emission_cube(data)
+    comparison_jobs = accident_non_acci_graph_generator(data=data, x_val_col=x_val_col, folder_name="compare",
+                                                        cube=cube)
+    accident_jobs = accidental_graph_generator(data=data, x_val_col=x_val_col, folder_name="accidents", cube=cube)
+    assert len(accident_jobs[0]["pv"]) == 2
+    assert len(comparison_jobs[0]["pv"]) == (1 if x_val_col == "SugPeilutAtarSvivati" else 2)
+
+
+def test_shotgun_records_its_memory_and_leaves_the_data_unchanged(output_root_folder, monkeypatch):
+    data = emission_rows(categorical=True, rows=20000)
+    original = data.copy()
+    cube = emission_cube(data)
+    rendered = []
+    monkeypatch.setattr(visualize, "render_jobs", lambda jobs, workers=None: rendered.extend(jobs))
+    start_trace(trace_memory=False)
+    accidents_non_accidents_shotgun(data=data, x_val_col="SugPeilutAtarSvivati", cube=cube)
+    trace = save_trace(str(output_root_folder / "trace.json"))
+    record = [record for record in trace["spans"] if record["name"].endswith("accidents_non_accidents_shotgun")][0]
+    assert record["errors"] == [] and len(rendered) > 0
+    assert record["data_mb"] == frame_mb(data)
+    assert record["cube_mb"] == frame_mb(cube) < record["data_mb"]
+    assert record["jobs_mb"] == pytest.approx(sum(frame_mb(job["pv"]) for job in rendered))
+    assert record["jobs_mb"] < record["data_mb"]  # Jobs hold pivots, not rows
+    pd.testing.assert_frame_equal(data, original)
@@ -0,0 +1,103 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+import pandas as pd
+
+from data_cleaning import data_value_cleaining, value_cleaning_columns, value_cleaning_version
+from instrumentation import save_trace, start_trace
+
+too_low = 'פליטה נמוכה מכמות הסף'
+non_accident = 'לא נפלט בתקלה'
+
+
+# Raw register rows with the given total and accident emission values
+def raw_rows(total_values, accident_values):
+    rows = len(total_values)
+    return pd.DataFrame({"KamutPlita": total_values, "KamutPlitaBeTeunot": accident_values,
+                         "SachTipulPsoletMesukenet": np.ones(rows), "SachSilukPsoletMesukenet": np.ones(rows),
+                         "SachTipulPsoletLoMesukenet": np.ones(rows), "SachSilukPsoletLoMesukenet": np.ones(rows)})
+
+
+def test_not_in_accident_rows_are_not_accidental_below_threshold_too():
+    cleaned = data_value_cleaining(raw_rows(["1,200", too_low], [non_accident, non_accident]))
+    assert list(cleaned["Accidental"]) == [False, False]
+    assert cleaned.attrs["emission_state_counts"]["below_threshold_not_in_accident"] == 1
+
+
+def test_below_threshold_rows_are_accidental_otherwise():
+    cleaned = data_value_cleaining(raw_rows([too_low, too_low, "5"], [too_low, "3", too_low]))
+    assert list(cleaned["Accidental"]) == [True, True, True]
+    assert cleaned["KamutPlita"].isnull().tolist() == [True, True, False]
+    assert cleaned["KamutPlitaLoBeTeunot"].tolist()[2] == 5
+
+
+def test_numeric_rows_have_no_accidental_flag():
+    cleaned = data_value_cleaining(raw_rows(["2,500.5"], ["0.5"]))
+    assert cleaned["Accidental"].isnull().all()
+    assert cleaned["KamutPlita"].tolist() == [2500.5]
+    assert cleaned["KamutPlitaLoBeTeunot"].tolist() == [0]
+
+
+def test_emission_columns_without_values_are_unavailable():
+    cleaned = data_value_cleaining(raw_rows(["1,200", None], [np.nan, np.nan]))
+    assert cleaned["KamutPlita"].tolist()[0] == 1200
+    assert cleaned["KamutPlitaBeTeunot"].isnull().all()
+    assert sum(cleaned.attrs["emission_state_counts"].values()) == 2
+
+
+def test_state_counts_and_unrecognized_values_are_recorded_in_the_trace(output_root_folder):
+    start_trace(trace_memory=False)
+    cleaned = data_value_cleaining(raw_rows(["1,200", "n/a"], [non_accident, "3"]))
+    data_value_cleaining(cleaned)
+    trace = save_trace(str(output_root_folder / "trace.json"))
+    first, second = [record for record in trace["spans"] if record["name"] == "data_cleaning.data_value_cleaining"]
+    assert first["emission_state_counts"] == cleaned.attrs["emission_state_counts"]
+    assert first["unrecognized_emission_values"] == {"KamutPlita": ["n/a"]}
+    assert second["already_value_cleaned"]
+
+
+def test_cleaning_again_returns_the_cleaned_data_as_is():
+    raw = raw_rows(["1,200", too_low, "5"], [non_accident, "3", too_low])
+    raw.attrs["cleaning_steps"] = {"conversion": 1}
+    original = raw.copy()
+    cleaned = data_value_cleaining(raw)
+    pd.testing.assert_frame_equal(raw, original)  # The raw data is not changed
+    assert raw.attrs["cleaning_steps"] == {"conversion": 1}
+    assert cleaned.attrs["cleaning_steps"] == {"conversion": 1, "value_cleaning": value_cleaning_version}
+    assert data_value_cleaining(cleaned) is cleaned
+
+
+def test_cleaned_data_without_attrs_is_recognized_by_its_columns():
+    cleaned = data_value_cleaining(raw_rows(["1,200", too_low], [non_accident, "3"]))
+    copied = pd.concat([cleaned, cleaned], ignore_index=True)
+    copied.attrs = {}  # As operations which drop the attrs
+    assert data_value_cleaining(copied) is copied
+    partly = copied.drop(columns=value_cleaning_columns[0:1])
+    assert data_value_cleaining(partly) is not partly
+
+
+def test_data_cleaned_by_another_version_is_cleaned_again():
+    raw = raw_rows(["1,200"], [non_accident])
+    raw.attrs["cleaning_steps"] = {"value_cleaning": value_cleaning_version - 1}
+    cleaned = data_value_cleaining(raw)
+    assert cleaned is not raw
+    assert cleaned["KamutPlita"].tolist() == [1200]
+    assert cleaned.attrs["cleaning_steps"]["value_cleaning"] == value_cleaning_version
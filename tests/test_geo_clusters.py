@@ -0,0 +1,134 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from geopy.location import Location
+
+import generators
+from geo_clusters import cluster_emissions, cluster_map_frames, cluster_summary, dbscan_haversine, haversine_km, \
+    neighbor_pairs
+from geoloc_for_map import geocode_entry, normalize_city_name, save_geocode_store
+from instrumentation import save_trace, start_trace
+
+
+# Random points around Israel, some of them in tight groups, with a weight (factories) for each
+def random_points(count=400, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([29.5, 34.3], [33.2, 35.8], size=(12, 2))
+    group = rng.integers(0, len(centers), count)
+    spread = np.where(rng.random(count) < 0.7, 0.02, 0.5)[:, None]
+    points = centers[group] + rng.normal(0, 1, (count, 2)) * spread
+    return points[:, 0], points[:, 1], rng.integers(1, 4, count).astype(float)
+
+
+# DBSCAN by comparing every pair of points: core points, clusters of connected core points (as sets) and noise points
+def brute_force_dbscan(latitude, longitude, weights, eps_km, min_size):
+    distance = haversine_km(latitude[:, None], longitude[:, None], latitude[None, :], longitude[None, :])
+    near = distance <= eps_km
+    core = near.astype(float) @ weights >= min_size
+    clusters = []
+    unvisited = set(np.flatnonzero(core))
+    while unvisited:
+        stack = [unvisited.pop()]
+        cluster = set(stack)
+        while stack:
+            point = stack.pop()
+            for other in np.flatnonzero(near[point] & core):
+                if other in unvisited:
+                    unvisited.remove(other)
+                    cluster.add(other)
+                    stack.append(other)
+        clusters.append(frozenset(cluster))
+    noise = set(np.flatnonzero(~core & ~(near[:, core].any(axis=1))))
+    return core, set(clusters), noise, near
+
+
+@pytest.mark.parametrize("eps_km, min_size", [(1, 3), (5, 5), (20, 10)])
+def test_dbscan_haversine_matches_a_brute_force_neighbour_check(eps_km, min_size):
+    latitude, longitude, weights = random_points()
+    labels = dbscan_haversine(latitude, longitude, eps_km=eps_km, min_size=min_size, weights=weights)
+    core, clusters, noise, near = brute_force_dbscan(latitude, longitude, weights, eps_km, min_size)
+
+    first, second = neighbor_pairs(latitude, longitude, eps_km)
+    assert set(zip(first.tolist(), second.tolist())) | set(zip(second.tolist(), first.tolist())) == \
+           set(zip(*np.nonzero(near & ~np.eye(len(latitude), dtype=bool))))
+    assert {frozenset(np.flatnonzero(core & (labels == label))) for label in set(labels[core])} == clusters
+    assert set(np.flatnonzero(labels == -1)) == noise
+    for point in np.flatnonzero(~core & (labels != -1)):  # Border points join a cluster of a core neighbour
+        assert (near[point] & core & (labels == labels[point])).any()
+    cluster_weights = [weights[labels == label].sum() for label in range(labels.max() + 1)]
+    assert cluster_weights == sorted(cluster_weights, reverse=True)
+
+
+# Geocoded rows of two clusters of factories (north and south) and a lone factory
+def clustered_rows():
+    return pd.DataFrame({
+        "MisparTaagidShutfutMenifa": [1, 1, 2, 3, 4, 5, 6],
+        "YeshuvAtarSvivatiMenifa": ["חיפה", "חיפה", "חיפה", "נשר", "אשדוד", "אשדוד", "ערד"],
+        "latitude": [32.80, 32.80, 32.80, 32.76, 31.80, 31.80, 31.26],
+        "longitude": [35.00, 35.00, 35.00, 35.04, 34.65, 34.65, 35.21],
+        "KvutzatMezahamim": ["מתכות", "חלקיקים", "מתכות", "מתכות", "חלקיקים", "חלקיקים", "מתכות"],
+        "KamutPlita": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+        "cluster": [0, 0, 0, 0, 1, 1, -1]
+    })
+
+
+def test_cluster_summary_gives_centroids_factories_cities_and_emissions():
+    summary = cluster_summary(clustered_rows(), values=["KamutPlita"])
+    assert summary["factories"].tolist() == [3, 2]
+    assert summary.loc[0, "cities"] == "חיפה, נשר"
+    assert summary["KamutPlita"].tolist() == [10.0, 11.0]
+    assert summary.loc[1, "radius_km"] == pytest.approx(0)
+    centroid = (np.mean([32.80, 32.80, 32.76]), np.mean([35.00, 35.00, 35.04]))
+    assert summary.loc[0, ["latitude", "longitude"]].tolist() == pytest.approx(centroid)
+    assert summary.loc[0, "radius_km"] == pytest.approx(haversine_km(*centroid, 32.76, 35.04))
+
+
+def test_cluster_map_frames_skip_clusters_without_emissions():
+    clustered = clustered_rows()
+    summary = cluster_summary(clustered, values=["KamutPlita"])
+    emissions = cluster_emissions(clustered, values=["KamutPlita"])
+    data_list, data_values_list = cluster_map_frames(summary, emissions, value="KamutPlita", max_size=50)
+    assert data_values_list == ["חלקיקים", "מתכות"]
+    assert [frame["cluster"].tolist() for frame in data_list] == [[0, 1], [0]]
+    assert data_list[0]["size"].max() == 50
+    assert data_list[0]["YeshuvAtarSvivatiMenifa"].tolist()[0] == "0: חיפה, נשר"
+
+    no_clusters = clustered.assign(cluster=-1)
+    assert cluster_map_frames(cluster_summary(no_clusters, values=["KamutPlita"]),
+                              cluster_emissions(no_clusters, values=["KamutPlita"]), value="KamutPlita") == ([], [])
+
+
+def test_industry_clusters_without_clusters_reports_no_error(output_root_folder):
+    rows = clustered_rows()
+    store_file_name = str(output_root_folder / "geocodes.json")
+    save_geocode_store({normalize_city_name(city): geocode_entry(city, Location(city, (latitude, longitude, 0), {}))
+                        for city, latitude, longitude in
+                        zip(rows["YeshuvAtarSvivatiMenifa"], rows["latitude"], rows["longitude"])}, store_file_name)
+    data = rows.drop(columns=["latitude", "longitude", "cluster"])
+    for col in generators.cube_values:
+        data[col] = data["KamutPlita"]
+    start_trace(trace_memory=False)
+    generators.industry_clusters(data=data, city_col="YeshuvAtarSvivatiMenifa", eps_km=5, min_size=50,
+                                 store_file_name=store_file_name)
+    trace = save_trace(str(output_root_folder / "trace.json"))
+    assert [record["errors"] for record in trace["spans"]] == [[] for record in trace["spans"]]
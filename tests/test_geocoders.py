@@ -0,0 +1,165 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import json
+import time
+import unicodedata
+
+import pandas as pd
+import pytest
+from geopy.location import Location
+
+import geoloc_for_map
+from geoloc_for_map import gazetteer_geocoder, geocode_entry, geoloc_loader, is_geocode_current, load_geocode_store, \
+    missing_cities, negative_ttl, nominatim_geocoder, normalize_city_name, save_geocode_store
+
+
+# Stand-in for the geopy Nominatim client, recording the clients made and the cities geocoded
+class FakeNominatim:
+    made = []
+    queries = []
+
+    def __init__(self, **options):
+        FakeNominatim.made.append(options)
+
+    def geocode(self, query, country_codes=None):
+        FakeNominatim.queries.append((query, country_codes))
+        return Location(query, (31.0, 35.0, 0.0), {})
+
+
+@pytest.fixture
+def fake_nominatim(monkeypatch):
+    FakeNominatim.made, FakeNominatim.queries = [], []
+    monkeypatch.setattr(geoloc_for_map.geopy, "Nominatim", FakeNominatim)
+    return FakeNominatim
+
+
+def test_nominatim_client_is_made_only_for_missing_cities(output_root_folder, fake_nominatim):
+    store_file_name = str(output_root_folder / "geocodes.json")
+    save_geocode_store({normalize_city_name("חיפה"): geocode_entry("חיפה", Location("חיפה", (32.8, 35.0, 0.0), {}))},
+                       store_file_name)
+    geocoder = nominatim_geocoder(min_delay_seconds=0)
+    data = pd.DataFrame({"city": ["חיפה", "חיפה"]})
+    geoloc_loader(data=data, city_col="city", store_file_name=store_file_name, geocoder=geocoder)
+    assert fake_nominatim.made == []
+
+    data = pd.DataFrame({"city": ["חיפה", "עכו", "ערד"]})
+    store = geoloc_loader(data=data, city_col="city", store_file_name=store_file_name, geocoder=geocoder)
+    assert len(fake_nominatim.made) == 1
+    assert "country_bias" not in fake_nominatim.made[0]
+    assert fake_nominatim.queries == [("עכו", "il"), ("ערד", "il")]
+    assert store[normalize_city_name("ערד")]["latitude"] == 31.0
+
+
+def test_nominatim_client_errors_stop_geocoding_without_raising(fake_nominatim, monkeypatch):
+    def failing_client(**options):
+        raise TypeError("unexpected keyword argument")
+
+    monkeypatch.setattr(geoloc_for_map.geopy, "Nominatim", failing_client)
+    assert list(nominatim_geocoder(min_delay_seconds=0)(["עכו"])) == []
+
+
+# Geocoder finding every city but the not_found ones, recording the cities it was asked for
+def list_geocoder(not_found=()):
+    asked = []
+
+    def geocoder(city_names):
+        for city_name in city_names:
+            asked.append(city_name)
+            yield city_name, None if city_name in not_found else Location(city_name, (31.0, 35.0, 0.0), {})
+
+    return geocoder, asked
+
+
+@pytest.mark.parametrize("variant", ["תל אביב - יפו", " תל  אביב-יפו ", "תל אביב־יפו", "תל אביב – יפו"])
+def test_spellings_of_a_city_name_have_one_store_key(variant):
+    assert normalize_city_name(variant) == normalize_city_name("תל אביב-יפו") == "תל אביב-יפו"
+
+
+def test_quote_marks_case_and_unicode_forms_have_one_store_key():
+    assert normalize_city_name("ג׳דיידה") == normalize_city_name("ג’דיידה") == "ג'דיידה"
+    assert normalize_city_name("פרדס חנה״") == normalize_city_name("פרדס חנה”")
+    assert normalize_city_name(unicodedata.normalize("NFD", "Café CITY")) == "café city"
+    assert normalize_city_name("עכו") != normalize_city_name("ערד")
+
+
+def test_negative_geocodes_expire_after_the_ttl():
+    now = time.time()
+    store = {"עכו": geocode_entry("עכו", Location("עכו", (32.9, 35.1, 0.0), {}), resolved_at=now - 10 * negative_ttl),
+             "ערד": geocode_entry("ערד", None, resolved_at=now - negative_ttl + 60),
+             "לוד": geocode_entry("לוד", None, resolved_at=now - negative_ttl - 60)}
+    assert is_geocode_current(store, "עכו", now=now)  # Coordinates never expire
+    assert is_geocode_current(store, "ערד", now=now)
+    assert not is_geocode_current(store, "לוד", now=now)
+    assert not is_geocode_current(store, "חיפה", now=now)
+    assert missing_cities(store, ["עכו", "ערד", "לוד", None, "חיפה", " חיפה", "לוד"]) == ["לוד", "חיפה"]
+    assert missing_cities(store, ["ערד"], ttl=30) == ["ערד"]
+
+
+def test_only_missing_and_expired_cities_are_geocoded_again(output_root_folder):
+    store_file_name = str(output_root_folder / "geocodes.json")
+    save_geocode_store({}, store_file_name)  # Not the legacy geocodes of the project
+    geocoder, asked = list_geocoder(not_found=["לוד"])
+    data = pd.DataFrame({"city": ["עכו", "לוד", "עכו"]})
+    store = geoloc_loader(data=data, city_col="city", store_file_name=store_file_name, geocoder=geocoder)
+    assert asked == ["עכו", "לוד"] and store["לוד"]["latitude"] is None
+    geoloc_loader(data=data, city_col="city", store_file_name=store_file_name, geocoder=geocoder)
+    assert asked == ["עכו", "לוד"]  # Negative entry is still current
+    geoloc_loader(data=data, city_col="city", store_file_name=store_file_name, ttl=0, geocoder=geocoder)
+    assert asked == ["עכו", "לוד", "לוד"]
+
+
+def test_resolve_times_in_the_future_are_clamped_when_the_store_is_loaded(tmp_path):
+    store_file_name = str(tmp_path / "geocodes.json")
+    save_geocode_store({"לוד": geocode_entry("לוד", None, resolved_at=time.time() + 365 * 24 * 60 * 60)},
+                       store_file_name)
+    store = load_geocode_store(store_file_name)
+    assert store["לוד"]["resolved_at"] <= time.time()
+    assert missing_cities(store, ["לוד"], ttl=0) == ["לוד"]
+    with open(store_file_name, encoding="utf-8") as file1:
+        assert json.load(file1)["לוד"]["resolved_at"] > time.time()  # The file is not changed by loading
+
+
+@pytest.fixture
+def gazetteer_file(tmp_path):
+    gazetteer = pd.DataFrame({"name": ["קריית שמונה", "תל אביב-יפו", "באר שבע"],
+                              "latitude": [33.21, 32.08, 31.25], "longitude": [35.57, 34.78, 34.79],
+                              "variants": [None, "תל אביב|יפו", None]})
+    gazetteer.to_csv(tmp_path / "gazetteer.csv", index=False, encoding="utf-8")
+    return str(tmp_path / "gazetteer.csv")
+
+
+def test_gazetteer_matches_names_variants_and_spellings(gazetteer_file):
+    city_names = ["באר שבע", "יפו", "תל אביב - יפו", "קרית שמונה", "קרית-שמונה", "עכו"]
+    geocoded = list(gazetteer_geocoder(gazetteer_file)(city_names))
+    assert [city_name for city_name, location in geocoded] == city_names
+    assert [location.address if location else None for city_name, location in geocoded] == [
+        "באר שבע", "תל אביב-יפו", "תל אביב-יפו", "קריית שמונה", "קריית שמונה", None]
+    assert (geocoded[0][1].latitude, geocoded[0][1].longitude) == (31.25, 34.79)
+
+
+def test_gazetteer_matches_misspelled_names_above_the_cutoff(gazetteer_file):
+    city_names = ["תל אביב-יפא", "קריית שמונא", "באר"]
+    fuzzy = dict(gazetteer_geocoder(gazetteer_file)(city_names))
+    assert fuzzy["תל אביב-יפא"].address == "תל אביב-יפו"
+    assert fuzzy["קריית שמונא"].address == "קריית שמונה"
+    assert fuzzy["באר"] is None  # Too far from any name
+    exact = dict(gazetteer_geocoder(gazetteer_file, fuzzy_cutoff=1.0)(city_names))
+    assert list(exact.values()) == [None, None, None]
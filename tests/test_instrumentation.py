@@ -0,0 +1,68 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import visualize
+from instrumentation import annotate_span, frame_mb, is_tracing, print_trace_summary, save_trace, span, \
+    start_trace
+
+
+def test_corrected_label_count_and_cache_statistics_are_traced(output_root_folder):
+    data = pd.DataFrame({"SugPeilutAtarSvivati": ["תעשייה", "אנרגיה", "תעשייה", None]})
+    start_trace(trace_memory=False)
+    with span("value_cleaning") as stage:
+        corrected_labels = visualize.correct_heb_mirror_values(dataframe=data, cols=["SugPeilutAtarSvivati"])
+        stage["heb_labels"] = sum(len(col_labels) for col_labels in corrected_labels.values())
+    visualize.correct_heb_mirror_list(["תעשייה"])
+    trace_file_name = str(output_root_folder / "trace.json")
+    save_trace(trace_file_name, run_info={"heb_label_cache": visualize.heb_label_cache_stats()})
+    with open(trace_file_name, encoding="utf-8") as file1:
+        trace = json.load(file1)
+    assert trace["spans"][0]["heb_labels"] == 2
+    assert trace["run"]["heb_label_cache"]["hits"] >= 1
+    assert set(trace["run"]["heb_label_cache"]) == {"hits", "misses", "size", "max_size"}
+
+
+def test_frame_memory_counts_the_text_of_the_columns():
+    text = pd.DataFrame({"AnafAtarSvivati": ["תעשייה כימית"] * 10000})
+    categories = text.astype("category")
+    assert frame_mb(text) > 10 * frame_mb(categories)
+    assert frame_mb(pd.DataFrame({"KamutPlita": np.zeros(2 ** 17)})) == pytest.approx(1, rel=0.01)
+
+
+def test_spans_record_their_data_memory_only_while_tracing(output_root_folder, capsys):
+    data = pd.DataFrame({"KamutPlita": np.zeros(2 ** 17)})
+    with span("shotgun") as stage:  # Not traced
+        annotate_span(data_mb=frame_mb(data))
+    assert not is_tracing() and "data_mb" not in stage
+    start_trace(trace_memory=True)
+    assert is_tracing()
+    with span("shotgun") as stage:
+        annotate_span(data_mb=frame_mb(data))
+        data.copy()  # Allocates about the memory of the data
+    trace = save_trace(str(output_root_folder / "trace.json"))
+    assert trace["spans"][0]["data_mb"] == pytest.approx(1, rel=0.01)
+    print_trace_summary(trace)
+    assert " x data)" in capsys.readouterr().out
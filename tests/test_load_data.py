@@ -0,0 +1,86 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from load_data import extend_category_codes, load_data_from_csv, load_data_from_csv_chunked
+from register_columns import analysis_columns, ingestion_dtypes
+from synthetic_data import write_synthetic_csv
+
+
+@pytest.fixture
+def register_csv(tmp_path):
+    return write_synthetic_csv(str(tmp_path / "register.csv"), rows=2000, chunk_rows=700)
+
+
+# Chunked load of the register columns the way main loads them
+def chunked_load(csv_file_name, chunksize):
+    return load_data_from_csv_chunked(csv_file_name, usecols=analysis_columns, column_dtypes=ingestion_dtypes,
+                                      chunksize=chunksize)
+
+
+@pytest.mark.parametrize("chunksize", [1, 333, 1999])
+def test_chunked_load_gives_the_frame_of_a_one_chunk_load(register_csv, chunksize):
+    one_chunk = chunked_load(register_csv, chunksize=10 ** 6)
+    chunked = chunked_load(register_csv, chunksize=chunksize)
+    pd.testing.assert_frame_equal(chunked, one_chunk)
+    for col in chunked.columns:
+        if isinstance(chunked[col].dtype, pd.CategoricalDtype):
+            assert list(chunked[col].cat.categories) == sorted(chunked[col].cat.categories)
+
+
+def test_chunked_load_has_the_values_of_the_one_shot_read(register_csv):
+    one_shot = load_data_from_csv(register_csv)
+    chunked = chunked_load(register_csv, chunksize=333)
+    assert list(chunked.columns) == [col for col in one_shot.columns if col in analysis_columns]
+    for col in chunked.columns:
+        if ingestion_dtypes.get(col) == "category":
+            assert isinstance(chunked[col].dtype, pd.CategoricalDtype)
+            pd.testing.assert_series_equal(chunked[col].astype(object), one_shot[col].astype(object),
+                                           check_names=False)
+        else:
+            assert pd.api.types.is_numeric_dtype(chunked[col])
+            numbers = pd.to_numeric(one_shot[col].astype(str).str.replace(",", "", regex=False), errors="coerce")
+            np.testing.assert_allclose(chunked[col].to_numpy(dtype=float), numbers.to_numpy(dtype=float), rtol=1e-6)
+    assert chunked["ShnatDivuach"].dtype == np.int16  # Whole numbers without NaN in every chunk
+    assert chunked["SachTipulPsoletMesukenet"].dtype == np.float32  # NaN in some chunks
+
+
+def test_category_codes_extend_across_chunks(tmp_path):
+    csv_file_name = str(tmp_path / "cities.csv")
+    pd.DataFrame({"YeshuvAtarSvivatiMenifa": ["חיפה", "חיפה", "עכו", None, "אשדוד", "חיפה", "ערד"],
+                  "ShnatDivuach": ["2018", "2019", "2019", "2019", "1,999", "2018", "2017"]}).to_csv(csv_file_name,
+                                                                                                  index=False)
+    loaded = load_data_from_csv_chunked(csv_file_name, column_dtypes={"YeshuvAtarSvivatiMenifa": "category",
+                                                                      "ShnatDivuach": "numeric"}, chunksize=2)
+    assert loaded["YeshuvAtarSvivatiMenifa"].astype(object).tolist() == ["חיפה", "חיפה", "עכו", np.nan, "אשדוד",
+                                                                        "חיפה", "ערד"]
+    assert list(loaded["YeshuvAtarSvivatiMenifa"].cat.categories) == sorted(["חיפה", "עכו", "אשדוד", "ערד"])
+    assert loaded["ShnatDivuach"].tolist() == [2018, 2019, 2019, 2019, 1999, 2018, 2017]
+
+    categories, codes = extend_category_codes(None, pd.Categorical(["b", "a", None]))
+    assert list(categories) == ["a", "b"] and codes.tolist() == [1, 0, -1]
+    categories, codes = extend_category_codes(categories, pd.Categorical(["c", "a"]))
+    assert list(categories) == ["a", "b", "c"] and codes.tolist() == [2, 0]
+    assert codes.dtype == np.int8
+    categories, codes = extend_category_codes(categories, pd.Categorical([None, None]))  # A chunk without values
+    assert list(categories) == ["a", "b", "c"] and codes.tolist() == [-1, -1]
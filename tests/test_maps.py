@@ -0,0 +1,92 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from output_paths import output_folder
+from visualize import industry_map, industry_size_map, map_points, map_points_geojson, safe_file_name, web_mercator
+
+
+# Emission rows of factories (several rows for each factory), two factories share the location of Haifa
+def factory_rows():
+    return pd.DataFrame({"MisparTaagidShutfutMenifa": [1, 1, 2, 3, 3, 3, 4],
+                         "YeshuvAtarSvivatiMenifa": ["חיפה", "חיפה", "חיפה", "עכו", "עכו", "עכו", "ערד"],
+                         "latitude": [32.8, 32.8, 32.8, 32.9, 32.9, 32.9, 31.3],
+                         "longitude": [35.0, 35.0, 35.0, 35.1, 35.1, 35.1, 35.2],
+                         "KamutPlita": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]})
+
+
+def test_map_points_count_the_factories_at_each_location():
+    points = map_points(factory_rows())
+    assert points.to_dict("list") == {"latitude": [32.8, 32.9, 31.3], "longitude": [35.0, 35.1, 35.2],
+                                      "YeshuvAtarSvivatiMenifa": ["חיפה", "עכו", "ערד"], "count": [2, 1, 1]}
+    rows = map_points(factory_rows().drop(columns=["MisparTaagidShutfutMenifa"]))  # Rows are counted instead
+    assert rows["count"].tolist() == [3, 3, 1]
+
+
+def test_map_points_geojson_has_a_feature_for_each_point():
+    geojson = map_points_geojson(map_points(factory_rows()))
+    assert len(geojson["features"]) == 3
+    assert geojson["features"][0]["geometry"]["coordinates"] == [35.0, 32.8]  # GeoJson is longitude first
+    assert geojson["features"][0]["properties"] == {"city": "חיפה", "count": 2}
+
+
+def test_industry_map_saves_one_layer_of_points_for_each_value(output_root_folder):
+    data = factory_rows()
+    industry_map(data_list=[data, data.iloc[3:]], data_values_list=["metals", "food"], industry_col="Anaf")
+    industry_map(data_list=[data], data_values_list=["clustered"], industry_col="Anaf", cluster=True)
+    folder = output_folder("folium")
+    assert sorted(os.listdir(folder)) == ["Anaf-clustered.html", "Anaf-food.html", "Anaf-metals.html"]
+    with open(os.path.join(folder, "Anaf-metals.html"), encoding="utf-8") as file1:
+        html = file1.read()
+    assert html.count('"type": "Feature"') == 3 and "circle_marker" not in html
+    with open(os.path.join(folder, "Anaf-clustered.html"), encoding="utf-8") as file1:
+        assert "L.markerClusterGroup" in file1.read()
+
+
+def test_cut_file_names_do_not_collide():
+    assert safe_file_name("KamutPlita-metals") == "KamutPlita-metals"
+    names = ["KamutPlita-" + "manufacture of basic metals " * 2 + suffix for suffix in ["iron", "steel"]]
+    cut = [safe_file_name(name) for name in names]
+    assert cut[0] != cut[1] and [len(name) for name in cut] == [40, 40]
+    assert cut[0] == safe_file_name(names[0])
+
+
+def test_web_mercator_of_known_points():
+    x, y = web_mercator([0, 180, -90], [0, 0, 85.0511287798])
+    np.testing.assert_allclose(x, [0, 20037508.34, -10018754.17])
+    np.testing.assert_allclose(y, [0, 0, 20037508.34], atol=1e-3)
+
+
+def test_all_industries_are_saved_in_one_selector_map(output_root_folder):
+    data = factory_rows().rename(columns={"KamutPlita": "Amount"})
+    industries = ["metals", "food", "chemicals"]
+    industry_size_map(data_list=[data, data.iloc[3:], data.iloc[:2]], data_values_list=industries,
+                      industry_col="Amount", single_document=True)
+    folder = output_folder("geoviews")
+    assert os.listdir(folder) == ["map Amount.html"]
+    with open(os.path.join(folder, "map Amount.html"), encoding="utf-8") as file1:
+        html = file1.read()
+    assert html.count('"type":"ColumnDataSource"') == 1
+    assert html.count('"type":"WMTSTileSource"') == 1
+    assert '"options":["metals","food","chemicals"]' in html
@@ -0,0 +1,69 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from generators import cutoff_summary, ranked_outliers
+
+
+# Emissions of industries sorted descending, the way industry_emission_rankings ranks them
+def emission_ranking(rows=25, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"AnafAtarSvivati": ["industry %d" % ind for ind in range(rows)],
+                         "KamutPlitaBeTeunot": np.sort(rng.gamma(0.5, 1000.0, rows))[::-1]})
+
+
+@pytest.mark.parametrize("rows", [24, 25])  # Even and odd numbers of values left for the median
+def test_cutoff_summary_gives_the_statistics_of_the_values_left(rows):
+    ranking = emission_ranking(rows)
+    cutoffs = [0, 1, 3, 10, rows - 1, rows, rows + 5]
+    summary = cutoff_summary(ranking, "KamutPlitaBeTeunot", cutoffs)
+    assert [row["cutoff"] for row in summary] == cutoffs[:5]  # Cutoffs which leave no values are skipped
+    values = ranking["KamutPlitaBeTeunot"]
+    for row in summary:
+        left = values.iloc[row["cutoff"]:]
+        assert row["rows"] == len(left)
+        assert row["max"] == left.max()
+        assert row["median"] == pytest.approx(left.median())
+        assert row["mean"] == pytest.approx(left.mean())
+        assert row["std"] == pytest.approx(left.std(ddof=0), abs=1e-6 * left.max())
+        assert row["removed_share"] == pytest.approx(1 - left.sum() / values.sum())
+        assert row["max_to_mean"] == pytest.approx(left.max() / left.mean())
+
+
+def test_cutoff_summary_of_emissions_without_amounts():
+    ranking = pd.DataFrame({"KamutPlitaBeTeunot": [0.0, 0.0]})
+    summary = cutoff_summary(ranking, "KamutPlitaBeTeunot", [0, 1])
+    assert [row["removed_share"] for row in summary] == [0, 0]
+    assert all(np.isnan(row["max_to_mean"]) for row in summary)
+
+
+def test_ranked_outliers_have_their_rank_and_shares():
+    ranking = emission_ranking()
+    outliers = ranked_outliers(ranking, "KamutPlitaBeTeunot", top_count=5)
+    assert outliers["rank"].tolist() == [1, 2, 3, 4, 5]
+    assert outliers["AnafAtarSvivati"].tolist() == ranking["AnafAtarSvivati"].iloc[:5].tolist()
+    share = ranking["KamutPlitaBeTeunot"] / ranking["KamutPlitaBeTeunot"].sum()
+    np.testing.assert_allclose(outliers["share"], share.iloc[:5])
+    np.testing.assert_allclose(outliers["cumulative_share"], share.cumsum().iloc[:5])
+    assert "rank" not in ranking.columns  # The ranking is not changed
+    assert len(ranked_outliers(ranking, "KamutPlitaBeTeunot", top_count=100)) == len(ranking)
@@ -0,0 +1,42 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+
+from output_paths import input_path, output_folder, output_path, output_root, output_root_variable, set_output_root
+
+
+def test_output_paths_are_under_the_output_root(output_root_folder):
+    assert output_root() == str(output_root_folder)
+    assert output_path("reports", "ForManual.txt") == os.path.join(str(output_root_folder), "ForManual.txt")
+    file_name = output_path("folium", "map.html", "factories")
+    assert file_name == os.path.join(str(output_root_folder), "map graphs - dots", "factories", "map.html")
+    assert os.path.isdir(os.path.dirname(file_name))  # Folders are created, the file is not
+    assert not os.path.exists(file_name)
+
+
+def test_relative_output_root_is_resolved_from_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(output_root_variable, raising=False)
+    assert output_root() == str(tmp_path / "Output_files")  # Default root
+    set_output_root("runs")
+    monkeypatch.chdir(os.path.dirname(input_path("main.py")))  # Paths do not follow the working directory
+    assert output_folder("figures", "graphs") == str(tmp_path / "runs" / "graphs")
+    assert os.path.isdir(tmp_path / "runs" / "graphs")
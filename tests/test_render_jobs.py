@@ -0,0 +1,66 @@
+'''
+    Analysis of Israel Pollutant Release and Transfer Register (PRTR)
+    Copyright (C) 2020  Doreen S. Ben-Zvi, PhD
+
+    Full license is locates in License.txt at project root folder.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import concurrent.futures
+import functools
+import multiprocessing
+
+import matplotlib
+import pandas as pd
+import pytest
+
+import visualize
+
+
+# Small bar chart jobs with Hebrew titles and tick labels, saved in folder
+def chart_jobs(folder, count=3):
+    jobs = []
+    for number in range(count):
+        pv = pd.DataFrame({"KamutPlitaBeTeunot": [1.0 + number, 2.0]}, index=["תעשייה", "אנרגיה"])
+        jobs.append(visualize.bar_chart_job(pv=pv, title_heb="פליטה %d" % number, col_name="מוצר",
+                                            output_folder_name=str(folder), is_x_rtl=True))
+    return jobs
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_render_jobs_on_worker_processes_saves_every_chart(output_root_folder, monkeypatch, start_method):
+    # Spawned workers start from a fresh interpreter, as they do on Windows
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor",
+                        functools.partial(concurrent.futures.ProcessPoolExecutor,
+                                          mp_context=multiprocessing.get_context(start_method)))
+    jobs = chart_jobs(output_root_folder)
+    visualize.render_jobs(jobs, workers=2)
+    assert sorted(path.name for path in output_root_folder.glob("*.png")) == \
+           sorted(job["title_heb"] + ".png" for job in jobs)
+
+
+def test_render_workers_start_headless_with_the_corrected_labels(monkeypatch):
+    monkeypatch.setattr(visualize, "corrected_heb_labels", {})
+    monkeypatch.setattr(visualize, "headless_render", dict(visualize.headless_render))
+    visualize.correct_heb_mirror_string.cache_clear()
+    labels = visualize.correct_job_labels(chart_jobs("."))
+    assert labels["מוצר"] == visualize.correct_heb_mirror_string("מוצר")
+
+    visualize.correct_heb_mirror_string.cache_clear()
+    with matplotlib.rc_context():  # The figure size and dpi of the worker are not kept for other tests
+        visualize.init_render_worker(figure_size=(4, 3), dpi=50, corrected_labels={"מוצר": "corrected"})
+    assert visualize.headless_render == {"enabled": True, "figure_size": (4, 3), "dpi": 50}
+    assert visualize.correct_heb_mirror_string("מוצר") == "corrected"
+    visualize.correct_heb_mirror_string.cache_clear()
@@ -18,8 +18,12 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
+import concurrent.futures
+import functools
+import hashlib
 import math
 import os
+import pathlib
 
 import altair as alt
 import altair_saver
@@ -33,18 +37,33 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 from bidi import algorithm as bidialg
-from bokeh.models import HoverTool
+from bokeh.io import save as bokeh_save
+from bokeh.layouts import column
+from bokeh.models import CDSView, ColumnDataSource, CustomJS, GroupFilter, HoverTool, Select, WMTSTileSource
+from bokeh.plotting import figure
+from bokeh.resources import CDN
+from folium.plugins import FastMarkerCluster
 from geoviews import dim, opts
 
 from data_cleaning import shorten_name
+from instrumentation import report_error, traced
+from output_paths import output_folder
 
 
 ###################
 # Code for graphs #
 ###################
 
-# Correct mirror string for string
+# Labels corrected by another process, given to render worker processes when they start (init_render_worker)
+corrected_heb_labels = {}
+
+
+# Correct mirror string for string.
+# Results are cached for the process as the same labels repeat in hundreds of charts.
+@functools.lru_cache(maxsize=8192)
 def correct_heb_mirror_string(heb):
+    if heb in corrected_heb_labels:
+        return corrected_heb_labels[heb]
     reshaped_title = arabic_reshaper.reshape(heb)
     reshaped_title = bidialg.get_display(reshaped_title)
     return reshaped_title
@@ -59,8 +78,41 @@ def correct_heb_mirror_list(heb_list):
     return corrected_list
 
 
-# Maximize figure window to fullscreen
+# Hits, misses and size of the corrected label cache
+def heb_label_cache_stats():
+    info = correct_heb_mirror_string.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+
+# Correct all distinct values of the columns at once, so tick labels of later charts are taken from the cache.
+# Values are shortened to how_short characters as they are displayed. Returns a dictionary for each column
+def correct_heb_mirror_values(dataframe, cols, how_short=None):
+    corrected_dict = {}
+    for col in cols:
+        if col in dataframe.columns:
+            values = [value[:how_short] for value in pd.unique(dataframe[col].dropna()) if isinstance(value, str)]
+            corrected_dict[col] = dict(zip(values, correct_heb_mirror_list(values)))
+    return corrected_dict
+
+
+# Headless rendering - figures are drawn off screen with a fixed size and DPI, without a GUI event loop
+headless_render = {"enabled": False, "figure_size": (19.2, 10.8), "dpi": 100}
+
+
+# Switch to headless rendering with a non interactive backend
+def set_headless_mode(figure_size=(19.2, 10.8), dpi=100):
+    plt.switch_backend("Agg")
+    headless_render.update({"enabled": True, "figure_size": tuple(figure_size), "dpi": dpi})
+    plt.rcParams["figure.figsize"] = figure_size
+    plt.rcParams["figure.dpi"] = dpi
+    plt.rcParams["savefig.dpi"] = dpi
+
+
+# Maximize figure window to fullscreen, or set the fixed figure size when rendering headless
 def make_fullscreen():
+    if headless_render["enabled"]:
+        plt.gcf().set_size_inches(*headless_render["figure_size"])
+        return
     bck = matplotlib.get_backend()
     if (bck == "Qt5Agg") or (bck == "Qt4Agg"):
         manager = plt.get_current_fig_manager()
@@ -75,157 +127,147 @@ def make_fullscreen():
     plt.pause(0.001)  # without this delay fullscreen only takes hold if plt.show() is used
 
 
-# Save matplotlib output_folder_name
-def save_figure(figure_name, output_folder_name="Output_files"):
-    working_directory = os.getcwd()
-    if output_folder_name != "":
-        if not os.path.exists(output_folder_name):
-            os.mkdir(output_folder_name)
-        os.chdir(output_folder_name)
-    plt.savefig(fname=figure_name, bbox_inches='tight')
+# Save matplotlib figure into output_folder_name (figures output folder if not given)
+def save_figure(figure_name, output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_folder("figures")
+    plt.savefig(fname=os.path.join(output_folder_name, figure_name), bbox_inches='tight')
     plt.close()
-    dir = os.getcwd()
-    os.chdir(working_directory)
-    return dir
+    return output_folder_name
+
+
+# Whether the chart is the instance used to compare log and non log y scales
+def is_presentation_comparison(col_by, emission_type, pollutant_group):
+    return col_by == "TchumPeilutAtarSvivati" and emission_type == "מקור מים" and pollutant_group == "חומרים אנאורגניים"
 
 
 # Compare log and non log y scales in one instance of accidental and non accidental emissions
-def compare_for_presentation(dataframe, pv, col_by, col_name, col_of):
-    if col_by == "TchumPeilutAtarSvivati" and dataframe["SugPlita"][0] == "מקור מים" and dataframe[col_of][
-        0] == "חומרים אנאורגניים":
-        fig, axes = plt.subplots(1, 2)
-        title_heb = 'פליטה של חומרים אנאורגניים בתאונות ובשגרה למקור מים לפי מוצר - השוואת לוג'
-        title_heb_corrected = correct_heb_mirror_string(title_heb)
-        fig.suptitle(title_heb_corrected)
-
-        for i, ax in enumerate(axes.flat):
-            if i == 0:
-                ax.set_title(correct_heb_mirror_string('ציר y רגיל'))
-                label_yaxis = correct_heb_mirror_string("פליטה (Kg)")
-                ax.set_ylabel(ylabel=label_yaxis)
-                pv.plot.bar(log=False, stacked=False, ax=ax)
-                correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
-                ax.set_xticklabels(labels=correct_ticks_labels)
-            elif i == 1:
-                ax.set_title(correct_heb_mirror_string('ציר y לוגריתמי'))
-                label_yaxis = correct_heb_mirror_string("פליטה (log Kg)")
-                ax.set_ylabel(ylabel=label_yaxis)
-                pv.plot.bar(log=True, stacked=False, ax=ax)
-                correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
-                ax.set_xticklabels(labels=correct_ticks_labels)
-            label_xaxis = correct_heb_mirror_string(col_name)
-            ax.set_xlabel(xlabel=label_xaxis)
-            fig.autofmt_xdate()
-
-        plt.setp(ax.get_xticklabels(), rotation=20, ha="right",
-                 rotation_mode="anchor", fontsize=6)
-        # plt.tight_layout()
-        make_fullscreen()
-        plt.show(block=False)
-        dir = save_figure(figure_name=title_heb)
-
-
-# Bar plot comparing accidental and non accidental emissions
-def accidents_with_non_acci(dataframes, col_by, col_of, title_template, col_name, output_folder_name, is_x_rtl=False,
-                            is_log=False):
-    if os.getcwd() != output_folder_name:
-        os.chdir(output_folder_name)
-    for dataframe in dataframes:
-        # Arrange data columns and legend
-        title_heb = title_template.format(dataframe[col_of][0], dataframe["SugPlita"][0], col_name)
-        title_heb_reversed = correct_heb_mirror_string(title_heb)
-        data_series = ['KamutPlitaLoBeTeunot', 'KamutPlitaBeTeunot']
-        new_legend = correct_heb_mirror_list(['כמות פליטה בשגרה', 'כמות פליטה בתאונות'])
-        pv = pd.pivot_table(data=dataframe, values=data_series, index=[col_by], aggfunc="sum")
-        pv.dropna(axis=0, how='any', inplace=True)
-        pv = pv.loc[~(pv == 0).all(axis=1)]
-
-        # pv.to_csv(title_heb+".txt", sep='\t', mode='a')
-
-        # Plot
-        if pv.size != 0:
-            pv.plot.bar(log=is_log, stacked=False)
-            ax = plt.gca()
-            fig = plt.gcf()
-            # Legend
-            ax.legend(new_legend)
-            # Figure title
-            ax.set_title(title_heb_reversed, fontsize=16)
-            # y axis label and ticks
-            label_yaxis = "פליטה (Kg)"
-            if is_log:
-                label_yaxis = "פליטה (log Kg)"
-            label_yaxis = correct_heb_mirror_string(label_yaxis)
+def compare_for_presentation(pv, col_name, output_folder_name=None):
+    fig, axes = plt.subplots(1, 2)
+    title_heb = 'פליטה של חומרים אנאורגניים בתאונות ובשגרה למקור מים לפי מוצר - השוואת לוג'
+    title_heb_corrected = correct_heb_mirror_string(title_heb)
+    fig.suptitle(title_heb_corrected)
+
+    for i, ax in enumerate(axes.flat):
+        if i == 0:
+            ax.set_title(correct_heb_mirror_string('ציר y רגיל'))
+            label_yaxis = correct_heb_mirror_string("פליטה (Kg)")
             ax.set_ylabel(ylabel=label_yaxis)
-            # x axis label and ticks
-            label_xaxis = correct_heb_mirror_string(col_name)
-            ax.set_xlabel(xlabel=label_xaxis)
-            if is_x_rtl:
-                correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
-                ax = plt.gca()
-                ax.set_xticklabels(labels=correct_ticks_labels)
-            plt.setp(ax.get_xticklabels(), rotation=20, ha="right",
-                     rotation_mode="anchor", fontsize=6)
-            fig.autofmt_xdate()
-
-            plt.tight_layout()
-            make_fullscreen()
-            # plt.show(block=False)
-            dir = save_figure(figure_name=title_heb, output_folder_name=output_folder_name)
-            compare_for_presentation(dataframe=dataframe, pv=pv, col_by=col_by, col_name=col_name, col_of=col_of)
-
-
-# Bar plot displaying accidental or non accidental emissions
-def accidents_or_non_acci(dataframes, col_by, col_of, title_template, col_name, data_series, is_x_rtl=False,
-                          is_log=False):
-    for dataframe in dataframes:
-        # Arrange data columns and legend
-        title_heb = title_template.format(dataframe[col_of][0], dataframe["SugPlita"][0], col_name)
-        title_heb_reversed = correct_heb_mirror_string(title_heb)
-        pv = pd.pivot_table(data=dataframe, values=data_series, index=[col_by], aggfunc="sum")
-        pv.dropna(axis=0, how='any', inplace=True)
-        pv = pv.loc[~(pv == 0).all(axis=1)]
-
-        # pv.to_csv(title_heb + ".txt", sep='\t', mode='a')
-
-        # Plot
-        if pv.size != 0:
-            pv.plot.bar(log=is_log, stacked=False, legend=False)
-            ax = plt.gca()
-            fig = plt.gcf()
-            # Legend
-            # Figure title
-            ax.set_title(title_heb_reversed, fontsize=16)
-            # y axis label and ticks
-            label_yaxis = "פליטה (Kg)"
-            if is_log:
-                label_yaxis = "פליטה (log Kg)"
-            label_yaxis = correct_heb_mirror_string(label_yaxis)
+            pv.plot.bar(log=False, stacked=False, ax=ax)
+            correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
+            ax.set_xticklabels(labels=correct_ticks_labels)
+        elif i == 1:
+            ax.set_title(correct_heb_mirror_string('ציר y לוגריתמי'))
+            label_yaxis = correct_heb_mirror_string("פליטה (log Kg)")
             ax.set_ylabel(ylabel=label_yaxis)
-            # x axis label and ticks
-            label_xaxis = correct_heb_mirror_string(col_name)
-            ax.set_xlabel(xlabel=label_xaxis)
-            if is_x_rtl:
-                correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
-                ax = plt.gca()
-                ax.set_xticklabels(labels=correct_ticks_labels)
-            plt.setp(ax.get_xticklabels(), rotation=20, ha="right",
-                     rotation_mode="anchor", fontsize=6)
-            fig.autofmt_xdate()
-
-            plt.tight_layout()
-            make_fullscreen()
-            # plt.show(block=False)
-            dir = save_figure(figure_name=title_heb, output_folder_name="")
+            pv.plot.bar(log=True, stacked=False, ax=ax)
+            correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
+            ax.set_xticklabels(labels=correct_ticks_labels)
+        label_xaxis = correct_heb_mirror_string(col_name)
+        ax.set_xlabel(xlabel=label_xaxis)
+        fig.autofmt_xdate()
+
+    plt.setp(ax.get_xticklabels(), rotation=20, ha="right",
+             rotation_mode="anchor", fontsize=6)
+    # plt.tight_layout()
+    make_fullscreen()
+    if not headless_render["enabled"]:
+        plt.show(block=False)
+    dir = save_figure(figure_name=title_heb, output_folder_name=output_folder_name)
+
+
+# Bar chart job - the aggregated pivot with its labels and options.
+# Jobs hold no figures or full data, so they are small and can be sent to worker processes.
+def bar_chart_job(pv, title_heb, col_name, output_folder_name, legend=None, is_x_rtl=False, is_log=False,
+                  compare_log=False):
+    return {"pv": pv, "title_heb": title_heb, "col_name": col_name, "output_folder_name": output_folder_name,
+            "legend": legend, "is_x_rtl": is_x_rtl, "is_log": is_log, "compare_log": compare_log}
+
+
+# Plot a bar chart job and save it
+def render_bar_chart(job):
+    pv = job["pv"]
+    pv.plot.bar(log=job["is_log"], stacked=False, legend=job["legend"] is not None)
+    ax = plt.gca()
+    fig = plt.gcf()
+    # Legend
+    if job["legend"] is not None:
+        ax.legend(correct_heb_mirror_list(job["legend"]))
+    # Figure title
+    ax.set_title(correct_heb_mirror_string(job["title_heb"]), fontsize=16)
+    # y axis label and ticks
+    label_yaxis = "פליטה (Kg)"
+    if job["is_log"]:
+        label_yaxis = "פליטה (log Kg)"
+    label_yaxis = correct_heb_mirror_string(label_yaxis)
+    ax.set_ylabel(ylabel=label_yaxis)
+    # x axis label and ticks
+    label_xaxis = correct_heb_mirror_string(job["col_name"])
+    ax.set_xlabel(xlabel=label_xaxis)
+    if job["is_x_rtl"]:
+        correct_ticks_labels = correct_heb_mirror_list(pv.axes[0])
+        ax = plt.gca()
+        ax.set_xticklabels(labels=correct_ticks_labels)
+    plt.setp(ax.get_xticklabels(), rotation=20, ha="right",
+             rotation_mode="anchor", fontsize=6)
+    fig.autofmt_xdate()
+
+    plt.tight_layout()
+    make_fullscreen()
+    # plt.show(block=False)
+    dir = save_figure(figure_name=job["title_heb"], output_folder_name=job["output_folder_name"])
+    if job["compare_log"]:
+        compare_for_presentation(pv=pv, col_name=job["col_name"], output_folder_name=job["output_folder_name"])
+    return job["title_heb"]
+
+
+# Worker processes have no window to draw in, so they always render headless.
+# Workers may not share the memory of the main process (they are spawned on Windows and macOS), so the headless
+# settings and the corrected labels of the jobs are passed to each worker when it starts
+def init_render_worker(figure_size, dpi, corrected_labels=None):
+    set_headless_mode(figure_size=figure_size, dpi=dpi)
+    corrected_heb_labels.update(corrected_labels or {})
+
+
+# Labels of bar chart jobs are corrected once, before the worker processes are started.
+# Returns the corrected label of each label
+def correct_job_labels(jobs):
+    labels = set()
+    for job in jobs:
+        labels.update([job["title_heb"], job["col_name"]] + list(job.get("legend") or []))
+        if job["is_x_rtl"]:
+            labels.update(job["pv"].index)
+    labels = [label for label in labels if isinstance(label, str)]
+    return dict(zip(labels, correct_heb_mirror_list(labels)))
+
+
+# Render chart jobs on a pool of workers processes (all CPUs if None), or one after another if workers is 1.
+# A failing chart is reported and does not stop the others.
+@traced
+def render_jobs(jobs, render=render_bar_chart, workers=None):
+    corrected_labels = correct_job_labels(jobs)
+    if workers == 1 or len(jobs) < 2:
+        for job in jobs:
+            try:
+                render(job)
+            except Exception as e:
+                report_error("Error during rendering " + str(job.get("title_heb")), e)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                                                initargs=(headless_render["figure_size"], headless_render["dpi"],
+                                                          corrected_labels)) as executor:
+        futures = {executor.submit(render, job): job.get("title_heb") for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                report_error("Error during rendering " + str(futures[future]), e)
 
 
 # Petal Scatter plot with color indicating category and size indicating value
-def multi_feat_scatter(data, filename, x_col, y_col, size_col, color_col, output_folder_name="Output_files"):
-    working_directory = os.getcwd()
-    if output_folder_name != "":
-        if not os.path.exists(output_folder_name):
-            os.mkdir(output_folder_name)
-        os.chdir(output_folder_name)
+def multi_feat_scatter(data, filename, x_col, y_col, size_col, color_col, output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_folder("altair")
     chart = alt.Chart(data).mark_circle().encode(
         alt.X(x_col, scale=alt.Scale(zero=False)),
         alt.Y(y_col, scale=alt.Scale(zero=False, padding=1)),
@@ -238,14 +280,63 @@ def multi_feat_scatter(data, filename, x_col, y_col, size_col, color_col, output
         labelColor='red',
         labelFontSize=14
     )
-    dir = os.getcwd()
-    altair_saver.save(chart, filename + ".html")
-    os.chdir(working_directory)
+    altair_saver.save(chart, os.path.join(output_folder_name, filename + ".html"))
+
+
+# Write data of altair charts as csv in the altair folder, once - the file is named by a hash of its content.
+# Returns the path of the file, charts refer to it by a url relative to their own folder (altair_data_url)
+def altair_dataset(data, name, output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_folder("altair")
+    content = data.to_csv(index=False)
+    file_name = name + "-" + hashlib.md5(content.encode("utf-8")).hexdigest()[0:8] + ".csv"
+    if not os.path.isfile(os.path.join(output_folder_name, file_name)):
+        with open(os.path.join(output_folder_name, file_name), "w", encoding="utf-8") as file1:
+            file1.write(content)
+    return os.path.join(output_folder_name, file_name)
+
+
+# Url of a data file for a chart saved in chart_folder_name - relative to the chart folder, so the output folder can
+# be moved or served as is, or a file url if they are on different drives
+def altair_data_url(data_file_name, chart_folder_name):
+    try:
+        return os.path.relpath(data_file_name, chart_folder_name).replace(os.sep, "/")
+    except ValueError:
+        return pathlib.Path(os.path.abspath(data_file_name)).as_uri()
+
+
+# Petal scatter plots (as multi_feat_scatter) of a shared dataset (data_url is the file of altair_dataset) side by
+# side, one for each value of type_col (with its title from type_titles), with size by value_col.
+# The cutoff top values of each type are removed as outliers by a filter in the chart, so charts of different cutoffs
+# are small specs which use the same data file. Browsers load the data file when the chart is served over http (for
+# example python -m http.server in the output folder), most of them block it for charts opened from disk
+def multi_feat_scatter_shared(data_url, filename, x_col, y_col, value_col, color_col, type_col, type_titles, cutoff=0,
+                              output_folder_name=None):
+    if output_folder_name is None:
+        output_folder_name = output_folder("altair")
+    data = alt.UrlData(url=altair_data_url(data_url, output_folder_name), format=alt.CsvDataFormat(type="csv"))
+    charts = []
+    for emission_type, title in type_titles.items():
+        chart = alt.Chart(data, title=title).transform_filter(
+            alt.datum[type_col] == emission_type
+        ).transform_window(
+            rank="row_number()", sort=[alt.SortField(value_col, order="descending")]
+        ).transform_filter(
+            alt.datum.rank > cutoff
+        ).mark_circle().encode(
+            alt.X(x_col + ":N", scale=alt.Scale(zero=False)),
+            alt.Y(y_col + ":N", scale=alt.Scale(zero=False, padding=1)),
+            color=color_col + ":N",
+            size=value_col + ":Q"
+        )
+        charts.append(chart)
+    altair_saver.save(alt.hconcat(*charts), os.path.join(output_folder_name, filename + ".html"))
 
 
 # Violin plot for multiple series - two series on one violin
 def violin_emissions(data, x_col, y_col, hue, split, figure_name, fig_title, is_x_rtl=False):
-    ax = sns.violinplot(x=x_col, y=y_col, hue=hue, split=split, data=data, palette="Set2")
+    order = list(pd.unique(data[x_col].dropna()))  # Order of appearance, also for categorical columns
+    ax = sns.violinplot(x=x_col, y=y_col, hue=hue, split=split, data=data, palette="Set2", order=order)
     # y axis label and ticks
     # ax.set_yscale("log")
     # label_yaxis = "סך פליטה (log Kg)"
@@ -272,43 +363,25 @@ def violin_emissions(data, x_col, y_col, hue, split, figure_name, fig_title, is_
 
 
 # Save folium map into designated folder
-def save_folium_map(map_plot, file_name, output_folder="Output_files"):
-    folium_map_folder = "map graphs - dots"
-    working_directory = os.getcwd()
-    directory = working_directory + "\\" + output_folder + "\\" + folium_map_folder
-    if not os.path.exists(directory):
-        if not os.path.exists(output_folder):
-            os.mkdir(output_folder)
-        os.chdir(output_folder)
-        if not os.path.exists(folium_map_folder):
-            os.mkdir(folium_map_folder)
-        os.chdir(folium_map_folder)
-    else:
-        os.chdir(directory)
-    map_plot.save(outfile=file_name + ".html")
-    dir = os.getcwd()
-    os.chdir(working_directory)
-    return dir
+def save_folium_map(map_plot, file_name):
+    directory = output_folder("folium")
+    map_plot.save(outfile=os.path.join(directory, file_name + ".html"))
+    return directory
 
 
 # Save geoviews map into designated folder
-def save_geoviews(map_plot, file_name, renderer, output_folder="Output_files"):
-    map_folder = "map graphs - circles"
-    working_directory = os.getcwd()
-    directory = working_directory + "\\" + output_folder + "\\" + map_folder
-    if not os.path.exists(directory):
-        if not os.path.exists(output_folder):
-            os.mkdir(output_folder)
-        os.chdir(output_folder)
-        if not os.path.exists(map_folder):
-            os.mkdir(map_folder)
-        os.chdir(map_folder)
-    else:
-        os.chdir(directory)
-    renderer.save(map_plot, file_name[0:40])
-    dir = os.getcwd()
-    os.chdir(working_directory)
-    return dir
+def save_geoviews(map_plot, file_name, renderer):
+    directory = output_folder("geoviews")
+    renderer.save(map_plot, os.path.join(directory, safe_file_name(file_name)))
+    return directory
+
+
+# File name cut to max_length characters. Cut names end with a hash of the full name, so different names never collide
+def safe_file_name(file_name, max_length=40):
+    if len(file_name) <= max_length:
+        return file_name
+    name_hash = hashlib.md5(file_name.encode("utf-8")).hexdigest()[0:8]
+    return file_name[0:max_length - 9] + "-" + name_hash
 
 
 # loop trough available colors for folium map
@@ -327,12 +400,22 @@ def color_looper_bokeh(number):
     return [color[number % len(color)] if len(color) - 1 < number else color[number]][0]
 
 
-# Create geoviews map with size according to industry
-def industry_size_map(data_list, data_values_list, industry_col):
+# Create geoviews map with size according to industry (or by size_col, times size_scale).
+# If single_document is True all the data values are drawn in one map with a selector (industry_selector_map),
+# (saved as file_name), instead of a map for each data value
+@traced
+def industry_size_map(data_list, data_values_list, industry_col, size_col=None, size_scale=10, single_document=False,
+                      file_name=None):
+    if size_col is None:
+        size_col = industry_col
+    if single_document:
+        industry_selector_map(data_list=data_list, data_values_list=data_values_list, industry_col=industry_col,
+                              size_col=size_col, size_scale=size_scale, file_name=file_name)
+        return
     for ind, data_df in enumerate(data_list):
         renderer = gv.renderer('bokeh')
         gv_points = gv.Points(data_df, ['longitude', 'latitude'],
-                              [industry_col, 'YeshuvAtarSvivatiMenifa'])
+                              list(dict.fromkeys([industry_col, 'YeshuvAtarSvivatiMenifa', size_col])))
         data_df.rename(columns={industry_col: ""})
         tooltips = [("Amount", "@" + industry_col),
                     ("Location", '@YeshuvAtarSvivatiMenifa')]
@@ -342,10 +425,57 @@ def industry_size_map(data_list, data_values_list, industry_col):
             opts.Points(width=400, height=700, alpha=0.3,
                         hover_line_color='black', color=color_looper_bokeh(ind),
                         line_color='black', xaxis=None, yaxis=None,
-                        tools=[hover], size=dim(industry_col) * 10,
+                        tools=[hover], size=dim(size_col) * size_scale,
                         hover_fill_color=None, hover_fill_alpha=0.5))
         dir = save_geoviews(map_plot=map_plot, file_name="map " + industry_col + "-" + data_values_list[ind],
-                            renderer=renderer, output_folder="Output_files")
+                            renderer=renderer)
+
+
+# Web mercator x and y (meters) of longitude and latitude, the coordinates of map tiles
+def web_mercator(longitude, latitude):
+    half_circumference = 20037508.34
+    x = np.asarray(longitude, dtype=float) * half_circumference / 180
+    y = np.log(np.tan((90 + np.asarray(latitude, dtype=float)) * np.pi / 360)) * half_circumference / np.pi
+    return x, y
+
+
+# One bokeh map of all the data values, with a selector showing the points of one data value at a time.
+# All points are in a single column data source, filtered by the selected value in the browser, so the map has one
+# tile layer and its size grows with the number of points only. Saved as file_name ("map " + industry_col if None)
+def industry_selector_map(data_list, data_values_list, industry_col, size_col=None, size_scale=10, file_name=None):
+    if size_col is None:
+        size_col = industry_col
+    if file_name is None:
+        file_name = "map " + industry_col
+    frames = []
+    for ind, data_df in enumerate(data_list):
+        frame = pd.DataFrame({"amount": data_df[industry_col].values,
+                              "location": data_df["YeshuvAtarSvivatiMenifa"].astype(str).values,
+                              "size": data_df[size_col].values * size_scale,
+                              "color": color_looper_bokeh(ind), "industry": str(data_values_list[ind])})
+        frame["x"], frame["y"] = web_mercator(data_df["longitude"].values, data_df["latitude"].values)
+        frames.append(frame)
+    points = pd.concat(frames, ignore_index=True)
+    source = ColumnDataSource(points)
+    industry_filter = GroupFilter(column_name="industry", group=str(data_values_list[0]))
+    view = CDSView(source=source, filters=[industry_filter])
+
+    map_plot = figure(width=400, height=700, x_axis_type="mercator", y_axis_type="mercator",
+                      tools="pan,wheel_zoom,reset,save")
+    map_plot.add_tile(WMTSTileSource(url=gvts.CartoLight.data))  # The tiles of the maps of each data value
+    map_plot.axis.visible = False
+    map_plot.grid.visible = False
+    circles = map_plot.circle(x="x", y="y", size="size", source=source, view=view, fill_color="color",
+                              fill_alpha=0.3, line_color="black", hover_line_color="black", hover_fill_alpha=0.5)
+    map_plot.add_tools(HoverTool(renderers=[circles], tooltips=[("Amount", "@amount"), ("Location", "@location")]))
+
+    selector = Select(title=industry_col, value=str(data_values_list[0]),
+                      options=[str(value) for value in data_values_list])
+    selector.js_on_change("value", CustomJS(args={"industry_filter": industry_filter, "source": source},
+                                            code="industry_filter.group = cb_obj.value; source.change.emit();"))
+    bokeh_save(column(selector, map_plot),
+               filename=os.path.join(output_folder("geoviews"), safe_file_name(file_name) + ".html"),
+               resources=CDN, title=file_name)
 
 
 # Save plotly map into designated folder
@@ -389,9 +519,52 @@ def industry_size_map(data_list, data_values_list, industry_col):
 #         fig.show()
 #         save_plotly_map(map_plot=fig, file_name=industry_col+"-"+data_values_list[ind])
 
+# One map point for each location of data_df (and city, if data has a city column), with the number of factories
+# (or of rows, if data has no site_col column) at the location
+def map_points(data_df, site_col="MisparTaagidShutfutMenifa", city_col="YeshuvAtarSvivatiMenifa"):
+    if site_col in data_df.columns:
+        data_df = data_df.drop_duplicates([site_col])
+    by = ["latitude", "longitude"] + [col for col in [city_col] if col in data_df.columns]
+    points = data_df.groupby(by, sort=False, observed=True).size().reset_index(name="count")
+    return points
+
+
+# GeoJson feature collection of map points, with their city and count as properties
+def map_points_geojson(points, city_col="YeshuvAtarSvivatiMenifa"):
+    cities = points[city_col] if city_col in points.columns else [""] * len(points)
+    features = [{"type": "Feature", "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+                 "properties": {"city": city, "count": int(count)}}
+                for latitude, longitude, city, count in zip(points["latitude"], points["longitude"], cities,
+                                                            points["count"])]
+    return {"type": "FeatureCollection", "features": features}
+
+
+# Map layer with one circle for each map point, as a single GeoJson layer, or clustered in the browser
+# (a single array of points and one marker callback) if cluster is True
+def map_points_layer(points, color, name, cluster=False):
+    if cluster:
+        callback = """function (row) {
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+                                        {radius: 5, fill: true, color: '%s', fillColor: '%s'});
+            marker.bindTooltip(row[2] + ': ' + row[3]);
+            return marker;
+        }""" % (color, color)
+        rows = points[["latitude", "longitude"]].copy()
+        rows["city"] = points["YeshuvAtarSvivatiMenifa"] if "YeshuvAtarSvivatiMenifa" in points.columns else ""
+        rows["count"] = points["count"]
+        return FastMarkerCluster(data=rows.values.tolist(), callback=callback, name=name)
+    return folium.GeoJson(map_points_geojson(points), name=name,
+                          marker=folium.CircleMarker(radius=5, fill=True, fill_color=color, color=color),
+                          tooltip=folium.GeoJsonTooltip(fields=["city", "count"]))
+
+
 # Create folium map
 # TODO: HTML labling doesn't work (commented out)
-def industry_map(data_list, data_values_list, industry_col):
+# Points are deduplicated to one per location with factory counts and drawn as one layer if bulk is True,
+# which keeps the saved map small. Otherwise a marker is added for each row.
+# cluster groups near points into clusters in the browser (bulk only)
+@traced
+def industry_map(data_list, data_values_list, industry_col, bulk=True, cluster=False):
     for ind, data_df in enumerate(data_list):
         # Create empty map
         map_f = folium.Map(
@@ -418,12 +591,16 @@ def industry_map(data_list, data_values_list, industry_col):
         color = color_looper_folium(ind)
         # legend_html = legend_html + html_marker.format(industry_name=data_values_list[ind], marker_color=color)
 
-        # The following lines only work for plotting all data points at once
-        data_df.apply(
-            lambda row: folium.CircleMarker(location=[row["latitude"], row["longitude"]], radius=5, fill=True,
-                                            # Set fill to True
-                                            fill_color=color,
-                                            color=color, ).add_to(map_f), axis=1)
+        if bulk:
+            map_points_layer(points=map_points(data_df), color=color, name=str(data_values_list[ind]),
+                             cluster=cluster).add_to(map_f)
+        else:
+            # The following lines only work for plotting all data points at once
+            data_df.apply(
+                lambda row: folium.CircleMarker(location=[row["latitude"], row["longitude"]], radius=5, fill=True,
+                                                # Set fill to True
+                                                fill_color=color,
+                                                color=color, ).add_to(map_f), axis=1)
 
         # Finish legend and display it
         # html_end = "</div>"
@@ -451,7 +628,7 @@ def waste_graph(data):
     data = shorten_name(dataframe=data, cols=["ShemAtarSvivatiMenifa"], how_short=40)
     pv_factories = pd.pivot_table(data=data,
                                   values=["total_waste", "total_non_dangerous_waste", "total_dangerous_waste"],
-                                  index=["ShemAtarSvivatiMenifa"], aggfunc=np.sum)
+                                  index=["ShemAtarSvivatiMenifa"], aggfunc=np.sum, observed=True)
     pv_factories = pv_factories.reset_index()
     pv_factories = pv_factories.sort_values(by=["total_waste"], ascending=False)
     # Scaling